@@ -0,0 +1,299 @@
+""" This module implements a persistent cache of parsed document
+vectors, keyed by the fingerprint of the engine that produced them
+and the arXiv ID of the document.
+
+"""
+
+import json
+import logging
+import os
+
+import numpy as np
+
+
+class EmbeddingCache:
+    """ Stores the vectors of parsed documents for one engine under
+    root/<fingerprint>/, as a raw, memory-mapped vector file with one
+    row per document and a text index of arXiv IDs, one per line.
+
+    The vector file is always written before the ID index, so the
+    number of complete lines in the index is the number of complete
+    rows; an interrupted write leaves at most some trailing bytes in
+    the vector file, or a partial last line in the index, both of which
+    are ignored when reading and overwritten by the next write. The
+    cache is safe to read from many processes, but only one process
+    should write at once.
+
+    Single vectors stored with put, e.g. by Document.parsed on a cache
+    miss once the cache is attached to its engine with
+    SimilarityEngine.attach_cache, are buffered in memory and written
+    buffer_size at a time, or when flush is called; the cache is also a
+    context manager that flushes on exit.
+
+    Parameters:
+        root (str): directory holding the caches of all engines.
+        fingerprint (str): fingerprint of the engine, see
+            SimilarityEngine.fingerprint.
+
+    Keyword arguments:
+        buffer_size (int): number of vectors stored with put to hold in
+            memory before writing them out.
+
+    """
+    def __init__(self, root, fingerprint, buffer_size=1000):
+        self.fingerprint = fingerprint
+        self.path = os.path.join(root, fingerprint)
+        os.makedirs(self.path, exist_ok=True)
+        self._meta_fname = os.path.join(self.path, 'meta.json')
+        self._vector_fname = os.path.join(self.path, 'vectors.bin')
+        self._id_fname = os.path.join(self.path, 'ids.txt')
+
+        self.dim = None
+        self.dtype = None
+        if os.path.isfile(self._meta_fname):
+            with open(self._meta_fname) as f:
+                meta = json.load(f)
+            self.dim = meta['dim']
+            self.dtype = np.dtype(meta['dtype'])
+
+        self._rows = {}
+        # the size of the complete lines of the ID index
+        self._id_size = 0
+        if os.path.isfile(self._id_fname):
+            with open(self._id_fname, 'rb') as f:
+                data = f.read()
+            self._id_size = data.rfind(b'\n') + 1
+            for row, line in enumerate(data[:self._id_size].decode().splitlines()):
+                self._rows[line] = row
+        self._vectors = None
+        self.buffer_size = buffer_size
+        self._pending = {}
+
+    @classmethod
+    def for_engine(cls, root, sim_engine, attach=True, **kwargs):
+        """ Open the cache for the given engine under root, and attach
+        it to the engine unless attach is False; other keyword arguments
+        are passed to the constructor.
+
+        """
+        cache = cls(root, sim_engine.fingerprint(), **kwargs)
+        if attach:
+            sim_engine.attach_cache(cache)
+        return cache
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.flush()
+
+    def __len__(self):
+        return len(self._rows) + len(self._pending)
+
+    def __contains__(self, arxiv_id):
+        return arxiv_id in self._rows or arxiv_id in self._pending
+
+    @property
+    def vectors(self):
+        """ Read-only memory map of all cached vectors, one per row. """
+        if self._vectors is None and self._rows:
+            self._vectors = np.memmap(self._vector_fname, dtype=self.dtype, mode='r',
+                                      shape=(len(self._rows), self.dim))
+        return self._vectors
+
+    def get(self, arxiv_id):
+        """ Look up the cached vector of a document.
+
+        Parameters:
+            arxiv_id (str): the arXiv ID of the document.
+
+        Returns:
+            numpy.ndarray: the cached vector, or None if missing.
+
+        """
+        row = self._rows.get(arxiv_id)
+        if row is None:
+            return self._pending.get(arxiv_id)
+        return self.vectors[row]
+
+    def put(self, arxiv_id, vector):
+        """ Cache the vector of a single document, buffering it until
+        buffer_size vectors are pending or flush is called. Documents
+        without an arXiv ID are not cached.
+
+        """
+        if arxiv_id is None or arxiv_id in self:
+            return
+        if not isinstance(vector, np.ndarray) or vector.ndim != 1:
+            raise TypeError(f'Can only cache 1-D numpy vectors, not {type(vector).__name__}.')
+        self._pending[arxiv_id] = vector
+        if len(self._pending) >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        """ Write out the vectors buffered by put. """
+        if self._pending:
+            pending = self._pending
+            self._pending = {}
+            try:
+                self.put_many(list(pending), np.vstack(list(pending.values())))
+            except BaseException:
+                # keep the vectors buffered, so that the write can be retried
+                self._pending = {**pending, **self._pending}
+                raise
+
+    def put_many(self, arxiv_ids, vectors):
+        """ Append the vectors of several documents to the cache,
+        skipping any that are already cached.
+
+        Parameters:
+            arxiv_ids (:obj:`list` of :obj:`str`): the arXiv ID of each row.
+            vectors (numpy.ndarray): matrix of shape (len(arxiv_ids), dim).
+
+        """
+        vectors = np.asarray(vectors)
+        if vectors.ndim != 2 or vectors.shape[0] != len(arxiv_ids):
+            raise ValueError(f'Expected a matrix of {len(arxiv_ids)} vectors, got shape {vectors.shape}.')
+        if any(arxiv_id is None for arxiv_id in arxiv_ids):
+            raise ValueError('Cannot cache documents without an arXiv ID.')
+        if self._pending:
+            pending = self._pending
+            self._pending = {}
+            arxiv_ids = list(pending) + list(arxiv_ids)
+            vectors = np.concatenate([np.vstack(list(pending.values())), vectors])
+
+        if self.dim is None:
+            self.dim = vectors.shape[1]
+            self.dtype = vectors.dtype
+            tmp_fname = self._meta_fname + '.tmp'
+            with open(tmp_fname, 'w') as f:
+                json.dump({'dim': self.dim, 'dtype': self.dtype.str}, f)
+            os.replace(tmp_fname, self._meta_fname)
+        elif vectors.shape[1] != self.dim:
+            raise ValueError(f'Cannot cache vectors of dimension {vectors.shape[1]} '
+                             f'alongside vectors of dimension {self.dim}.')
+
+        new = [ind for ind, arxiv_id in enumerate(arxiv_ids) if arxiv_id not in self._rows]
+        if not new:
+            return
+        # guard against duplicates within the batch itself
+        new = list({arxiv_ids[ind]: ind for ind in new}.values())
+
+        mode = 'r+b' if os.path.isfile(self._vector_fname) else 'wb'
+        with open(self._vector_fname, mode) as f:
+            f.seek(len(self._rows) * self.dim * self.dtype.itemsize)
+            f.write(np.ascontiguousarray(vectors[new], dtype=self.dtype).tobytes())
+            f.truncate()
+            f.flush()
+            os.fsync(f.fileno())
+
+        # overwrite any partial last line left by an interrupted write
+        mode = 'r+b' if os.path.isfile(self._id_fname) else 'wb'
+        with open(self._id_fname, mode) as f:
+            f.seek(self._id_size)
+            data = ''.join(arxiv_ids[ind] + '\n' for ind in new).encode()
+            f.write(data)
+            f.truncate()
+        self._id_size += len(data)
+        for ind in new:
+            self._rows[arxiv_ids[ind]] = len(self._rows)
+
+        self._vectors = None
+
+
+def embed_documents(sim_engine, documents, cache, batch_size=1000, workers=None):
+    """ Parse every document that is not already in the cache and store
+    the results, committing one batch at a time so that an interrupted
+    run can be resumed by simply calling this function again.
+
+    Parameters:
+        sim_engine (SimilarityEngine): a fitted engine whose parsed
+            documents are dense vectors.
+        documents (iterable of :obj:`document.Document`): the documents
+            to embed, e.g. a stream over a whole collection.
+        cache (EmbeddingCache): the cache to fill.
+
+    Keyword arguments:
+        batch_size (int): number of documents per commit.
+        workers (int): number of processes to parse with, see
+            SimilarityEngine.document_parser.
+
+    Returns:
+        int: the number of newly-embedded documents.
+
+    """
+    batch = []
+    num_embedded = 0
+    with sim_engine.document_parser(workers=workers) as parser:
+        for document in documents:
+            if document.arxiv_id is None or document.arxiv_id in cache:
+                continue
+            batch.append(document)
+            if len(batch) >= batch_size:
+                cache.put_many([doc.arxiv_id for doc in batch], np.vstack(parser(batch)))
+                num_embedded += len(batch)
+                logging.info(f'Embedded {num_embedded} documents, {len(cache)} in cache.')
+                batch = []
+
+        if batch:
+            cache.put_many([doc.arxiv_id for doc in batch], np.vstack(parser(batch)))
+            num_embedded += len(batch)
+
+    logging.info(f'Embedded {num_embedded} documents, {len(cache)} in cache.')
+    return num_embedded
+
+
+def reembed_documents(sim_engine, documents, old_cache, cache, is_stale, batch_size=1000, workers=None):
+    """ Fill the cache of an updated engine from the cache of the engine
+    it was updated from, copying the vectors of unaffected documents and
+    parsing only the stale ones, e.g. those containing words whose
+    vectors changed (see GloveSimilarityEngine.is_stale). Like
+    embed_documents, this can be resumed after an interruption.
+
+    Parameters:
+        sim_engine (SimilarityEngine): the updated engine.
+        documents (iterable of :obj:`document.Document`): the documents to embed.
+        old_cache (EmbeddingCache): the cache of the engine before the update.
+        cache (EmbeddingCache): the cache of the updated engine.
+        is_stale (callable): takes a document, returns True if its old
+            vector cannot be reused.
+
+    Keyword arguments:
+        batch_size (int): number of documents per commit.
+        workers (int): number of processes to parse stale documents
+            with, see SimilarityEngine.document_parser.
+
+    Returns:
+        (int, int): the number of documents copied and re-parsed.
+
+    """
+    def commit(parser, batch, vectors):
+        stale = [ind for ind, vector in enumerate(vectors) if vector is None]
+        for ind, vector in zip(stale, parser([batch[ind] for ind in stale])):
+            vectors[ind] = vector
+        cache.put_many([doc.arxiv_id for doc in batch], np.vstack(vectors))
+        return len(stale)
+
+    batch = []
+    vectors = []
+    num_copied = 0
+    num_parsed = 0
+    with sim_engine.document_parser(workers=workers) as parser:
+        for document in documents:
+            if document.arxiv_id is None or document.arxiv_id in cache:
+                continue
+            if document.arxiv_id in old_cache and not is_stale(document):
+                vectors.append(old_cache.get(document.arxiv_id))
+                num_copied += 1
+            else:
+                vectors.append(None)
+            batch.append(document)
+            if len(batch) >= batch_size:
+                num_parsed += commit(parser, batch, vectors)
+                batch, vectors = [], []
+
+        if batch:
+            num_parsed += commit(parser, batch, vectors)
+
+    logging.info(f'Copied {num_copied} and re-parsed {num_parsed} documents into {cache.path}.')
+    return num_copied, num_parsed
@@ -1,47 +1,91 @@
 """ This module implements the Document class to store
-arXiv records.
+arXiv records, and the DocumentBatch class to store many
+of them column-wise.
 
 """
 
-import copy
+import types
+
+import numpy as np
+
+from pubstomp.text import normalise_whitespace
 
 
 class Document:
     """ Stores "documents", which are initially arXiv metadata,
     i.e. titles, abstracts, dates and subjects.
 
+    The record is neither copied nor modified: each field is read from
+    it the first time it is needed, through a read-only view.
+
+    Parameters:
+        json_doc (dict): the arXiv record, e.g. as returned by MongoDB.
+
     """
+    __slots__ = ('_record', '_arxiv_id', '_title', '_abstract',
+                 '_subjects', '_dates', '_parsed')
+
     def __init__(self, json_doc):
-        self._raw_json = copy.deepcopy(json_doc)
+        self._record = types.MappingProxyType(json_doc)
         self._arxiv_id = None
-        self._date_submitted = None
-        self._abstract = None
         self._title = None
+        self._abstract = None
+        self._subjects = None
+        self._dates = None
         self._parsed = None
 
+    @property
+    def record(self):
+        """ Read-only view of the underlying record. """
+        return self._record
+
     def parsed(self, sim_engine):
-        """ Parses the document for the given SimilarityEngine. """
+        """ Parses the document for the given SimilarityEngine, looking
+        first in the engine's persistent cache, if one is attached (see
+        SimilarityEngine.attach_cache) and the document has an arXiv ID.
+        Misses are added to the cache, which buffers them until
+        EmbeddingCache.flush.
+
+        """
         if self._parsed is None:
-            self._parsed = sim_engine.parse_document(self)
+            cache = sim_engine.cache
+            if self.arxiv_id is None:
+                cache = None
+            if cache is not None:
+                self._parsed = cache.get(self.arxiv_id)
+            if self._parsed is None:
+                self._parsed = sim_engine.parse_document(self)
+                if cache is not None:
+                    cache.put(self.arxiv_id, self._parsed)
         return self._parsed
 
+    def set_parsed(self, parsed):
+        """ Store a representation parsed elsewhere for the same engine,
+        e.g. in bulk by SimilarityEngine.parse_documents, to be returned
+        by later calls to parsed.
+
+        """
+        self._parsed = parsed
+
     @property
     def arxiv_id(self):
         """ Grabs the arXiv ID. """
         try:
             if self._arxiv_id is None:
-                self._arxiv_id = self._raw_json['arxiv_id']
+                self._arxiv_id = self._record['arxiv_id']
         except KeyError:
             print('Paper is missing arXiv ID.')
         return self._arxiv_id
 
     @property
     def abstract(self):
-        """ Gets longest item under the `description` key. """
+        """ Gets longest item under the `description` key, with
+        whitespace normalised.
+
+        """
         try:
             if self._abstract is None:
-                self._abstract = (max(self._raw_json['description'], key=len)
-                                  .replace("\n", " ").strip())
+                self._abstract = normalise_whitespace(max(self._record['description'], key=len))
         except KeyError:
             print('Paper is missing abstract!')
 
@@ -52,7 +96,102 @@ class Document:
         """ Grabs the title of the paper. """
         try:
             if self._title is None:
-                self._title = self._raw_json['title'].strip()
+                self._title = self._record['title'].strip()
         except KeyError:
             print('Paper is missing title!')
         return self._title
+
+    @property
+    def subjects(self):
+        """ Grabs the subjects of the paper, as a tuple. """
+        try:
+            if self._subjects is None:
+                self._subjects = tuple(self._record['subject'])
+        except KeyError:
+            print('Paper is missing subjects!')
+        return self._subjects
+
+    @property
+    def dates(self):
+        """ Grabs the dates of the paper's versions, as a tuple. """
+        try:
+            if self._dates is None:
+                self._dates = tuple(self._record['dates'])
+        except KeyError:
+            print('Paper is missing dates!')
+        return self._dates
+
+
+class DocumentBatch:
+    """ Stores the arXiv IDs and abstracts of many documents
+    column-wise, as an array of IDs and a single text buffer holding
+    every abstract back to back, with an array of offsets such that
+    abstract i is text[offsets[i]:offsets[i + 1]]. This avoids one
+    Python object per document for bulk workloads, e.g. embedding a
+    whole collection.
+
+    Parameters:
+        arxiv_ids (numpy.ndarray): the arXiv ID of each document.
+        offsets (numpy.ndarray): len(arxiv_ids) + 1 offsets into text.
+        text (str): the concatenated abstracts.
+
+    """
+    __slots__ = ('arxiv_ids', 'offsets', 'text')
+
+    def __init__(self, arxiv_ids, offsets, text):
+        if len(offsets) != len(arxiv_ids) + 1:
+            raise ValueError(f'Got {len(offsets)} offsets for {len(arxiv_ids)} documents.')
+        self.arxiv_ids = np.asarray(arxiv_ids)
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self.text = text
+
+    @classmethod
+    def from_documents(cls, documents):
+        """ Pack an iterable of Document into a batch. Missing IDs and
+        abstracts are stored as empty strings.
+
+        """
+        arxiv_ids = []
+        abstracts = []
+        for document in documents:
+            arxiv_ids.append(document.arxiv_id or '')
+            abstracts.append(document.abstract or '')
+        offsets = np.zeros(len(abstracts) + 1, dtype=np.int64)
+        np.cumsum([len(abstract) for abstract in abstracts], out=offsets[1:])
+        return cls(np.array(arxiv_ids, dtype=str), offsets, ''.join(abstracts))
+
+    @classmethod
+    def from_records(cls, records):
+        """ Pack an iterable of arXiv records into a batch. """
+        return cls.from_documents(Document(record) for record in records)
+
+    def __len__(self):
+        return len(self.arxiv_ids)
+
+    def abstract(self, ind):
+        """ Get the abstract of the ind-th document. """
+        return self.text[self.offsets[ind]:self.offsets[ind + 1]]
+
+    def abstracts(self):
+        """ Get the abstracts of every document, as a list. """
+        offsets = self.offsets.tolist()
+        return [self.text[start:stop] for start, stop in zip(offsets[:-1], offsets[1:])]
+
+    def __getitem__(self, key):
+        """ Get the ind-th document as a Document, or a contiguous
+        slice of the batch as a DocumentBatch sharing the same text.
+
+        """
+        if isinstance(key, slice):
+            start, stop, step = key.indices(len(self))
+            if step != 1:
+                raise ValueError('DocumentBatch only supports contiguous slices.')
+            stop = max(start, stop)
+            return DocumentBatch(self.arxiv_ids[start:stop], self.offsets[start:stop + 1], self.text)
+        if key < 0:
+            key += len(self)
+        return Document({'arxiv_id': str(self.arxiv_ids[key]), 'description': [self.abstract(key)]})
+
+    def __iter__(self):
+        for ind in range(len(self)):
+            yield self[ind]
@@ -3,56 +3,46 @@
 """ Random assorted shit. """
 
 
-def date_graph():
+def date_graph(snapshot_path=None, stats_path=None):
     """ Plot a cumulative graph of dates papers were added to
     the arXiv database.
 
+    Keyword arguments:
+        snapshot_path (str): count the papers of this offline snapshot
+            (see pubstomp.snapshot) rather than reading the statistics.
+        stats_path (str): the corpus statistics kept up to date by the
+            harvester (see pubstomp.stats), computed from the database
+            if missing; by default stats.DEFAULT_STATS_FNAME.
+
     """
-    import pymongo as pm
     import matplotlib
     matplotlib.use('Agg')
     import matplotlib.pyplot as plt
-    import os
     import numpy as np
-    import seaborn as sns
-    import json
-    from collections import defaultdict
 
-    if os.path.isfile('years.json'):
-        with open('years.json', 'r') as f:
-            years = json.load(f)
+    if snapshot_path is not None:
+        from pubstomp.snapshot import Snapshot
+        years = Snapshot(snapshot_path).year_counts()
 
     else:
-        db = pm.MongoClient().pubstomp.arXiv_v1
-        dates = db.find({}, {'dates': 1})
-        years = defaultdict(int)
-        bad_count = 0
-        for doc in dates:
-            try:
-                date_list = doc['dates']
-            except KeyError:
-                print(doc)
-                bad_count += 1
-                pass
-            year = int(min(date_list).strftime('%Y'))
-            years[year] += 1
+        from pubstomp.stats import CorpusStats, DEFAULT_STATS_FNAME
+        from pubstomp.store import get_collection
+        stats_path = DEFAULT_STATS_FNAME if stats_path is None else stats_path
+        years = CorpusStats.for_collection(stats_path, get_collection()).year_counts
 
+    years = {int(year): int(count) for year, count in years.items() if count}
     print(years)
-    with open('years.json', 'w') as f:
-        json.dump(years, f)
-
-    raw_years = list(years.keys())
-    raw_counts = list(years.items())
 
     fig = plt.figure()
     ax = fig.add_subplot(111)
 
-    ax.plot([int(key) for key in years], np.cumsum([years[key] for key in years]))
+    ax.plot(sorted(years), np.cumsum([years[key] for key in sorted(years)]))
     ax.set_xlabel('Year of submission')
     ax.set_ylabel('Cumulative number of papers')
-    ax.set_xticks([int(key) for key in years])
+    ax.set_xticks(sorted(years))
     plt.savefig('years.pdf')
 
 
 if __name__ == '__main__':
-    date_graph()
+    import sys
+    date_graph(snapshot_path=sys.argv[1] if len(sys.argv) > 1 else None)
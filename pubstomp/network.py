@@ -1,35 +1,306 @@
-""" This module iteratively creates a network of papers with edges
-based on their pair-wise similarities, in some really fun and cool
-way.
+""" This module creates sparse networks of papers, with edges between
+each paper and its most similar papers under a SimilarityEngine,
+i.e. a k-nearest-neighbour graph, or between every pair of papers
+whose similarity passes a threshold. The similarity matrix is scored
+one tile at a time and only the edges are kept, as COO arrays, so the
+full matrix is never held in memory.
 
 """
 
-import networkx
-import pymongo
-import copy
-from document import Document
-from spacy_similarity import SpacySimilarity
+import argparse
 
-def create_sampled_network(num_samples=10):
-    """ Iterate over mongo cursor and create network on the fly.
+import numpy as np
+import scipy.sparse
+
+from pubstomp.similarity.quantize import dequantize
+
+GRAPH_FORMAT_VERSION = 1
+
+
+def node_dtype(num_nodes):
+    """ The smallest integer type that can index num_nodes nodes. """
+    return np.int32 if num_nodes < np.iinfo(np.int32).max else np.int64
+
+
+def sparse_edges(score_tile, num_nodes, k=None, threshold=None, block_size=1024):
+    """ Find the edges of a kNN and/or threshold graph, scoring the
+    similarity matrix one (block_size, block_size) tile at a time and
+    keeping only the best k scores of each row seen so far. Self-loops
+    are never included.
+
+    Parameters:
+        score_tile (callable): score_tile(row_start, row_stop, col_start,
+            col_stop) returns the similarity of nodes row_start:row_stop
+            to nodes col_start:col_stop as a new array.
+        num_nodes (int): the number of nodes.
+
+    Keyword arguments:
+        k (int): the number of out-edges of each node, to its k most
+            similar nodes. If None, keep every edge passing threshold.
+        threshold (float): drop edges with a lower similarity.
+        block_size (int): number of nodes per tile side.
+
+    Returns:
+        (numpy.ndarray, numpy.ndarray, numpy.ndarray): the source and
+            target node and float32 similarity of each edge, ordered by
+            source and then, for kNN graphs, by descending similarity.
 
     """
-    cursor = list(pymongo.MongoClient(serverSelectionTimeoutMS=1000).pubstomp.arXiv_v1.aggregate([{'$sample': {'size': num_samples}}]))
-    graph = networkx.Graph()
-    for ind, doc in enumerate(cursor):
-        doc = Document(doc)
-        graph.add_node(ind, arxiv_id=doc.arxiv_id)
-        for jnd, _doc in enumerate(cursor):
-            _doc = Document(_doc)
-            if ind == jnd:
+    if k is None and threshold is None:
+        raise ValueError('At least one of k or threshold is required.')
+
+    dtype = node_dtype(num_nodes)
+    width = num_nodes - 1 if k is None else min(k, num_nodes - 1)
+    if width <= 0:
+        return np.empty(0, dtype=dtype), np.empty(0, dtype=dtype), np.empty(0, dtype=np.float32)
+
+    all_rows, all_cols, all_weights = [], [], []
+    for start in range(0, num_nodes, block_size):
+        stop = min(start + block_size, num_nodes)
+        if k is not None:
+            best_cols = np.full((stop - start, width), -1, dtype=np.intp)
+            best_scores = np.full((stop - start, width), -np.inf)
+
+        for col_start in range(0, num_nodes, block_size):
+            col_stop = min(col_start + block_size, num_nodes)
+            scores = np.array(score_tile(start, stop, col_start, col_stop), dtype=np.float64)
+            diagonal = np.arange(max(start, col_start), min(stop, col_stop))
+            scores[diagonal - start, diagonal - col_start] = -np.inf
+            if threshold is not None:
+                scores[scores < threshold] = -np.inf
+
+            if k is None:
+                rows, cols = np.nonzero(scores > -np.inf)
+                all_rows.append(rows + start)
+                all_cols.append(cols + col_start)
+                all_weights.append(scores[rows, cols])
                 continue
-            graph.add_node(jnd, arxiv_id=_doc.arxiv_id)
-            result = SpacySimilarity(doc, _doc).similarity
-            print(doc.arxiv_id, _doc.arxiv_id, result)
-            graph.add_edge(ind, jnd, similarity=result)
 
-    print(graph)
+            candidate_scores = np.concatenate([best_scores, scores], axis=1)
+            candidate_cols = np.concatenate(
+                [best_cols, np.broadcast_to(np.arange(col_start, col_stop), scores.shape)], axis=1)
+            best = np.argpartition(-candidate_scores, width - 1, axis=1)[:, :width]
+            best_scores = np.take_along_axis(candidate_scores, best, axis=1)
+            best_cols = np.take_along_axis(candidate_cols, best, axis=1)
+
+        if k is not None:
+            order = np.argsort(-best_scores, axis=1, kind='stable')
+            best_scores = np.take_along_axis(best_scores, order, axis=1)
+            best_cols = np.take_along_axis(best_cols, order, axis=1)
+            keep = best_scores > -np.inf
+            all_rows.append(np.nonzero(keep)[0] + start)
+            all_cols.append(best_cols[keep])
+            all_weights.append(best_scores[keep])
+
+    return (np.concatenate(all_rows).astype(dtype),
+            np.concatenate(all_cols).astype(dtype),
+            np.concatenate(all_weights).astype(np.float32))
+
+
+class SimilarityGraph:
+    """ A directed similarity graph over a set of papers, with its
+    edges stored as COO arrays: edge i runs from node rows[i] to node
+    cols[i] with weight weights[i], and node n is the paper arxiv_ids[n].
+
+    Parameters:
+        arxiv_ids (:obj:`list` of :obj:`str`): the arXiv ID of each node.
+        rows (numpy.ndarray): the source node of each edge.
+        cols (numpy.ndarray): the target node of each edge.
+        weights (numpy.ndarray): the similarity of each edge.
+
+    """
+    def __init__(self, arxiv_ids, rows, cols, weights):
+        if not len(rows) == len(cols) == len(weights):
+            raise ValueError(f'Got {len(rows)} sources, {len(cols)} targets and {len(weights)} weights.')
+        self.arxiv_ids = np.asarray(arxiv_ids)
+        dtype = node_dtype(len(self.arxiv_ids))
+        self.rows = np.asarray(rows, dtype=dtype)
+        self.cols = np.asarray(cols, dtype=dtype)
+        self.weights = np.asarray(weights, dtype=np.float32)
+
+    @classmethod
+    def from_vectors(cls, arxiv_ids, vectors, k=10, threshold=None, block_size=1024):
+        """ Build the graph of documents whose parsed vectors are
+        compared by dot product, e.g. from a GloVe engine or the
+        embedding cache; see sparse_edges for the keyword arguments.
+
+        """
+        vectors = np.ascontiguousarray(vectors)
+
+        def score_tile(start, stop, col_start, col_stop):
+            return vectors[start:stop] @ vectors[col_start:col_stop].T
+
+        return cls(arxiv_ids, *sparse_edges(score_tile, len(vectors), k=k, threshold=threshold,
+                                            block_size=block_size))
+
+    @classmethod
+    def from_documents(cls, sim_engine, documents, k=10, threshold=None, block_size=1024, workers=None):
+        """ Build the graph of a list of documents under any engine. The
+        documents are parsed once, over several processes if workers is
+        set. If the engine parses documents into vectors, they are
+        compared by blocked matrix products, otherwise the parsed
+        documents are kept on each Document and every tile is scored with
+        SimilarityEngine.get_similarity_matrix.
+
+        Parameters:
+            sim_engine (SimilarityEngine): a fitted engine.
+            documents (:obj:`list` of :obj:`document.Document`): the
+                papers to connect.
+
+        Keyword arguments:
+            workers (int): number of processes to parse with.
+
+        Other keyword arguments are passed to sparse_edges.
+
+        """
+        documents = list(documents)
+        arxiv_ids = [document.arxiv_id for document in documents]
+        parsed = sim_engine.parse_documents(documents, workers=workers)
+        if parsed and all(isinstance(vector, np.ndarray) and vector.ndim == 1 for vector in parsed):
+            return cls.from_vectors(arxiv_ids, np.vstack(parsed), k=k, threshold=threshold,
+                                    block_size=block_size)
+        for document, parsed_document in zip(documents, parsed):
+            document.set_parsed(parsed_document)
+
+        def score_tile(start, stop, col_start, col_stop):
+            return sim_engine.get_similarity_matrix(documents[start:stop], documents[col_start:col_stop])
+
+        return cls(arxiv_ids, *sparse_edges(score_tile, len(documents), k=k, threshold=threshold,
+                                            block_size=block_size))
+
+    @classmethod
+    def from_index(cls, index, k=10, threshold=None):
+        """ Build the kNN graph of every document in a
+        NearestNeighbourIndex by querying the index with each of its own
+        rows, e.g. an approximate IVFIndex for corpora too large to scan
+        exhaustively for every node.
+
+        Parameters:
+            index (NearestNeighbourIndex): the index to query.
+
+        Keyword arguments:
+            k (int): the number of out-edges of each node.
+            threshold (float): drop edges with a lower similarity.
+
+        """
+        rows_of = {str(arxiv_id): row for row, arxiv_id in enumerate(index.arxiv_ids)}
+        rows, cols, weights = [], [], []
+        for row, arxiv_id in enumerate(index.arxiv_ids):
+            scales = None if index.scales is None else index.scales[row:row + 1]
+            vector = dequantize(index.vectors[row:row + 1], scales)[0]
+            for neighbour, score in index.query_vector(vector, k=k, exclude=str(arxiv_id)):
+                if threshold is None or score >= threshold:
+                    rows.append(row)
+                    cols.append(rows_of[neighbour])
+                    weights.append(score)
+        return cls(index.arxiv_ids, rows, cols, weights)
+
+    @property
+    def num_nodes(self):
+        return len(self.arxiv_ids)
+
+    @property
+    def num_edges(self):
+        return len(self.rows)
+
+    def __repr__(self):
+        return f'{type(self).__name__}({self.num_nodes} nodes, {self.num_edges} edges)'
+
+    def to_scipy(self):
+        """ The weighted adjacency matrix, as a scipy.sparse.coo_matrix. """
+        return scipy.sparse.coo_matrix((self.weights, (self.rows, self.cols)),
+                                       shape=(self.num_nodes, self.num_nodes))
+
+    def to_networkx(self, directed=False):
+        """ Convert the graph to networkx, with each node's arXiv ID
+        under the 'arxiv_id' attribute and each edge's weight under
+        'similarity'.
+
+        Keyword arguments:
+            directed (bool): return a networkx.DiGraph, rather than a
+                networkx.Graph in which an edge found in both directions
+                is kept once.
+
+        """
+        import networkx
+        graph = networkx.DiGraph() if directed else networkx.Graph()
+        graph.add_nodes_from((node, {'arxiv_id': str(arxiv_id)}) for node, arxiv_id in enumerate(self.arxiv_ids))
+        graph.add_weighted_edges_from(zip(self.rows.tolist(), self.cols.tolist(), self.weights.tolist()),
+                                      weight='similarity')
+        return graph
+
+    def save(self, fname):
+        """ Save the graph as a compact binary edge list, a .npz file
+        holding the node IDs and the COO arrays.
+
+        Parameters:
+            fname (str): the file to write.
+
+        """
+        with open(fname, 'wb') as f:
+            np.savez(f, format_version=GRAPH_FORMAT_VERSION, arxiv_ids=self.arxiv_ids.astype(str),
+                     rows=self.rows, cols=self.cols, weights=self.weights)
+
+    @classmethod
+    def load(cls, fname):
+        """ Load a graph written by save. """
+        with np.load(fname) as arrays:
+            if int(arrays['format_version']) != GRAPH_FORMAT_VERSION:
+                raise ValueError(f'Graph at {fname} has format version {int(arrays["format_version"])}, '
+                                 f'expected {GRAPH_FORMAT_VERSION}.')
+            return cls(arrays['arxiv_ids'], arrays['rows'], arrays['cols'], arrays['weights'])
+
+    def write_edgelist(self, fname):
+        """ Write the edges as text, one "arxiv_id arxiv_id similarity"
+        line per edge, as read by networkx.read_weighted_edgelist.
+
+        """
+        with open(fname, 'w') as f:
+            for row, col, weight in zip(self.rows.tolist(), self.cols.tolist(), self.weights.tolist()):
+                f.write(f'{self.arxiv_ids[row]} {self.arxiv_ids[col]} {weight:.6g}\n')
+
+
+def create_sampled_network(num_samples=1000, k=10, threshold=None, model_path=None, workers=None):
+    """ Sample documents from the database and connect each to its k
+    most similar documents.
+
+    Keyword arguments:
+        num_samples (int): number of documents to sample.
+        k (int): number of out-edges per document, or None for a pure
+            threshold graph.
+        threshold (float): drop edges with a lower similarity.
+        model_path (str): directory of a GloVe engine saved with
+            SimilarityEngine.save; by default one is trained on the sample.
+        workers (int): number of processes to parse with.
+
+    Returns:
+        SimilarityGraph: the graph of the sample.
+
+    """
+    from pubstomp.store import get_collection, sample_documents
+    from pubstomp.similarity import GloveSimilarityEngine
+    documents = sample_documents(get_collection(serverSelectionTimeoutMS=1000), num_samples)
+    if model_path is None:
+        sim_engine = GloveSimilarityEngine(documents)
+    else:
+        sim_engine = GloveSimilarityEngine.load(model_path)
+    return SimilarityGraph.from_documents(sim_engine, documents, k=k, threshold=threshold, workers=workers)
 
 
 if __name__ == '__main__':
-    create_sampled_network(num_samples=10)
+    parser = argparse.ArgumentParser(description='Create a sparse similarity graph of sampled papers.')
+    parser.add_argument('--num_samples', default=1000, type=int, help='number of papers to sample')
+    parser.add_argument('--k', default=10, type=int, help='number of neighbours per paper, 0 for none')
+    parser.add_argument('--threshold', default=None, type=float, help='minimum similarity of an edge')
+    parser.add_argument('--model', default=None, help='directory of a saved GloVe engine')
+    parser.add_argument('--workers', default=None, type=int, help='number of processes to parse with')
+    parser.add_argument('--output', default='graph.npz', help='file to save the graph to')
+    parser.add_argument('--edgelist', default=None, help='also write a text edge list to this file')
+    args = parser.parse_args()
+
+    graph = create_sampled_network(num_samples=args.num_samples, k=args.k or None, threshold=args.threshold,
+                                   model_path=args.model, workers=args.workers)
+    print(graph)
+    graph.save(args.output)
+    if args.edgelist is not None:
+        graph.write_edgelist(args.edgelist)
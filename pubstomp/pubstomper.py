@@ -4,21 +4,53 @@ arXiv papers with various methods/representations.
 
 """
 
-import pymongo as pm
 import numpy as np
-import seaborn as sns
-import matplotlib.pyplot as plt
-from pubstomp.document import Document
-from pubstomp.similarity import GloveSimilarityEngine, DummySimilarityEngine
+from pubstomp.similarity import get_engine_class
+from pubstomp.similarity.similarity import unpack_triangle
 import argparse
+import os
 
 
-def pub_stomp(num_train_documents, num_test_documents, engine_type, glove_dir):
+def sample_asymmetry(sim_engine, documents, num_samples, seed=0):
+    """ Diagnose whether an engine is symmetric, by evaluating the
+    similarity of randomly-sampled pairs of distinct documents in both
+    orders.
+
+    Parameters:
+        sim_engine (SimilarityEngine): the engine to check.
+        documents (:obj:`list` of :obj:`document.Document`): the documents
+            to sample pairs from.
+        num_samples (int): the number of pairs to sample.
+
+    Keyword arguments:
+        seed (int): seed for the random pairs.
+
+    Returns:
+        numpy.ndarray: array of shape (num_samples, 3) of the two row
+            indices of each pair and get_similarity(a, b) - get_similarity(b, a).
+
+    """
+    rng = np.random.default_rng(seed)
+    result = np.empty((num_samples, 3))
+    for sample in range(num_samples):
+        ind, jnd = rng.choice(len(documents), size=2, replace=False)
+        diff = (sim_engine.get_similarity(documents[ind], documents[jnd])
+                - sim_engine.get_similarity(documents[jnd], documents[ind]))
+        result[sample] = ind, jnd, diff
+    return result
+
+
+def pub_stomp(num_train_documents, num_test_documents, engine_type, glove_dir, model_path=None,
+              asymmetry_samples=0, cache_dir=None):
     """ Pull two samples of documents from the mongo and construct the
     similarity model on the training set of num_train_documents, then
     calculate pairwise similarities on the test set of
     num_test_documents.
 
+    The similarity matrix is always written to heatmap.dat; symmetric
+    engines also write its packed upper triangle to
+    similarities_packed.npy.
+
     Note:
         Assumes Mongo is accessible on localhost:27017.
 
@@ -28,38 +60,57 @@ def pub_stomp(num_train_documents, num_test_documents, engine_type, glove_dir):
 
     Keyword arguments:
         engine_type (str): the name of the similarity engine to use,
-            options are 'glove', 'spacy' or 'test'.
+            options are the keys of pubstomp.similarity.ENGINES,
+            'glove', 'bow', 'spacy', 'word_overlap' or 'test'.
+        model_path (str): directory of a saved engine; if it exists the
+            engine is loaded from it instead of being trained, otherwise
+            the newly-trained engine is saved there.
+        asymmetry_samples (int): if positive, sample this many pairs of
+            test documents and save the difference between their
+            similarities in each order, to check the symmetry of an engine.
+        cache_dir (str): root directory of the embedding caches; if set,
+            the parsed test documents are looked up in and added to the
+            cache of the engine.
 
     """
-    db = pm.MongoClient().pubstomp.arXiv_v0
+    from pubstomp.store import get_collection, sample_documents
+    db = get_collection('arXiv_v0')
+    engine_class = get_engine_class(engine_type)
 
-    training_sample = list(db.aggregate([{'$sample': {'size': num_train_documents}}]))
-    training_set = [Document(doc) for doc in training_sample]
+    if model_path is not None and os.path.isdir(model_path):
+        sim_engine = engine_class.load(model_path)
+    else:
+        training_set = sample_documents(db, num_train_documents)
+        if engine_type in ('glove', 'word_overlap'):
+            sim_engine = engine_class(training_set, glove_dir)
+        else:
+            sim_engine = engine_class(training_set)
+        if model_path is not None:
+            sim_engine.save(model_path)
 
-    test_sample = db.aggregate([{'$sample': {'size': num_test_documents}}])
-    test_set = [Document(doc) for doc in test_sample]
+    cache = None
+    if cache_dir is not None:
+        from pubstomp.cache import EmbeddingCache
+        cache = EmbeddingCache.for_engine(cache_dir, sim_engine)
 
-    if engine_type == 'test':
-        sim_engine = DummySimilarityEngine(training_set)
-    elif engine_type == 'glove':
-        sim_engine = GloveSimilarityEngine(training_set, glove_dir)
-    else:
-        raise NotImplementedError
-
-    heatmap = np.zeros((num_test_documents, num_test_documents))
-    asymmetry_diff = []
-    for ind, doc_a in enumerate(test_set):
-        for jnd, doc_b in enumerate(test_set):
-            if ind > jnd:
-                continue
-            similarity = sim_engine.get_similarity(doc_a, doc_b)
-            heatmap[ind, jnd] = similarity
-            similarity = sim_engine.get_similarity(doc_b, doc_a)
-            heatmap[jnd, ind] = similarity
-            asymmetry_diff.append(heatmap[ind, jnd] - heatmap[jnd, ind])
+    test_set = sample_documents(db, num_test_documents)
 
+    # symmetric engines only compute the upper triangle
+    if sim_engine.symmetric:
+        packed = sim_engine.get_packed_similarity_matrix(test_set)
+        np.save('similarities_packed.npy', packed)
+        heatmap = unpack_triangle(packed, len(test_set))
+    else:
+        heatmap = sim_engine.get_similarity_matrix(test_set)
     np.savetxt('heatmap.dat', heatmap)
-    np.savetxt('asymmetry_diff.dat', asymmetry_diff)
+
+    if asymmetry_samples > 0:
+        np.savetxt('asymmetry_diff.dat', sample_asymmetry(sim_engine, test_set, asymmetry_samples))
+    if cache is not None:
+        cache.flush()
+
+    import seaborn as sns
+    import matplotlib.pyplot as plt
     sns.heatmap(heatmap)
     plt.show()
 
@@ -70,6 +121,11 @@ if __name__ == '__main__':
     parser.add_argument('--num_test', nargs='?', help='num_test help', const=100, default=100, type=int)
     parser.add_argument('--engine', nargs='?', help='engine help', const='test', default='test')
     parser.add_argument('--glove_dir', nargs='?', help='glove_dir help')
+    parser.add_argument('--model', nargs='?', help='directory to load a trained engine from, or save it to')
+    parser.add_argument('--asymmetry_samples', default=0, type=int,
+                        help='number of random pairs to check the symmetry of the engine on')
+    parser.add_argument('--cache', nargs='?', help='root directory of the embedding caches')
     args = parser.parse_args()
     
-    pub_stomp(args.num_train, args.num_test, args.engine, args.glove_dir)
+    pub_stomp(args.num_train, args.num_test, args.engine, args.glove_dir, model_path=args.model,
+              asymmetry_samples=args.asymmetry_samples, cache_dir=args.cache)
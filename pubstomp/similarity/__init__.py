@@ -1,10 +1,65 @@
-""" Similarity methods. """
+""" Similarity methods.
 
-__all__ = ['SimilarityEngine', 'GloveSimilarityEngine', 'DummySimilarityEngine', 'SpacySimilarityEngine']
+Only the SimilarityEngine base class is imported with the package;
+every engine and index is imported from its module on first access,
+so that e.g. a worker that only needs GloVe vectors never imports
+scipy, spaCy or pymongo.
+
+"""
+
+import importlib
+
+__all__ = ['SimilarityEngine', 'GloveSimilarityEngine', 'DummySimilarityEngine', 'SpacySimilarityEngine',
+           'BagOfWordsSimilarityEngine', 'WordOverlapSimilarityEngine', 'NearestNeighbourIndex', 'IVFIndex',
+           'get_engine_class']
 __author__ = ['Matthew Evans', 'Will Grant', 'Liam Pattinson', 'Mark Johnson']
 __maintainer__ = ['Matthew Evans', 'Will Grant', 'Liam Pattinson', 'Mark Johnson']
 
 from pubstomp.similarity.similarity import SimilarityEngine
-from pubstomp.similarity.glove import GloveSimilarityEngine
-from pubstomp.similarity.dummy import DummySimilarityEngine
-from pubstomp.similarity.spacy import SpacySimilarityEngine
+
+# the module defining each lazily-imported name
+_LAZY_NAMES = {
+    'GloveSimilarityEngine': 'pubstomp.similarity.glove',
+    'DummySimilarityEngine': 'pubstomp.similarity.dummy',
+    'SpacySimilarityEngine': 'pubstomp.similarity.spacy',
+    'BagOfWordsSimilarityEngine': 'pubstomp.similarity.direct',
+    'WordOverlapSimilarityEngine': 'pubstomp.similarity.word_overlap',
+    'NearestNeighbourIndex': 'pubstomp.similarity.neighbours',
+    'IVFIndex': 'pubstomp.similarity.ivf',
+}
+
+# the class of each engine, by the name used on the command line
+ENGINES = {
+    'glove': 'GloveSimilarityEngine',
+    'bow': 'BagOfWordsSimilarityEngine',
+    'spacy': 'SpacySimilarityEngine',
+    'word_overlap': 'WordOverlapSimilarityEngine',
+    'test': 'DummySimilarityEngine',
+}
+
+
+def __getattr__(name):
+    if name not in _LAZY_NAMES:
+        raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+    value = getattr(importlib.import_module(_LAZY_NAMES[name]), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
+
+
+def get_engine_class(engine_type):
+    """ Import and return the engine class registered under a name.
+
+    Parameters:
+        engine_type (str): one of the keys of ENGINES, e.g. 'glove'.
+
+    Returns:
+        type: the SimilarityEngine subclass.
+
+    """
+    if engine_type not in ENGINES:
+        raise NotImplementedError(f'Unknown engine {engine_type}, expected one of {sorted(ENGINES)}.')
+    return __getattr__(ENGINES[engine_type])
@@ -1,16 +1,17 @@
-import re
 import collections
-from functools import reduce
 
 import numpy as np
-import pymongo as db
+import scipy.sparse
 
-from nltk.stem import PorterStemmer
-from nltk.tokenize import sent_tokenize, word_tokenize
+from pubstomp.similarity import SimilarityEngine
+from pubstomp.similarity.similarity import blocked_dot, packed_dot
+from pubstomp.similarity.neighbours import top_k
+from pubstomp.text import Tokenizer, NON_WORD_RE, stop_words
 
-with open("most_common.txt") as f:
-    most_common = f.readlines()
-most_common = [x.strip() for x in most_common]
+# lower-case, drop stop words and maths, then Porter-stem
+TOKENIZER = Tokenizer()
+# number of abstracts tokenised per call to Tokenizer.tokenize_batch
+TOKENIZE_BATCH_SIZE = 1000
 
 # ======================
 # Misc helper functions
@@ -19,8 +20,8 @@ def remove_most_common(s):
     """
     Given string of text, removes any words which feature in the list of 100 most common words
     """
-    wordlist = s.split()
-    return ' '.join([word for word in wordlist if not word in most_common])
+    most_common = stop_words()
+    return ' '.join([word for word in s.split() if word not in most_common])
 
 def remove_uniques(L):
     """
@@ -40,39 +41,45 @@ def remove_non_words(L):
     """
     Given list L of 'words', remove anything which looks more like punctuation, maths, etc.
     """
-    return [l for l in L if not re.search("""[0-9,;_:'"`~=()<>\\\|\+\[\]\{\}\.\$\*\^]""",l)]
+    return [l for l in L if not NON_WORD_RE.search(l)]
 
 # ======================
 # Bigger functions
 
 def get_abstracts(M=100):
     """
-    Accesses abstract database, returns list of first M abstracts.
+    Accesses abstract database, returns list of M randomly sampled abstracts.
     Abstracts are represented as a list of strings. Each list element is a single abstract.
     """
-    db_client = db.MongoClient()
-    papers = db_client.pubstomp.arXiv_v1.aggregate([{'$sample': {'size': M}}])
+    from pubstomp.store import get_collection, sample_documents
+    documents = sample_documents(get_collection(), M, fields=('description',))
+    return [document.abstract for document in documents]
 
-    abstracts = []
-    for i,paper in enumerate(papers):
-        abstracts.append(max(paper['description'],key=len))
-        if i == M-1:
-            break
-    return abstracts
+def abstract_to_tokens(abstract):
+    """
+    Converts an abstract to the list of useful words contained within it, keeping repeats
+    """
+    return TOKENIZER.tokenize(abstract)
+
+def abstracts_to_tokens(abstracts):
+    """
+    Converts an iterable of abstracts to lists of useful words, as abstract_to_tokens,
+    tokenising TOKENIZE_BATCH_SIZE abstracts per call
+    """
+    batch = []
+    for abstract in abstracts:
+        batch.append(abstract)
+        if len(batch) >= TOKENIZE_BATCH_SIZE:
+            yield from TOKENIZER.tokenize_batch(batch)
+            batch = []
+    if batch:
+        yield from TOKENIZER.tokenize_batch(batch)
 
 def all_abstracts_to_wordlist(abstract):
     """
     Converts all abstracts to a list of unique and useful words contained within them
     """
-    abstract = abstract.lower()
-    abstract = remove_most_common(abstract)
-    words = re.sub('\s+', ' ', abstract).strip() # replace all whitespaces with a single space
-    wordlist = word_tokenize(words)
-    # Stem -- remove suffixes etc. Uses simple Porter stemmer
-    stemmer = PorterStemmer()
-    wordlist = [stemmer.stem(w) for w in wordlist]
-    # Remove any words that contain dollar signs, backslashes, numerals, etc.
-    wordlist = remove_non_words(wordlist)
+    wordlist = abstract_to_tokens(abstract)
     # Remove any unique words (those that only appear once across all abstracts)
     wordlist = remove_uniques(wordlist)
     # Remove duplicates
@@ -84,48 +91,135 @@ def abstract_to_wordlist(abstract):
     Converts an abstract to a list of useful words contained within in
     Same as all_abstracts_to_wordlist, although it doesn't remove unique instances of words
     """
-    abstract = abstract.lower()
-    abstract = remove_most_common(abstract)
-    words = re.sub('\s+', ' ', abstract).strip() # replace all whitespaces with a single space
-    wordlist = word_tokenize(words)
-    # Stem -- remove suffixes etc. Uses simple Porter stemmer
-    stemmer = PorterStemmer()
-    wordlist = [stemmer.stem(w) for w in wordlist]
-    # Remove any words that contain dollar signs, backslashes, numerals, etc.
-    wordlist = remove_non_words(wordlist)
     # Remove duplicates
-    wordlist = remove_dupes(wordlist)
-    return wordlist
+    return remove_dupes(abstract_to_tokens(abstract))
 
 def get_word_space(abstracts):
     """
-    Given list of abstracts (see 'get_abstracts'), returns list of words that may be used to
-    classify them.
+    Given iterable of abstracts (see 'get_abstracts'), returns mapping from the words that may
+    be used to classify them to their column in word space.
+    Words are counted in a single pass over the abstracts, and any word that appears only once
+    across all abstracts is dropped.
+    """
+    return tokens_to_word_space(abstracts_to_tokens(abstracts))
+
+def tokens_to_word_space(token_lists):
+    """
+    Same as get_word_space, for abstracts that have already been tokenised (see
+    'abstracts_to_tokens')
     """
-    # Convert all abstracts to one long string
-    words = reduce((lambda x,y: x+y),abstracts)
-    wordlist = all_abstracts_to_wordlist(words)
+    counts = collections.Counter()
+    for tokens in token_lists:
+        counts.update(tokens)
     # Create mapping
-    return dict([[v,k] for k,v in enumerate(wordlist)])
+    wordlist = [word for word, count in counts.items() if count > 1]
+    return {word: i for i, word in enumerate(wordlist)}
+
+def to_document_term_matrix(abstracts,wordmap):
+    """
+    Converts an iterable of abstracts to a sparse binary matrix in 'word space'
+    Returns a scipy.sparse.csr_matrix of shape ( num_abstracts, num_features)
+    """
+    return tokens_to_document_term_matrix(abstracts_to_tokens(abstracts), wordmap)
+
+def tokens_to_document_term_matrix(token_lists,wordmap):
+    """
+    Same as to_document_term_matrix, for abstracts that have already been tokenised (see
+    'abstracts_to_tokens')
+    """
+    indptr = [0]
+    indices = []
+    for tokens in token_lists:
+        indices.extend(wordmap[w] for w in set(tokens) if w in wordmap)
+        indptr.append(len(indices))
+    indices = np.array(indices, dtype=np.int32)
+    data = np.ones(len(indices), dtype=np.float32)
+    matrix = scipy.sparse.csr_matrix((data, indices, np.array(indptr)),
+                                     shape=(len(indptr) - 1, len(wordmap)))
+    matrix.sort_indices()
+    return matrix
 
 def to_word_space(abstract,wordmap):
     """
     Converts an abstract to a vector in 'word space'
-    Returns a numpy array
+    Returns a scipy.sparse.csr_matrix of shape (1, num_features)
     """
-    wordlist = abstract_to_wordlist(abstract)
-    intlist  = [wordmap[w] for w in wordlist if w in wordmap.keys()]
-    return np.array([1 if i in intlist else 0 for i in range(len(wordmap))])
+    return to_document_term_matrix([abstract],wordmap)
 
 def get_similarities(X,y):
     """
-    Takes matrix X of abstracts converted to vectors in word space
+    Takes sparse matrix X of abstracts converted to vectors in word space
     Shape: ( num_abstracts, num_features)
-    Takes vector y in word space
+    Takes vector y in word space, either dense or as a sparse (1, num_features) row
     Returns vector of similarities
     """
+    if scipy.sparse.issparse(y):
+        y = y.toarray().ravel()
     return X@y
-    
+
+def get_similarity_matrix(X,Y=None):
+    """
+    Takes matrix X of abstracts converted to vectors in word space
+    Shape: ( num_abstracts, num_features)
+    Takes optional matrix Y of other abstracts in word space, otherwise compares X with itself
+    Returns matrix of similarities between every pair of abstracts, computed blockwise
+    """
+    return blocked_dot(X,Y)
+
+# ======================
+# Similarity engine
+
+class BagOfWordsSimilarityEngine(SimilarityEngine):
+    """ Represents each abstract as a binary vector over the stemmed vocabulary of the
+    training documents, and measures similarity as the number of shared words.
+
+    Parameters:
+        documents (:obj:`list` of :obj:`document.Document`): documents to build the
+            vocabulary from.
+
+    """
+    symmetric = True
+
+    def __init__(self, documents):
+        # tokenise once, for both the vocabulary and the matrix
+        token_lists = list(abstracts_to_tokens(document.abstract for document in documents))
+        self.wordmap = tokens_to_word_space(token_lists)
+        self.data = {'wordmap': self.wordmap,
+                     'matrix': tokens_to_document_term_matrix(token_lists, self.wordmap)}
+
+    def _save_state(self):
+        """ Save the vocabulary, in column order. """
+        return {'words': list(self.wordmap)}, {}
+
+    def _load_state(self, params, arrays):
+        """ Rebuild the word mapping from the saved vocabulary. """
+        self.wordmap = {word: i for i, word in enumerate(params['words'])}
+        self.data = {'wordmap': self.wordmap}
+
+    def parse_document(self, document):
+        """ Convert the document to a sparse (1, num_features) row in word space. """
+        return to_word_space(document.abstract, self.wordmap)
+
+    def get_similarity(self, document_a, document_b):
+        """ Count the words shared by the two documents. """
+        return float(document_a.parsed(self).multiply(document_b.parsed(self)).sum())
+
+    def get_similarity_matrix(self, documents_a, documents_b=None):
+        """ Count the words shared by every pair of documents, with one sparse
+        document-term matrix per list.
+        """
+        X = scipy.sparse.vstack([doc.parsed(self) for doc in documents_a], format='csr')
+        if documents_b is None:
+            return get_similarity_matrix(X)
+        Y = scipy.sparse.vstack([doc.parsed(self) for doc in documents_b], format='csr')
+        return get_similarity_matrix(X, Y)
+
+    def get_packed_similarity_matrix(self, documents):
+        """ Count the words shared by every pair of documents, computing only
+        the upper triangle; see packed_dot.
+        """
+        return packed_dot(scipy.sparse.vstack([doc.parsed(self) for doc in documents], format='csr'))
+
 
 if __name__ == '__main__':
     num_abstracts = -1
@@ -137,18 +231,15 @@ if __name__ == '__main__':
     wordmap = get_word_space(abstracts)
     N = len(wordmap)   # Number of features
     print("Num features: ",N)
-    X = np.zeros((M,N))
-    for i,abstract in enumerate(abstracts):
-        X[i] = to_word_space(abstract,wordmap)
+    X = to_document_term_matrix(abstracts,wordmap)
 
     print("Reference paper:")
     print(abstracts[0])
-    y = to_word_space(abstracts[0],wordmap)
+    y = X[0]
     print("\n==============================\n")
     similarities = get_similarities(X,y)
     # Get top 10 (not counting self, which should give the maximum similarity
-    top_10 = sorted(range(len(similarities)), key=lambda i: similarities[i])[-11:-1]
-    top_10.reverse()
+    top_10 = top_k(similarities, 11)[1:]
     print("Your top 10 papers:")
     print(top_10)
     print("\n==============================\n")
@@ -1,41 +1,275 @@
 #!/usr/bin/env python
 
+import os
 import sys
-import pymongo
+import shutil
+import hashlib
+import concurrent.futures
 import json
-import subprocess
-import seaborn
-import matplotlib.pyplot as plt
 import numpy as np
 
 from pubstomp.similarity import SimilarityEngine
+from pubstomp.similarity.similarity import stack_vectors, blocked_dot, packed_dot, share_array, attach_array, DocumentParser
+from pubstomp.text import clean_for_glove
+from pubstomp.document import DocumentBatch
 
 class GloveSimilarityEngine(SimilarityEngine):
-  def __init__(self, documents, glove_dir):
+  symmetric = True
+
+  def __init__(self, documents, glove_dir=None, dtype='float32'):
     '''
-    Train the model.
+    Train the model, in-process unless glove_dir points to a build of
+    the reference GloVe binaries. Word vectors are float32, as in the
+    reference implementation, unless another dtype is given.
     '''
     abstracts = []
     for document in documents:
       string = clean_abstract(document.abstract)
       abstracts.append({'string':string})
-    self.data = {'word_vectors': calculate_word_vectors(abstracts, glove_dir)}
+    self.set_word_vectors(calculate_word_vectors(abstracts, glove_dir, dtype=dtype))
+
+  def set_word_vectors(self, word_vectors):
+    '''
+    Use the given word vectors, see make_word_vectors.
+    '''
+    self.data = {'word_vectors': word_vectors}
     self.word_vectors = self.data['word_vectors']
+    self.vocab = self.word_vectors['index']
+    self.embeddings = self.word_vectors['vectors']
+    self._trainer = self.word_vectors.get('trainer')
+    self._fingerprint = None
+
+  def _saved_trainer_path(self):
+    '''
+    The directory of the trainer saved alongside a loaded model, if it
+    belongs to this engine's word vectors, else None.
+    '''
+    if self.model_path is None:
+      return None
+    path = os.path.join(self.model_path, 'trainer')
+    try:
+      with open(os.path.join(path, 'trainer.json')) as f:
+        saved_fingerprint = json.load(f)['fingerprint']
+    except FileNotFoundError:
+      return None
+    return path if saved_fingerprint == self.fingerprint() else None
+
+  @property
+  def trainer(self):
+    '''
+    The GloveTrainer of an engine trained in-process, or None. For a
+    loaded engine it is only read from the model directory on first use,
+    so that loading and parsing never touch the training state.
+    '''
+    if self._trainer is None:
+      path = self._saved_trainer_path()
+      if path is not None:
+        from pubstomp.similarity.glove_trainer import GloveTrainer
+        self._trainer = GloveTrainer.load(path, fingerprint=self.fingerprint())
+    return self._trainer
+
+  def update(self, documents, iterations=5, drift_tolerance=0.05):
+    '''
+    Fold new documents into the model without retraining from scratch,
+    warm-starting from the current word vectors; see GloveTrainer.update.
+    Returns the set of words that were added or whose vectors moved by
+    more than drift_tolerance, to pass to is_stale.
+
+    The update changes the fingerprint, so an attached embedding cache
+    is flushed and replaced by the (initially empty) cache of the
+    updated engine under the same root; see
+    pubstomp.cache.reembed_documents to fill it from the old one.
+    '''
+    if self.trainer is None:
+      raise RuntimeError('Only engines trained in-process can be updated.')
+    old_cache = self.cache
+    if old_cache is not None:
+      old_cache.flush()
+      self.attach_cache(None)
+    changed_words = self.trainer.update((clean_abstract(document.abstract) for document in documents),
+                                        iterations=iterations,
+                                        drift_tolerance=drift_tolerance)
+    word_vectors = make_word_vectors(self.trainer.vocab, self.trainer.counts(), self.trainer.params['vectors'],
+                                     dtype=self.embeddings.dtype)
+    word_vectors['trainer'] = self.trainer
+    self.set_word_vectors(word_vectors)
+    if old_cache is not None:
+      from pubstomp.cache import EmbeddingCache
+      EmbeddingCache.for_engine(os.path.dirname(old_cache.path), self, buffer_size=old_cache.buffer_size)
+    return changed_words
+
+  def is_stale(self, document, changed_words):
+    '''
+    Whether a document vector computed before an update needs to be
+    recomputed, i.e. whether the document contains any changed word.
+    '''
+    return not changed_words.isdisjoint(clean_abstract(document.abstract).split())
 
   def parse_document(self, document):
      '''
-     Parse a document.
+     Parse a document into its unit-normalised abstract vector.
      '''
-     abstract_abstract = make_abstract(document.abstract, self.word_vectors)
+     abstract_abstract = make_abstract(clean_abstract(document.abstract), self.word_vectors)
      vector = calculate_abstract_vector(abstract_abstract, self.word_vectors)
      return vector
 
+  def document_parser(self, workers=None, chunk_size=256):
+    '''
+    Parse documents over a pool of workers if workers > 1, see
+    GloveDocumentParser.
+    '''
+    if workers is None or workers <= 1:
+      return DocumentParser(self, workers=workers, chunk_size=chunk_size)
+    return GloveDocumentParser(self, workers=workers, chunk_size=chunk_size)
+
+  def _save_state(self):
+    '''
+    Save the vocabulary as a parameter and the word vectors as arrays.
+    The trainer is saved separately, see _save_artifacts.
+    '''
+    params = {'words':self.word_vectors['words']}
+    arrays = {name:self.word_vectors[name] for name in ('counts', 'vectors', 'norms')}
+    return params, arrays
+
+  def _save_artifacts(self, path):
+    '''
+    Save the trainer, if any, under path/trainer, copying it from the
+    model this engine was loaded from if it has not been read yet.
+    '''
+    if self._trainer is not None:
+      self._trainer.save(os.path.join(path, 'trainer'), fingerprint=self.fingerprint())
+    else:
+      saved_path = self._saved_trainer_path()
+      if saved_path is not None:
+        shutil.copytree(saved_path, os.path.join(path, 'trainer'))
+
+  def fingerprint(self):
+    '''
+    Hash the vocabulary and word vectors, which are all that parsing a
+    document depends on.
+    '''
+    if self._fingerprint is None:
+      digest = hashlib.sha1(type(self).__name__.encode())
+      digest.update(json.dumps(self.word_vectors['words']).encode())
+      digest.update(np.ascontiguousarray(self.embeddings).data)
+      self._fingerprint = digest.hexdigest()[:16]
+    return self._fingerprint
+
+  def _load_state(self, params, arrays):
+    '''
+    Rebuild the word vectors from saved state.
+    '''
+    words = params['words']
+    word_vectors = {'words':words,
+                    'index':{word:i for i, word in enumerate(words)}}
+    word_vectors.update({name:arrays[name] for name in ('counts', 'vectors', 'norms')})
+    self.set_word_vectors(word_vectors)
+
   def get_similarity(self, doca, docb):
     '''
     Get the similarity between two documents.
     '''
     return np.dot(doca.parsed(self), docb.parsed(self))
 
+  def get_similarity_matrix(self, docsa, docsb=None):
+    '''
+    Get the similarity between every pair of documents, as a single
+    blocked matrix product of the stacked abstract vectors.
+    '''
+    vectorsa = stack_vectors([doc.parsed(self) for doc in docsa])
+    if docsb is None:
+      return blocked_dot(vectorsa)
+    vectorsb = stack_vectors([doc.parsed(self) for doc in docsb])
+    return blocked_dot(vectorsa, vectorsb)
+
+  def get_packed_similarity_matrix(self, docs):
+    '''
+    Get the similarity between every pair of documents, computing only
+    the upper triangle; see packed_dot. Subclasses that are not
+    symmetric, e.g. WordOverlapSimilarityEngine, raise ValueError.
+    '''
+    if not self.symmetric:
+      return super().get_packed_similarity_matrix(docs)
+    return packed_dot(stack_vectors([doc.parsed(self) for doc in docs]))
+
+class GloveDocumentParser(DocumentParser):
+  '''
+  Parses documents over a process pool. The word vectors and norms are
+  copied once into shared memory, which every worker attaches to, and
+  the workers write the abstract vectors of each chunk of documents
+  straight into a shared output matrix, so that neither the embedding
+  matrix nor the results are pickled.
+  '''
+  def __init__(self, sim_engine, workers, chunk_size=256):
+    super().__init__(sim_engine, workers=workers, chunk_size=chunk_size)
+    word_vectors = sim_engine.word_vectors
+    self._shared = []
+    specs = {}
+    for name in ('vectors', 'norms'):
+      shm, specs[name] = share_array(word_vectors[name])
+      self._shared.append(shm)
+    self.dim = word_vectors['vectors'].shape[1]
+    self.dtype = word_vectors['vectors'].dtype
+    self.pool = concurrent.futures.ProcessPoolExecutor(max_workers=workers,
+                                                       initializer=_init_parse_worker,
+                                                       initargs=(word_vectors['words'], specs))
+
+  def close(self):
+    '''
+    Shut down the pool and free the shared word vectors.
+    '''
+    self.pool.shutdown()
+    for shm in self._shared:
+      shm.close()
+      shm.unlink()
+    self._shared = []
+
+  def __call__(self, documents):
+    '''
+    Parse a batch of documents into their abstract vectors.
+    '''
+    if isinstance(documents, DocumentBatch):
+      abstracts = documents.abstracts()
+    else:
+      abstracts = [document.abstract for document in documents]
+    shm, spec = share_array(np.empty((len(abstracts), self.dim), dtype=self.dtype))
+    try:
+      futures = [self.pool.submit(_parse_chunk, spec, start, abstracts[start:start+self.chunk_size])
+                 for start in range(0, len(abstracts), self.chunk_size)]
+      for future in futures:
+        future.result()
+      vectors = np.ndarray((len(abstracts), self.dim), dtype=self.dtype, buffer=shm.buf).copy()
+    finally:
+      shm.close()
+      shm.unlink()
+    return list(vectors)
+
+# Word vectors attached by each parse worker, see _init_parse_worker.
+_worker_word_vectors = {}
+
+def _init_parse_worker(words, specs):
+  '''
+  Attach a parse worker to the shared word vectors.
+  '''
+  _worker_word_vectors['index'] = {word:i for i, word in enumerate(words)}
+  for name, spec in specs.items():
+    shm, _worker_word_vectors[name] = attach_array(spec)
+    _worker_word_vectors[name+'_shm'] = shm
+
+def _parse_chunk(output_spec, start, abstracts):
+  '''
+  Parse a chunk of abstracts in a worker, writing their vectors into
+  rows start onwards of the shared output matrix.
+  '''
+  shm, output = attach_array(output_spec)
+  try:
+    for ind, abstract in enumerate(abstracts):
+      abstract_abstract = make_abstract(clean_abstract(abstract), _worker_word_vectors)
+      output[start+ind] = calculate_abstract_vector(abstract_abstract, _worker_word_vectors)
+  finally:
+    del output
+    shm.close()
+
 def write_file(filename, lines):
   '''
   Write a file containing the given lines.
@@ -50,24 +284,18 @@ def read_file(filename):
 
 def clean_abstract(abstract):
   '''
-  Cleans up an abstract.
+  Cleans up an abstract, replacing line endings with spaces and
+  removing commas and full stops; see pubstomp.text.clean_for_glove.
   '''
+  return clean_for_glove(abstract)
 
-  # Replace line endings with spaces.
-  bad_characters = '\r\n'
-  for character in bad_characters:
-    abstract = abstract.replace(character, ' ')
-
-  # Remove bad characters.
-  bad_characters = ',.'
-  for character in bad_characters:
-    abstract = abstract.replace(character, '')
-
-  return abstract
-
-def calculate_word_vectors(abstracts, glove_dir):
+def calculate_word_vectors(abstracts, glove_dir=None, dtype='float32'):
   '''
   Takes a list of abstracts, and returns word vectors for them.
+  If glove_dir is None, the vectors are trained in-process with
+  glove_trainer, in the given dtype, and the GloveTrainer is kept under
+  the 'trainer' key so that the vectors can be updated later; otherwise
+  they are trained with the GloVe binaries in glove_dir.
   '''
 
   # Constants.
@@ -86,6 +314,19 @@ def calculate_word_vectors(abstracts, glove_dir):
   glove_max_iter = 15
   glove_binary = 2
 
+  if glove_dir is None:
+    from pubstomp.similarity.glove_trainer import GloveTrainer
+    trainer = GloveTrainer(min_count=vocab_min_count,
+                           window_size=cooccur_window_size,
+                           iterations=glove_max_iter,
+                           x_max=glove_x_max,
+                           dtype=np.dtype(dtype).name)
+    word_vectors = make_word_vectors(*trainer.fit(x['string'] for x in abstracts), dtype=dtype)
+    word_vectors['trainer'] = trainer
+    return word_vectors
+
+  import subprocess
+
   # Write out abstracts to file.
   write_file('abstracts.txt', [x['string'] for x in abstracts])
 
@@ -131,100 +372,79 @@ def calculate_word_vectors(abstracts, glove_dir):
   vocab_file = read_file('vocab.txt')
   vectors = read_file('vectors.txt')
 
-  word_vectors = []
+  words = []
+  counts = []
+  vects = []
   for vocab, vector in zip(vocab_file, vectors):
     if vocab[0]!=vector[0]:
       raise ValueError('FATAL ERROR: Process on node (7) caused SEGFAULT: 0x18395827')
-    word = vocab[0]
-    count = int(vocab[1])
-    vect = np.array([float(x) for x in vector[1:]])
-    norm = np.linalg.norm(vect)
-
-    # Divide the vector by its norm squared, to rank in order of importance.
-    vect = vect/norm**2
-    norm = 1/norm
-
-    word_vectors.append({'word':word,
-                         'count':count,
-                         'vector':vect,
-                         'norm':norm})
-
-  return sorted(word_vectors, key=lambda x:x['norm'], reverse=True)
-
-def calculate_word_overlaps(word_vectors):
-  output = []
-  for this in word_vectors:
-    output.append([])
-    for that in word_vectors:
-      output[-1].append(np.dot(this['vector'],that['vector']))
-  return np.array(output)
-
-def make_abstract(abstract,word_vectors):
-  words = abstract.split()
-  indices = []
-  norm = 0
-  for word in set(words):
-    try:
-      i = [x['word'] for x in word_vectors].index(word)
-      indices.append(i)
-      norm = norm + word_vectors[i]['norm']**2
-    except ValueError:
-      pass
-  output = {'string':abstract}
-  output['indices'] = indices
-  output['norm'] = np.sqrt(norm)
-  return output
+    words.append(vocab[0])
+    counts.append(int(vocab[1]))
+    vects.append(vector[1:])
 
-def calculate_abstract_vector(abstract,word_vectors):
-  output = sum([word_vectors[i]['vector'] for i in abstract['indices']])
-  output = output / np.linalg.norm(output)
-  return output
+  return make_word_vectors(words, counts, np.array(vects, dtype=np.float32), dtype=dtype)
 
-def get_overlap(this,that,word_overlaps):
+def make_word_vectors(words, counts, vectors, dtype='float32'):
   '''
-  Calculates the overlap between two abstracts, using the word vectors.
+  Takes a vocabulary, the count of each word and the (vocab, dim) matrix
+  of raw GloVe vectors, and returns the word vectors as a dict of:
+    'words': list of words, ordered by decreasing norm,
+    'index': dict mapping each word to its row,
+    'counts': array of word counts,
+    'vectors': (vocab, dim) matrix of word vectors, float32 by default,
+    'norms': array of word norms.
   '''
-  if len(this['indices'])>len(that['indices']):
-    return get_overlap(that,this,word_overlaps)
+  vectors = np.asarray(vectors, dtype=dtype)
+  norms = np.linalg.norm(vectors, axis=1)
 
-  matrix = []
-  for i in this['indices']:
-    matrix.append([])
-    for j in that['indices']:
-      matrix[-1].append(word_overlaps[i][j])
+  # Divide each vector by its norm squared, to rank in order of importance.
+  vectors = vectors/norms[:, None]**2
+  norms = 1/norms
 
-  norm = this['norm']*that['norm']
+  order = np.argsort(-norms, kind='stable')
+  words = [words[i] for i in order]
+  return {'words':words,
+          'index':{word:i for i, word in enumerate(words)},
+          'counts':np.asarray(counts)[order],
+          'vectors':np.ascontiguousarray(vectors[order]),
+          'norms':norms[order]}
 
-  return sum([max(line) for line in matrix]) / norm
+def make_abstract(abstract,word_vectors):
+  index = word_vectors['index']
+  indices = np.fromiter((index[word] for word in set(abstract.split()) if word in index),
+                        dtype=np.intp)
+  output = {'string':abstract}
+  output['indices'] = indices
+  output['norm'] = np.sqrt(np.sum(word_vectors['norms'][indices]**2))
+  return output
+
+def calculate_abstract_vector(abstract,word_vectors):
+  output = word_vectors['vectors'][abstract['indices']].sum(axis=0)
+  norm = np.linalg.norm(output)
+  if norm == 0:
+    return output
+  return output / norm
 
 def main():
   '''
   Does stuff as what Mark wrote.
   '''
+  import seaborn
+  import matplotlib.pyplot as plt
+  from pubstomp.store import get_collection, iter_documents
 
   # Constants.
   no_entries = 3000
 
-  # Set up data getter from server.
-  client = pymongo.MongoClient()
-  data_getter = client.pubstomp.arXiv_v1.find()
-
-  # Grab the first no_entries entries.
-  data = []
-  for i,entry in enumerate(data_getter):
-    if i>=no_entries:
-      break
-    data.append(entry)
+  # Stream the abstracts of the first no_entries entries from the server.
+  documents = iter_documents(get_collection(), fields=('description',), limit=no_entries)
 
   # Extract abstracts.
   # The abstract is the longest string in each description.
   abstracts = []
-  for datum in data:
-    try:
-      string = clean_abstract(max(datum['description'],key=len))
-      abstracts.append({'string':string})
-    except KeyError('description'):
-      pass
+  for document in documents:
+    if document.abstract is not None:
+      abstracts.append({'string':clean_abstract(document.abstract)})
 
   # Calculate word vectors from abstracts.
   word_vectors = calculate_word_vectors(abstracts)
@@ -232,12 +452,6 @@ def main():
   print()
   print('Generated word vectors')
 
-  # Calculate overlaps between words.
-  word_overlaps = calculate_word_overlaps(word_vectors)
-
-  print()
-  print('Generated word overlaps')
-
   # Convert abstracts into word lists.
   abstracts = [make_abstract(abstract, word_vectors) for abstract in abstracts]
 
@@ -247,17 +461,6 @@ def main():
   # Calculate abstract vectors.
   abstract_vectors = [calculate_abstract_vector(abstract, word_vectors) for abstract in abstracts]
 
-  '''
-  # Calculate overlap matrix.
-  overlaps = []
-  for i,abstracti in enumerate(abstracts):
-    overlaps.append([])
-    for j,abstractj in enumerate(abstracts):
-      overlap = get_overlap(abstracti, abstractj, word_overlaps)
-
-      overlaps[-1].append(overlap)
-  '''
-
   # Calculate overlap matrix.
   overlaps = []
   for i in abstract_vectors:
@@ -0,0 +1,448 @@
+""" This module implements an in-process GloVe trainer, following
+Pennington, Socher & Manning (2014) and the reference C implementation
+driven by glove.py: a vocabulary is counted, word-word co-occurrences
+within a window are accumulated (weighted by 1/distance) into a sparse
+matrix, and word vectors are fitted to the log co-occurrences with
+weighted least squares and AdaGrad, one vectorized minibatch of
+non-zero co-occurrences at a time.
+
+"""
+
+import collections
+import json
+import os
+
+import numpy as np
+import scipy.sparse
+
+
+def encode_abstracts(abstracts, min_count=2, counts=None):
+    """ Tokenise abstracts on whitespace in a single pass, counting the
+    vocabulary as it goes, then drop the words seen fewer than min_count
+    times.
+
+    Parameters:
+        abstracts (iterable of str): cleaned abstracts, e.g. from
+            glove.clean_abstract.
+
+    Keyword arguments:
+        min_count (int): minimum number of occurrences of a word.
+        counts (collections.Counter): counter to accumulate the counts
+            of every word into, including those below min_count.
+
+    Returns:
+        (:obj:`list` of :obj:`str`, numpy.ndarray, :obj:`list` of :obj:`numpy.ndarray`):
+            the vocabulary in order of decreasing count, the count of
+            each word, and each abstract as an array of vocabulary rows.
+
+    """
+    index = {}
+    if counts is None:
+        counts = collections.Counter()
+    encoded = []
+    for abstract in abstracts:
+        words = abstract.split()
+        counts.update(words)
+        encoded.append(np.fromiter((index.setdefault(word, len(index)) for word in words),
+                                   dtype=np.int32, count=len(words)))
+
+    vocab = sorted((word for word in index if counts[word] >= min_count),
+                   key=lambda word: (-counts[word], word))
+    # map the provisional first-seen ids onto the final vocabulary rows,
+    # with -1 for words below min_count, which are dropped entirely
+    remap = np.full(len(index), -1, dtype=np.int32)
+    remap[[index[word] for word in vocab]] = np.arange(len(vocab), dtype=np.int32)
+    encoded = [ids[ids >= 0] for ids in (remap[ids] for ids in encoded)]
+    return vocab, np.array([counts[word] for word in vocab]), encoded
+
+
+def build_cooccurrence(encoded, vocab_size, window_size=15, chunk_size=10000):
+    """ Accumulate the symmetric, distance-weighted co-occurrence matrix
+    of encoded abstracts; windows do not cross abstract boundaries.
+
+    Parameters:
+        encoded (:obj:`list` of :obj:`numpy.ndarray`): abstracts as
+            arrays of vocabulary rows.
+        vocab_size (int): number of words in the vocabulary.
+
+    Keyword arguments:
+        window_size (int): number of context words either side.
+        chunk_size (int): number of abstracts processed per sparse update.
+
+    Returns:
+        scipy.sparse.csr_matrix: the (vocab, vocab) co-occurrence matrix.
+
+    """
+    cooccurrence = scipy.sparse.csr_matrix((vocab_size, vocab_size), dtype=np.float64)
+    for start in range(0, len(encoded), chunk_size):
+        chunk = encoded[start:start + chunk_size]
+        if not chunk:
+            continue
+        ids = np.concatenate(chunk)
+        doc = np.repeat(np.arange(len(chunk)), [len(ids_) for ids_ in chunk])
+
+        rows, cols, weights = [], [], []
+        for distance in range(1, window_size + 1):
+            same_doc = doc[:-distance] == doc[distance:]
+            if not same_doc.any():
+                break
+            rows.append(ids[:-distance][same_doc])
+            cols.append(ids[distance:][same_doc])
+            weights.append(np.full(same_doc.sum(), 1 / distance))
+
+        if not rows:
+            continue
+        rows, cols, weights = np.concatenate(rows), np.concatenate(cols), np.concatenate(weights)
+        chunk_matrix = scipy.sparse.coo_matrix((weights, (rows, cols)), shape=(vocab_size, vocab_size)).tocsr()
+        cooccurrence = cooccurrence + chunk_matrix + chunk_matrix.T
+
+    return cooccurrence
+
+
+def train_glove(cooccurrence, vector_size=50, iterations=15, x_max=10, alpha=0.75,
+                learning_rate=0.05, batch_size=4096, seed=0, init=None, entries=None, dtype='float32'):
+    """ Fit GloVe word vectors to a co-occurrence matrix with AdaGrad.
+
+    Parameters:
+        cooccurrence (scipy.sparse.spmatrix): the (vocab, vocab) co-occurrence matrix.
+
+    Keyword arguments:
+        vector_size (int): dimension of the word vectors.
+        iterations (int): number of passes over the non-zero co-occurrences.
+        x_max (float): cut-off of the weighting function.
+        alpha (float): exponent of the weighting function.
+        learning_rate (float): initial AdaGrad learning rate.
+        batch_size (int): number of co-occurrences per vectorized update.
+        seed (int): seed for the initialisation and shuffling.
+        init (dict): parameters returned by a previous call to warm-start
+            from, already padded to the current vocabulary size.
+        entries (numpy.ndarray, numpy.ndarray): if given, the (word,
+            context) positions of the only co-occurrences to train on.
+        dtype (str): floating-point type of the parameters, float32 as in
+            the reference implementation.
+
+    Returns:
+        dict: the fitted parameters, with keys 'vectors' (the (vocab, dim)
+            sum of word and context vectors, as written by the reference
+            implementation), 'W', 'W_context', 'b', 'b_context',
+            the AdaGrad accumulators and the final 'cost'.
+
+    """
+    rng = np.random.default_rng(seed)
+    dtype = np.dtype(dtype)
+    vocab_size = cooccurrence.shape[0]
+    shape = (vocab_size, vector_size)
+    if init is not None:
+        params = {key: np.array(value) for key, value in init.items() if key not in ('vectors', 'cost')}
+    else:
+        # numpy can only draw float32 and float64, so draw float32 as the
+        # reference implementation does and cast
+        params = {'W': ((rng.random(shape, dtype=np.float32) - 0.5) / vector_size).astype(dtype),
+                  'W_context': ((rng.random(shape, dtype=np.float32) - 0.5) / vector_size).astype(dtype),
+                  'b': np.zeros(vocab_size, dtype=dtype),
+                  'b_context': np.zeros(vocab_size, dtype=dtype),
+                  'gradsq_W': np.ones(shape, dtype=dtype),
+                  'gradsq_W_context': np.ones(shape, dtype=dtype),
+                  'gradsq_b': np.ones(vocab_size, dtype=dtype),
+                  'gradsq_b_context': np.ones(vocab_size, dtype=dtype)}
+
+    if entries is None:
+        cooccurrence = cooccurrence.tocoo()
+        word, context, counts = cooccurrence.row, cooccurrence.col, cooccurrence.data
+    else:
+        word, context = entries
+        counts = np.asarray(cooccurrence.tocsr()[word, context]).ravel()
+
+    weighting = np.minimum(1.0, (counts / x_max) ** alpha).astype(dtype)
+    log_counts = np.log(counts).astype(dtype)
+
+    cost = 0.0
+    for _ in range(iterations):
+        cost = 0.0
+        order = rng.permutation(len(counts))
+        for start in range(0, len(order), batch_size):
+            batch = order[start:start + batch_size]
+            i, j = word[batch], context[batch]
+            w_i, w_j = params['W'][i], params['W_context'][j]
+            diff = np.einsum('ij,ij->i', w_i, w_j) + params['b'][i] + params['b_context'][j] - log_counts[batch]
+            fdiff = weighting[batch] * diff
+            cost += 0.5 * float(np.dot(fdiff, diff))
+
+            adagrad_step(params, 'W', i, fdiff[:, None] * w_j, learning_rate)
+            adagrad_step(params, 'W_context', j, fdiff[:, None] * w_i, learning_rate)
+            adagrad_step(params, 'b', i, fdiff, learning_rate)
+            adagrad_step(params, 'b_context', j, fdiff, learning_rate)
+
+    params['cost'] = cost / max(len(counts), 1)
+    params['vectors'] = params['W'] + params['W_context']
+    return params
+
+
+def adagrad_step(params, name, index, gradient, learning_rate):
+    """ Apply one AdaGrad update to the rows of params[name] touched by a
+    minibatch, summing the gradients of repeated rows first.
+
+    Parameters:
+        params (dict): the model parameters and their 'gradsq_' accumulators.
+        name (str): the parameter to update.
+        index (numpy.ndarray): the row of each gradient in the minibatch.
+        gradient (numpy.ndarray): one gradient per minibatch entry.
+        learning_rate (float): the AdaGrad learning rate.
+
+    """
+    order = np.argsort(index, kind='stable')
+    index = index[order]
+    starts = np.flatnonzero(np.concatenate(([True], index[1:] != index[:-1])))
+    rows = index[starts]
+    summed = np.add.reduceat(gradient[order], starts, axis=0)
+    gradsq = params['gradsq_' + name]
+    params[name][rows] -= learning_rate * summed / np.sqrt(gradsq[rows])
+    gradsq[rows] += summed ** 2
+
+
+def word_drift(old_vectors, new_vectors):
+    """ Measure how far each word vector moved in an update, as seen by
+    document vectors: documents are built from each raw vector divided
+    by its squared norm (see glove.make_word_vectors), so a change in
+    norm alone changes every document containing the word, and the
+    drift is the relative distance between these transformed vectors.
+
+    Parameters:
+        old_vectors (numpy.ndarray): the (vocab, dim) raw vectors before
+            the update.
+        new_vectors (numpy.ndarray): the raw vectors after the update.
+
+    Returns:
+        numpy.ndarray: ||new / |new|^2 - old / |old|^2|| / ||old / |old|^2||
+            for each word.
+
+    """
+    def transform(vectors):
+        norms = np.linalg.norm(vectors, axis=1)
+        return vectors / np.maximum(norms, 1e-12)[:, None]**2
+
+    old = transform(old_vectors)
+    return np.linalg.norm(transform(new_vectors) - old, axis=1) / np.maximum(np.linalg.norm(old, axis=1), 1e-12)
+
+
+class GloveTrainer:
+    """ Holds everything needed to keep a GloVe model up to date as new
+    abstracts arrive: the counts of every word seen, the vocabulary, the
+    accumulated co-occurrence matrix and the trainer parameters,
+    including the AdaGrad accumulators.
+
+    Keyword arguments:
+        min_count (int): minimum number of occurrences of a word.
+        window_size (int): number of context words either side.
+        Remaining keyword arguments are passed to train_glove.
+
+    Attributes:
+        self.vocab (:obj:`list` of :obj:`str`): the vocabulary, in row order.
+        self.word_counts (collections.Counter): count of every word seen.
+        self.cooccurrence (scipy.sparse.csr_matrix): the co-occurrence matrix.
+        self.params (dict): the parameters returned by train_glove.
+
+    """
+    def __init__(self, min_count=2, window_size=15, **kwargs):
+        self.min_count = min_count
+        self.window_size = window_size
+        self.train_kwargs = kwargs
+        self.vocab = []
+        self.word_counts = collections.Counter()
+        self.cooccurrence = None
+        self.params = None
+
+    def counts(self):
+        """ Return the count of each vocabulary word, in row order. """
+        return np.array([self.word_counts[word] for word in self.vocab])
+
+    def fit(self, abstracts):
+        """ Train from scratch on an iterable of cleaned abstracts.
+
+        Returns:
+            (:obj:`list` of :obj:`str`, numpy.ndarray, numpy.ndarray): the
+                vocabulary, the count of each word and the (vocab, dim)
+                matrix of word vectors.
+
+        """
+        self.word_counts = collections.Counter()
+        self.vocab, counts, encoded = encode_abstracts(abstracts, min_count=self.min_count,
+                                                       counts=self.word_counts)
+        self.cooccurrence = build_cooccurrence(encoded, len(self.vocab), window_size=self.window_size)
+        self.params = train_glove(self.cooccurrence, **self.train_kwargs)
+        return self.vocab, counts, self.params['vectors']
+
+    def update(self, abstracts, iterations=5, drift_tolerance=0.05):
+        """ Fold new abstracts into the model: count their words, add any
+        that now reach min_count to the end of the vocabulary, accumulate
+        their co-occurrences and warm-start training on only the
+        co-occurrences they touched. The cost is proportional to the new
+        abstracts rather than to the corpus.
+
+        Parameters:
+            abstracts (iterable of str): new cleaned abstracts.
+
+        Keyword arguments:
+            iterations (int): number of passes over the touched co-occurrences.
+            drift_tolerance (float): minimum relative change of a word
+                vector, as used by documents, for the word to count as
+                changed; see word_drift.
+
+        Returns:
+            set: the new words and the words whose vectors moved by more
+                than drift_tolerance.
+
+        """
+        if self.params is None:
+            raise RuntimeError('Cannot update a GloveTrainer that has not been fitted.')
+
+        tokenised = []
+        for abstract in abstracts:
+            words = abstract.split()
+            self.word_counts.update(words)
+            tokenised.append(words)
+
+        index = {word: i for i, word in enumerate(self.vocab)}
+        new_words = sorted({word for words in tokenised for word in words
+                            if word not in index and self.word_counts[word] >= self.min_count},
+                           key=lambda word: (-self.word_counts[word], word))
+        old_size = len(self.vocab)
+        for word in new_words:
+            index[word] = len(self.vocab)
+            self.vocab.append(word)
+        self._grow(len(self.vocab))
+
+        encoded = [np.array([index[word] for word in words if word in index], dtype=np.int32)
+                   for words in tokenised]
+        delta = build_cooccurrence(encoded, len(self.vocab), window_size=self.window_size).tocoo()
+        self.cooccurrence = (self.cooccurrence + delta).tocsr()
+
+        old_vectors = self.params['vectors'][:old_size].copy()
+        kwargs = dict(self.train_kwargs, iterations=iterations)
+        self.params = train_glove(self.cooccurrence, init=self.params,
+                                  entries=(delta.row, delta.col), **kwargs)
+
+        drifted = np.flatnonzero(word_drift(old_vectors, self.params['vectors'][:old_size]) > drift_tolerance)
+        return set(new_words) | {self.vocab[row] for row in drifted}
+
+    def _grow(self, vocab_size):
+        """ Pad the co-occurrence matrix and parameters to a larger
+        vocabulary, initialising the new rows as train_glove does.
+
+        """
+        old_size = self.cooccurrence.shape[0]
+        if vocab_size == old_size:
+            return
+        self.cooccurrence.resize((vocab_size, vocab_size))
+        rng = np.random.default_rng(vocab_size)
+        vector_size = self.params['W'].shape[1]
+        dtype = self.params['W'].dtype
+        num_new = vocab_size - old_size
+        for name in ('W', 'W_context'):
+            fresh = ((rng.random((num_new, vector_size), dtype=np.float32) - 0.5) / vector_size).astype(dtype)
+            self.params[name] = np.concatenate((self.params[name], fresh))
+            self.params['gradsq_' + name] = np.concatenate(
+                (self.params['gradsq_' + name], np.ones((num_new, vector_size), dtype=dtype)))
+        for name in ('b', 'b_context'):
+            self.params[name] = np.concatenate((self.params[name], np.zeros(num_new, dtype=dtype)))
+            self.params['gradsq_' + name] = np.concatenate(
+                (self.params['gradsq_' + name], np.ones(num_new, dtype=dtype)))
+        self.params['vectors'] = self.params['W'] + self.params['W_context']
+
+    def state(self):
+        """ Return the trainer state for SimilarityEngine._save_state.
+
+        Returns:
+            (dict, dict): JSON-serialisable parameters and named arrays.
+
+        """
+        params = {'min_count': self.min_count,
+                  'window_size': self.window_size,
+                  'train_kwargs': self.train_kwargs,
+                  'vocab': self.vocab,
+                  'word_counts': dict(self.word_counts)}
+        cooccurrence = self.cooccurrence.tocsr()
+        arrays = {'cooccurrence_data': cooccurrence.data,
+                  'cooccurrence_indices': cooccurrence.indices,
+                  'cooccurrence_indptr': cooccurrence.indptr}
+        arrays.update({name: value for name, value in self.params.items()
+                       if name not in ('vectors', 'cost')})
+        return params, arrays
+
+    @classmethod
+    def from_state(cls, params, arrays):
+        """ Rebuild a trainer from the output of state. """
+        trainer = cls(min_count=params['min_count'], window_size=params['window_size'],
+                      **params['train_kwargs'])
+        trainer.vocab = list(params['vocab'])
+        trainer.word_counts = collections.Counter(params['word_counts'])
+        vocab_size = len(trainer.vocab)
+        trainer.cooccurrence = scipy.sparse.csr_matrix(
+            (np.array(arrays['cooccurrence_data']), np.array(arrays['cooccurrence_indices']),
+             np.array(arrays['cooccurrence_indptr'])), shape=(vocab_size, vocab_size))
+        trainer.params = {name: np.array(value) for name, value in arrays.items()
+                          if not name.startswith('cooccurrence_')}
+        trainer.params['vectors'] = trainer.params['W'] + trainer.params['W_context']
+        return trainer
+
+    def save(self, path, fingerprint=None):
+        """ Save the trainer to the directory at path, as one .npy file
+        per array plus a trainer.json file holding the parameters.
+
+        Parameters:
+            path (str): directory to save into.
+
+        Keyword arguments:
+            fingerprint (str): fingerprint of the engine whose vectors
+                the trainer produced, checked by load.
+
+        """
+        params, arrays = self.state()
+        os.makedirs(path, exist_ok=True)
+        for name, array in arrays.items():
+            np.save(os.path.join(path, name + '.npy'), array)
+        with open(os.path.join(path, 'trainer.json'), 'w') as f:
+            json.dump({'fingerprint': fingerprint, 'arrays': sorted(arrays), 'params': params}, f)
+
+    @classmethod
+    def load(cls, path, fingerprint=None):
+        """ Load a trainer saved with save.
+
+        Parameters:
+            path (str): directory the trainer was saved into.
+
+        Keyword arguments:
+            fingerprint (str): if given, the fingerprint the trainer must
+                have been saved with.
+
+        Returns:
+            GloveTrainer: the loaded trainer.
+
+        """
+        with open(os.path.join(path, 'trainer.json')) as f:
+            meta = json.load(f)
+        if fingerprint is not None and meta['fingerprint'] != fingerprint:
+            raise ValueError(f'Trainer at {path} belongs to engine {meta["fingerprint"]}, not {fingerprint}.')
+        arrays = {name: np.load(os.path.join(path, name + '.npy')) for name in meta['arrays']}
+        return cls.from_state(meta['params'], arrays)
+
+
+def train_word_vectors(abstracts, min_count=2, window_size=15, **kwargs):
+    """ Train GloVe word vectors from an iterable of cleaned abstracts,
+    entirely in memory.
+
+    Parameters:
+        abstracts (iterable of str): cleaned abstracts.
+
+    Keyword arguments:
+        min_count (int): minimum number of occurrences of a word.
+        window_size (int): number of context words either side.
+        Remaining keyword arguments are passed to train_glove.
+
+    Returns:
+        (:obj:`list` of :obj:`str`, numpy.ndarray, numpy.ndarray): the
+            vocabulary, the count of each word and the (vocab, dim)
+            matrix of word vectors.
+
+    """
+    return GloveTrainer(min_count=min_count, window_size=window_size, **kwargs).fit(abstracts)
@@ -0,0 +1,155 @@
+""" This module implements an approximate nearest-neighbour index
+over unit-normalised document vectors, using an inverted file (IVF)
+of k-means clusters. Queries only scan the documents in the clusters
+whose centroids are closest to the query vector, trading recall for
+latency through the number of probed clusters.
+
+"""
+
+import numpy as np
+
+from pubstomp.similarity.neighbours import NearestNeighbourIndex, top_k
+from pubstomp.similarity.quantize import quantize
+
+
+def spherical_kmeans(vectors, num_clusters, num_iter=20, sample_size=None, seed=0):
+    """ Cluster unit-normalised vectors by cosine similarity, i.e.
+    k-means with centroids renormalised onto the unit sphere after
+    every iteration.
+
+    Parameters:
+        vectors (numpy.ndarray): matrix of shape (num_vectors, vector_dim).
+        num_clusters (int): number of centroids to find.
+
+    Keyword arguments:
+        num_iter (int): number of Lloyd iterations.
+        sample_size (int): train on a random sample of this many vectors,
+            defaults to 256 per cluster.
+        seed (int): seed for the random number generator.
+
+    Returns:
+        numpy.ndarray: unit-normalised centroids of shape (num_clusters, vector_dim).
+
+    """
+    rng = np.random.default_rng(seed)
+    if sample_size is None:
+        sample_size = 256 * num_clusters
+    sample = vectors
+    if sample_size < len(vectors):
+        sample = vectors[np.sort(rng.choice(len(vectors), sample_size, replace=False))]
+    sample = np.asarray(sample, dtype=np.float32)
+
+    centroids = sample[rng.choice(len(sample), num_clusters, replace=False)].copy()
+    for _ in range(num_iter):
+        assignment = np.argmax(sample @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignment, sample)
+        norms = np.linalg.norm(sums, axis=1)
+        # leave the centroids of empty clusters where they were
+        filled = norms > 0
+        centroids[filled] = sums[filled] / norms[filled, None]
+
+    return centroids
+
+
+def assign_clusters(vectors, centroids, block_size=65536):
+    """ Find the closest centroid to each vector, one block at a time.
+
+    Returns:
+        numpy.ndarray: the index of the closest centroid for each vector.
+
+    """
+    assignment = np.empty(len(vectors), dtype=np.intp)
+    for start in range(0, len(vectors), block_size):
+        block = vectors[start:start + block_size]
+        assignment[start:start + block_size] = np.argmax(block @ centroids.T, axis=1)
+    return assignment
+
+
+def recall_at_k(approximate_index, exact_index, queries, k=10, exclude=None):
+    """ Measure the mean fraction of the exact top-k neighbours that an
+    approximate index also returns.
+
+    Parameters:
+        approximate_index (NearestNeighbourIndex): the index under test.
+        exact_index (NearestNeighbourIndex): the brute-force reference.
+        queries (numpy.ndarray): matrix of query vectors, one per row.
+
+    Keyword arguments:
+        k (int): number of neighbours to compare.
+        exclude (:obj:`list` of :obj:`str`): an arXiv ID to drop from the
+            results of each query, e.g. the IDs of indexed documents used
+            as queries, which would otherwise always match themselves.
+
+    Returns:
+        float: recall@k averaged over the queries.
+
+    """
+    if exclude is None:
+        exclude = [None] * len(queries)
+    hits = 0
+    for vector, arxiv_id in zip(queries, exclude):
+        exact = {match for match, _ in exact_index.query_vector(vector, k=k, exclude=arxiv_id)}
+        approx = {match for match, _ in approximate_index.query_vector(vector, k=k, exclude=arxiv_id)}
+        hits += len(exact & approx)
+    return hits / (k * len(queries))
+
+
+class IVFIndex(NearestNeighbourIndex):
+    """ Approximate drop-in replacement for NearestNeighbourIndex. The
+    documents are partitioned into num_lists clusters with spherical
+    k-means and stored contiguously cluster by cluster; a query scans
+    only the num_probe clusters with the most similar centroids.
+
+    Parameters:
+        sim_engine (SimilarityEngine): a fitted engine whose parsed
+            documents are unit-normalised vectors.
+        arxiv_ids (:obj:`list` of :obj:`str`): the arXiv ID of each row.
+        vectors (numpy.ndarray): matrix of shape (num_documents, vector_dim).
+
+    Keyword arguments:
+        num_lists (int): number of clusters, defaults to sqrt(num_documents).
+        num_probe (int): number of clusters scanned per query; the
+            recall/latency knob, which can be changed after construction.
+        num_iter (int): number of k-means iterations.
+        seed (int): seed for the k-means initialisation.
+        block_size (int): number of rows per block when assigning clusters.
+        storage (str): storage type of the document matrix, see
+            NearestNeighbourIndex; clustering always uses the vectors
+            as given.
+
+    Attributes:
+        self.centroids (numpy.ndarray): the unit-normalised cluster centroids.
+        self.list_offsets (numpy.ndarray): rows list_offsets[i]:list_offsets[i+1]
+            of self.vectors belong to cluster i.
+
+    """
+    def __init__(self, sim_engine, arxiv_ids, vectors, num_lists=None, num_probe=8,
+                 num_iter=20, seed=0, block_size=65536, storage=None):
+        super().__init__(sim_engine, arxiv_ids, vectors, block_size=block_size)
+        if num_lists is None:
+            num_lists = max(1, int(np.sqrt(len(self))))
+        num_lists = min(num_lists, len(self))
+        self.num_probe = num_probe
+
+        self.centroids = spherical_kmeans(self.vectors, num_lists, num_iter=num_iter, seed=seed)
+        assignment = assign_clusters(self.vectors, self.centroids, block_size=block_size)
+
+        # reorder the documents so that each cluster is one contiguous slice
+        order = np.argsort(assignment, kind='stable')
+        self.vectors = np.ascontiguousarray(self.vectors[order])
+        self.arxiv_ids = self.arxiv_ids[order]
+        self.storage = storage
+        self.vectors, self.scales = quantize(self.vectors, storage)
+        self.list_offsets = np.zeros(num_lists + 1, dtype=np.intp)
+        np.cumsum(np.bincount(assignment, minlength=num_lists), out=self.list_offsets[1:])
+
+    def _candidate_slices(self, vector):
+        """ Yield the row ranges of the num_probe clusters whose
+        centroids are most similar to the query.
+
+        """
+        for cluster in top_k(self.centroids @ vector, self.num_probe):
+            start, stop = self.list_offsets[cluster], self.list_offsets[cluster + 1]
+            if start != stop:
+                yield start, stop
@@ -0,0 +1,209 @@
+""" This module implements exact top-k nearest-neighbour queries over
+the parsed vectors of a whole collection of documents, e.g. for
+recommending papers similar to a given arXiv abstract.
+
+"""
+
+import numpy as np
+
+from pubstomp.similarity.similarity import stack_vectors
+from pubstomp.similarity.quantize import quantize, quantized_dot
+
+
+def top_k(scores, k):
+    """ Find the indices of the k largest scores without sorting the
+    full array.
+
+    Parameters:
+        scores (numpy.ndarray): 1D array of scores.
+        k (int): number of indices to return.
+
+    Returns:
+        numpy.ndarray: indices of the k largest scores, in descending
+            order of score.
+
+    """
+    k = min(k, len(scores))
+    if k <= 0:
+        return np.empty(0, dtype=np.intp)
+    candidates = np.argpartition(scores, -k)[-k:]
+    return candidates[np.argsort(scores[candidates])[::-1]]
+
+
+class NearestNeighbourIndex:
+    """ Stores the parsed vectors of a collection of documents in a
+    single contiguous matrix, and answers top-k similarity queries
+    against it with blocked matrix-vector products.
+
+    Parameters:
+        sim_engine (SimilarityEngine): a fitted engine whose parsed
+            documents are vectors compared by dot product.
+        arxiv_ids (:obj:`list` of :obj:`str`): the arXiv ID of each row.
+        vectors (numpy.ndarray): matrix of shape (num_documents, vector_dim).
+
+    Keyword arguments:
+        block_size (int): number of rows scanned per matrix-vector product.
+        storage (str): store the document matrix as 'float64', 'float32',
+            'float16' or 'int8' with a scale per row, see quantize; by
+            default it is stored as given.
+
+    Attributes:
+        self.arxiv_ids (numpy.ndarray): the arXiv ID of each row.
+        self.vectors (numpy.ndarray): the contiguous document matrix.
+        self.scales (numpy.ndarray): the scale of each row for int8
+            storage, else None.
+
+    """
+    def __init__(self, sim_engine, arxiv_ids, vectors, block_size=65536, storage=None):
+        if len(arxiv_ids) != vectors.shape[0]:
+            raise ValueError(f'Got {len(arxiv_ids)} IDs for {vectors.shape[0]} vectors.')
+        self.sim_engine = sim_engine
+        self.block_size = block_size
+        self.arxiv_ids = np.asarray(arxiv_ids)
+        self.storage = storage
+        self.vectors, self.scales = quantize(vectors, storage)
+        self._rows = None
+
+    @classmethod
+    def from_documents(cls, sim_engine, documents, workers=None, **kwargs):
+        """ Parse every document with the engine and index the results.
+
+        Parameters:
+            sim_engine (SimilarityEngine): a fitted engine.
+            documents (:obj:`list` of :obj:`document.Document`): the
+                documents to index.
+
+        Keyword arguments:
+            workers (int): if set, parse the documents over this many
+                processes with SimilarityEngine.parse_documents, rather
+                than one at a time through Document.parsed.
+
+        Other keyword arguments are passed to the constructor.
+
+        """
+        arxiv_ids = [doc.arxiv_id for doc in documents]
+        if workers is None:
+            vectors = stack_vectors([doc.parsed(sim_engine) for doc in documents])
+        else:
+            vectors = stack_vectors(sim_engine.parse_documents(documents, workers=workers))
+        return cls(sim_engine, arxiv_ids, vectors, **kwargs)
+
+    def __len__(self):
+        return len(self.arxiv_ids)
+
+    def rows_of(self, arxiv_ids):
+        """ Find the rows of the given documents, skipping any that are
+        not indexed.
+
+        Parameters:
+            arxiv_ids (iterable of :obj:`str`): e.g. the posting list of
+                a subject, see pubstomp.stats.CorpusStats.
+
+        Returns:
+            numpy.ndarray: the sorted rows.
+
+        """
+        if self._rows is None:
+            self._rows = {str(arxiv_id): row for row, arxiv_id in enumerate(self.arxiv_ids)}
+        rows = [self._rows[arxiv_id] for arxiv_id in arxiv_ids if arxiv_id in self._rows]
+        return np.unique(np.asarray(rows, dtype=np.intp))
+
+    def query(self, document, k=10, exclude_self=True, candidates=None):
+        """ Find the k indexed documents most similar to the given one.
+
+        Parameters:
+            document (document.Document): the query document.
+
+        Keyword arguments:
+            k (int): number of neighbours to return.
+            exclude_self (bool): whether to drop the query document from
+                the results, if it is in the index.
+            candidates (iterable of :obj:`str`): only consider these
+                arXiv IDs, see query_vector.
+
+        Returns:
+            :obj:`list` of :obj:`tuple`: (arxiv_id, score) pairs, most
+                similar first.
+
+        """
+        exclude = document.arxiv_id if exclude_self else None
+        return self.query_vector(document.parsed(self.sim_engine), k=k, exclude=exclude,
+                                 candidates=candidates)
+
+    def query_vector(self, vector, k=10, exclude=None, candidates=None):
+        """ Find the k indexed documents most similar to a parsed vector.
+
+        Parameters:
+            vector (numpy.ndarray): the parsed query vector.
+
+        Keyword arguments:
+            k (int): number of neighbours to return.
+            exclude (str): an arXiv ID to drop from the results.
+            candidates (iterable of :obj:`str`): only consider these
+                arXiv IDs, e.g. the documents with a given subject from
+                pubstomp.stats.CorpusStats.documents_with_subject. Only
+                the candidate rows are scanned, exactly.
+
+        Returns:
+            :obj:`list` of :obj:`tuple`: (arxiv_id, score) pairs, most
+                similar first.
+
+        """
+        if candidates is None:
+            rows, scores = self._search(vector, k + (exclude is not None))
+        else:
+            rows, scores = self._search_rows(vector, k + (exclude is not None), self.rows_of(candidates))
+        results = [(str(self.arxiv_ids[row]), float(score))
+                   for row, score in zip(rows, scores)
+                   if self.arxiv_ids[row] != exclude]
+        return results[:k]
+
+    def _candidate_slices(self, vector):
+        """ Yield the (start, stop) row ranges to scan for a query; the
+        exact index scans every row, one block at a time.
+
+        """
+        for start in range(0, len(self), self.block_size):
+            yield start, min(start + self.block_size, len(self))
+
+    def _search(self, vector, k):
+        """ Scan the candidate rows for the query, keeping only the top
+        k candidates of each slice.
+
+        Returns:
+            (numpy.ndarray, numpy.ndarray): the rows and scores of the
+                top k documents, most similar first.
+
+        """
+        candidate_rows = []
+        candidate_scores = []
+        for start, stop in self._candidate_slices(vector):
+            scales = None if self.scales is None else self.scales[start:stop]
+            scores = quantized_dot(self.vectors[start:stop], scales, vector)
+            rows = top_k(scores, k)
+            candidate_rows.append(rows + start)
+            candidate_scores.append(scores[rows])
+
+        if not candidate_rows:
+            return np.empty(0, dtype=np.intp), np.empty(0)
+
+        rows = np.concatenate(candidate_rows)
+        scores = np.concatenate(candidate_scores)
+        best = top_k(scores, k)
+        return rows[best], scores[best]
+
+    def _search_rows(self, vector, k, rows):
+        """ Score only the given rows for the query, one block at a time.
+
+        Returns:
+            (numpy.ndarray, numpy.ndarray): the rows and scores of the
+                top k documents, most similar first.
+
+        """
+        scores = np.empty(len(rows), dtype=np.result_type(self.vectors.dtype, np.float32))
+        for start in range(0, len(rows), self.block_size):
+            block = rows[start:start + self.block_size]
+            scales = None if self.scales is None else self.scales[block]
+            scores[start:start + len(block)] = quantized_dot(self.vectors[block], scales, vector)
+        best = top_k(scores, k)
+        return rows[best], scores[best]
@@ -0,0 +1,73 @@
+""" This module implements reduced-precision storage of document
+matrices: plain float32 or float16 copies, or int8 scalar quantization
+with one float32 scale per row, and the dot-product kernel that scores
+a query against such a matrix without dequantizing all of it.
+
+"""
+
+import numpy as np
+
+STORAGE_TYPES = ('float64', 'float32', 'float16', 'int8')
+
+
+def quantize(matrix, storage):
+    """ Convert a matrix of row vectors to the given storage type.
+
+    For int8 storage, each row is divided by its own scale, the largest
+    absolute value in the row over 127, and rounded, so that row i is
+    approximately data[i] * scales[i].
+
+    Parameters:
+        matrix (numpy.ndarray): matrix of shape (num_rows, vector_dim).
+        storage (str): one of STORAGE_TYPES, or None to keep the matrix
+            as it is.
+
+    Returns:
+        (numpy.ndarray, numpy.ndarray): the contiguous stored matrix,
+            and the float32 scale of each row for int8 storage, else None.
+
+    """
+    if storage is None:
+        return np.ascontiguousarray(matrix), None
+    if storage not in STORAGE_TYPES:
+        raise ValueError(f'Unknown storage type {storage}, expected one of {STORAGE_TYPES}.')
+    if storage != 'int8':
+        return np.ascontiguousarray(matrix, dtype=storage), None
+
+    matrix = np.asarray(matrix, dtype=np.float32)
+    scales = np.abs(matrix).max(axis=1, initial=0) / 127
+    safe_scales = np.where(scales > 0, scales, 1)
+    data = np.rint(matrix / safe_scales[:, None]).astype(np.int8)
+    return data, scales.astype(np.float32)
+
+
+def dequantize(data, scales=None):
+    """ Convert a stored matrix back to float32. """
+    matrix = np.asarray(data, dtype=np.float32)
+    if scales is not None:
+        matrix = matrix * scales[:, None]
+    return matrix
+
+
+def quantized_dot(data, scales, vector):
+    """ Score a query vector against a block of stored rows. float16 and
+    int8 blocks are widened to float32 one block at a time, since BLAS
+    has no kernels for them, and int8 scores are rescaled per row
+    afterwards, so the full-precision matrix is never materialised.
+
+    Parameters:
+        data (numpy.ndarray): stored rows of shape (num_rows, vector_dim).
+        scales (numpy.ndarray): the scale of each row for int8 storage,
+            else None.
+        vector (numpy.ndarray): the query vector.
+
+    Returns:
+        numpy.ndarray: the dot product of each row with the query.
+
+    """
+    if data.dtype in (np.float32, np.float64):
+        return data @ vector.astype(data.dtype, copy=False)
+    scores = data.astype(np.float32) @ vector.astype(np.float32, copy=False)
+    if scales is not None:
+        scores *= scales
+    return scores
@@ -4,6 +4,215 @@ abstracts.
 
 """
 
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+from multiprocessing import shared_memory
+
+import numpy as np
+
+MODEL_FORMAT_VERSION = 1
+
+
+def stack_vectors(vectors):
+    """ Stack a sequence of parsed document vectors into a single
+    contiguous 2D matrix, one row per document.
+
+    Parameters:
+        vectors (:obj:`list` of :obj:`numpy.ndarray`): the vectors to stack.
+
+    Returns:
+        numpy.ndarray: matrix of shape (num_vectors, vector_dim).
+
+    """
+    return np.ascontiguousarray(np.vstack(vectors))
+
+
+def blocked_dot(matrix_a, matrix_b=None, block_size=1024):
+    """ Compute all pair-wise dot products between the rows of two
+    matrices, one block of rows at a time so that the working set of
+    each product stays in cache. If matrix_b is not provided, the rows
+    of matrix_a are compared with themselves and only the upper
+    triangle of blocks is computed, with the lower triangle filled by
+    symmetry.
+
+    Parameters:
+        matrix_a (numpy.ndarray): matrix of shape (num_a, vector_dim),
+            or a scipy.sparse matrix.
+
+    Keyword arguments:
+        matrix_b (numpy.ndarray): matrix of shape (num_b, vector_dim),
+            or a scipy.sparse matrix.
+        block_size (int): number of rows per block.
+
+    Returns:
+        numpy.ndarray: matrix of shape (num_a, num_b) of dot products.
+
+    """
+    symmetric = matrix_b is None
+    if symmetric:
+        matrix_b = matrix_a
+
+    num_a, num_b = matrix_a.shape[0], matrix_b.shape[0]
+    result = np.empty((num_a, num_b), dtype=np.result_type(matrix_a.dtype, matrix_b.dtype))
+    for start_a in range(0, num_a, block_size):
+        stop_a = min(start_a + block_size, num_a)
+        block_a = matrix_a[start_a:stop_a]
+        for start_b in range(start_a if symmetric else 0, num_b, block_size):
+            stop_b = min(start_b + block_size, num_b)
+            block = block_a @ matrix_b[start_b:stop_b].T
+            if hasattr(block, 'toarray'):
+                block = block.toarray()
+            result[start_a:stop_a, start_b:stop_b] = block
+            if symmetric and start_b != start_a:
+                result[start_b:stop_b, start_a:stop_a] = block.T
+
+    return result
+
+
+def packed_size(num_rows):
+    """ The length of the packed upper triangle, including the
+    diagonal, of a square matrix with num_rows rows.
+
+    """
+    return num_rows * (num_rows + 1) // 2
+
+
+def unpack_triangle(packed, num_rows):
+    """ Expand a packed upper triangle, as returned by packed_dot, into
+    the full symmetric matrix.
+
+    Parameters:
+        packed (numpy.ndarray): the packed triangle, row by row.
+        num_rows (int): the number of rows of the matrix.
+
+    Returns:
+        numpy.ndarray: matrix of shape (num_rows, num_rows).
+
+    """
+    result = np.empty((num_rows, num_rows), dtype=packed.dtype)
+    upper = np.triu_indices(num_rows)
+    result[upper] = packed
+    result.T[upper] = packed
+    return result
+
+
+def packed_dot(matrix, block_size=1024):
+    """ Compute the dot products between every pair of rows of a
+    matrix, storing only the upper triangle including the diagonal,
+    row by row, i.e. element [i, j] for j >= i is at position
+    i * num_rows - i * (i - 1) // 2 + (j - i). Only the upper triangle
+    of each block of rows is computed.
+
+    Parameters:
+        matrix (numpy.ndarray): matrix of shape (num_rows, vector_dim),
+            or a scipy.sparse matrix.
+
+    Keyword arguments:
+        block_size (int): number of rows per block.
+
+    Returns:
+        numpy.ndarray: the packed triangle, of length packed_size(num_rows).
+
+    """
+    num_rows = matrix.shape[0]
+    result = np.empty(packed_size(num_rows), dtype=matrix.dtype)
+    position = 0
+    for start in range(0, num_rows, block_size):
+        stop = min(start + block_size, num_rows)
+        block = matrix[start:stop] @ matrix[start:].T
+        if hasattr(block, 'toarray'):
+            block = block.toarray()
+        for ind in range(stop - start):
+            row = block[ind, ind:]
+            result[position:position + len(row)] = row
+            position += len(row)
+
+    return result
+
+
+def share_array(array):
+    """ Copy an array into a new block of shared memory, so that worker
+    processes can attach to it by name instead of receiving a pickled
+    copy. The caller owns the block, and must close and unlink it.
+
+    Parameters:
+        array (numpy.ndarray): the array to share.
+
+    Returns:
+        (multiprocessing.shared_memory.SharedMemory, tuple): the shared
+            block, and a picklable (name, shape, dtype) spec to pass to
+            attach_array.
+
+    """
+    array = np.asarray(array)
+    shm = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+    np.ndarray(array.shape, dtype=array.dtype, buffer=shm.buf)[...] = array
+    return shm, (shm.name, array.shape, array.dtype.str)
+
+
+def attach_array(spec):
+    """ Attach to an array shared with share_array.
+
+    Parameters:
+        spec (tuple): the spec returned by share_array.
+
+    Returns:
+        (multiprocessing.shared_memory.SharedMemory, numpy.ndarray): the
+            attached block, which must be kept alive (and eventually
+            closed) for as long as the array is used, and the array.
+
+    """
+    name, shape, dtype = spec
+    shm = shared_memory.SharedMemory(name=name)
+    return shm, np.ndarray(shape, dtype=np.dtype(dtype), buffer=shm.buf)
+
+
+class DocumentParser:
+    """ Parses batches of documents with a fitted engine. Parsers are
+    context managers, so that subclasses can hold on to expensive
+    resources, e.g. a process pool, across many batches; this base
+    class simply parses each document in turn in the calling process.
+
+    Parameters:
+        sim_engine (SimilarityEngine): the engine to parse with.
+
+    Keyword arguments:
+        workers (int): number of worker processes, if supported.
+        chunk_size (int): number of documents per unit of work sent to
+            a worker.
+
+    """
+    def __init__(self, sim_engine, workers=None, chunk_size=256):
+        self.sim_engine = sim_engine
+        self.workers = workers
+        self.chunk_size = chunk_size
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        """ Release any resources held by the parser. """
+
+    def __call__(self, documents):
+        """ Parse a batch of documents.
+
+        Parameters:
+            documents (:obj:`list` of :obj:`document.Document`): the
+                documents to parse.
+
+        Returns:
+            list: the parsed representation of each document, as
+                returned by SimilarityEngine.parse_document.
+
+        """
+        return [self.sim_engine.parse_document(document) for document in documents]
+
 
 class SimilarityEngine:
     """ SimilarityEngine subclasses should take a list of Document
@@ -18,12 +227,27 @@ class SimilarityEngine:
         documents (:obj:`list` of :obj:`document.Document`): list
             of documents required to construct the engine.
 
+    Subclasses that can be saved to disk implement _save_state and
+    _load_state, which are used by save and load respectively.
+
     Attributes:
         self.data (dict): a dictionary containing, with the subclass
             developer's discretion, the data used to train the model
             and the model itself, for some broad definition of model.
+        self.cache (pubstomp.cache.EmbeddingCache): optional persistent
+            cache of parsed documents, consulted by Document.parsed; see
+            attach_cache.
+        self.model_path (str): the directory a loaded engine was read from.
+        self.symmetric (bool): whether get_similarity(a, b) always equals
+            get_similarity(b, a), in which case only the upper triangle of
+            a similarity matrix needs computing, see
+            get_packed_similarity_matrix.
 
     """
+    cache = None
+    model_path = None
+    symmetric = False
+
     @staticmethod
     def parse_document(document):
         """ If any further document parsing is required by the
@@ -38,6 +262,41 @@ class SimilarityEngine:
         """
         return document
 
+    def document_parser(self, workers=None, chunk_size=256):
+        """ Create a DocumentParser for this engine, to be used as a
+        context manager when parsing many batches of documents. Engines
+        that can parse in parallel override this to return a parser that
+        spreads the work over a process pool.
+
+        Keyword arguments:
+            workers (int): number of worker processes, if supported.
+            chunk_size (int): number of documents per unit of work.
+
+        Returns:
+            DocumentParser: the parser.
+
+        """
+        return DocumentParser(self, workers=workers, chunk_size=chunk_size)
+
+    def parse_documents(self, documents, workers=None, chunk_size=256):
+        """ Parse a batch of documents, in parallel if the engine
+        supports it; see document_parser.
+
+        Parameters:
+            documents (:obj:`list` of :obj:`document.Document`): the
+                documents to parse.
+
+        Keyword arguments:
+            workers (int): number of worker processes, if supported.
+            chunk_size (int): number of documents per unit of work.
+
+        Returns:
+            list: the parsed representation of each document.
+
+        """
+        with self.document_parser(workers=workers, chunk_size=chunk_size) as parser:
+            return parser(documents)
+
     def get_similarity(self, document_a, document_b):
         """ Calculate similarity between the two documents according to
         the model embedded in the subclass.
@@ -51,3 +310,203 @@ class SimilarityEngine:
 
         """
         raise NotImplementedError('Calling Base class get_similarity!')
+
+    def get_similarity_matrix(self, documents_a, documents_b=None):
+        """ Calculate the similarity between every pair of documents
+        drawn from the two lists. Engines whose parsed documents are
+        vectors should override this method with a batched matrix
+        product (see `blocked_dot`); this fallback simply calls
+        get_similarity on every pair.
+
+        Parameters:
+            documents_a (:obj:`list` of :obj:`document.Document`): the
+                documents that index the rows of the result.
+
+        Keyword arguments:
+            documents_b (:obj:`list` of :obj:`document.Document`): the
+                documents that index the columns of the result. If None,
+                compare documents_a with itself.
+
+        Returns:
+            numpy.ndarray: matrix of shape (len(documents_a), len(documents_b))
+                with element [i, j] = get_similarity(documents_a[i], documents_b[j]).
+
+        """
+        if documents_b is None:
+            documents_b = documents_a
+
+        result = np.empty((len(documents_a), len(documents_b)))
+        for ind, document_a in enumerate(documents_a):
+            for jnd, document_b in enumerate(documents_b):
+                result[ind, jnd] = self.get_similarity(document_a, document_b)
+
+        return result
+
+    def get_packed_similarity_matrix(self, documents):
+        """ Calculate the similarity between every pair of documents of
+        a symmetric engine, evaluating each unordered pair once. Engines
+        whose parsed documents are vectors should override this method
+        with packed_dot; this fallback calls get_similarity on each pair.
+
+        Parameters:
+            documents (:obj:`list` of :obj:`document.Document`): the
+                documents to compare.
+
+        Returns:
+            numpy.ndarray: the packed upper triangle of the similarity
+                matrix, including the diagonal; see packed_dot and
+                unpack_triangle.
+
+        """
+        if not self.symmetric:
+            raise ValueError(f'{type(self).__name__} is not symmetric, use get_similarity_matrix.')
+
+        result = np.empty(packed_size(len(documents)))
+        position = 0
+        for ind, document_a in enumerate(documents):
+            for document_b in documents[ind:]:
+                result[position] = self.get_similarity(document_a, document_b)
+                position += 1
+
+        return result
+
+    def attach_cache(self, cache):
+        """ Attach a persistent cache of parsed documents, to be
+        consulted and filled by Document.parsed. Only engines whose
+        parsed documents are 1-D vectors can be cached.
+
+        Parameters:
+            cache (pubstomp.cache.EmbeddingCache): the cache, which must
+                have been opened for this engine's fingerprint, or None
+                to detach the current cache.
+
+        """
+        if cache is not None and cache.fingerprint != self.fingerprint():
+            raise ValueError(f'Cache {cache.path} belongs to another engine '
+                             f'than {type(self).__name__} {self.fingerprint()}.')
+        self.cache = cache
+
+    def _save_state(self):
+        """ Return the state required to rebuild the trained engine.
+
+        Returns:
+            (dict, dict): JSON-serialisable parameters, and a dict of
+                named numpy arrays.
+
+        """
+        raise NotImplementedError(f'{type(self).__name__} does not support saving.')
+
+    def _load_state(self, params, arrays):
+        """ Rebuild the trained engine from the output of _save_state.
+
+        Parameters:
+            params (dict): the saved parameters.
+            arrays (dict): the saved arrays, possibly memory-mapped.
+
+        """
+        raise NotImplementedError(f'{type(self).__name__} does not support loading.')
+
+    def _save_artifacts(self, path):
+        """ Write any optional parts of the engine that are not needed
+        to parse documents, and so are left out of _save_state, e.g. the
+        state needed to keep training it. They are written into the new
+        model directory before it replaces the old one, and should be
+        read from self.model_path only when needed.
+
+        Parameters:
+            path (str): the directory being saved into.
+
+        """
+
+    def fingerprint(self):
+        """ Hash the saved state of the trained engine, so that
+        anything derived from it (e.g. cached document vectors) can be
+        keyed on the exact model that produced it.
+
+        Returns:
+            str: hex digest identifying the engine class and its state.
+
+        """
+        if getattr(self, '_fingerprint', None) is None:
+            params, arrays = self._save_state()
+            digest = hashlib.sha1(type(self).__name__.encode())
+            digest.update(json.dumps(params, sort_keys=True).encode())
+            for name in sorted(arrays):
+                digest.update(name.encode())
+                digest.update(np.ascontiguousarray(arrays[name]).data)
+            self._fingerprint = digest.hexdigest()[:16]
+        return self._fingerprint
+
+    def save(self, path):
+        """ Save the trained engine to the directory at path, as one
+        .npy file per array plus an engine.json file holding the
+        parameters and format version. The model is written to a fresh
+        directory beside path, which then replaces any existing model
+        by rename, so that an existing model is never rewritten in
+        place: a crash leaves the old model intact, and processes that
+        have its arrays memory-mapped keep reading the old files.
+
+        Parameters:
+            path (str): directory to save into, replaced if it exists.
+
+        """
+        params, arrays = self._save_state()
+        path = os.path.abspath(path)
+        parent, name = os.path.split(path)
+        os.makedirs(parent, exist_ok=True)
+        tmp_path = tempfile.mkdtemp(prefix=f'.{name}.tmp-', dir=parent)
+        os.chmod(tmp_path, 0o755)
+        try:
+            for array_name, array in arrays.items():
+                np.save(os.path.join(tmp_path, array_name + '.npy'), array)
+
+            meta = {'format_version': MODEL_FORMAT_VERSION,
+                    'engine': type(self).__name__,
+                    'arrays': sorted(arrays),
+                    'params': params}
+            with open(os.path.join(tmp_path, 'engine.json'), 'w') as f:
+                json.dump(meta, f)
+            self._save_artifacts(tmp_path)
+
+            old_path = None
+            if os.path.exists(path):
+                old_path = tempfile.mkdtemp(prefix=f'.{name}.old-', dir=parent)
+                os.replace(path, os.path.join(old_path, name))
+            os.replace(tmp_path, path)
+        except BaseException:
+            shutil.rmtree(tmp_path, ignore_errors=True)
+            raise
+        if old_path is not None:
+            shutil.rmtree(old_path, ignore_errors=True)
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        """ Load an engine previously saved with save, without any
+        retraining.
+
+        Parameters:
+            path (str): directory the engine was saved into.
+
+        Keyword arguments:
+            mmap (bool): memory-map the arrays read-only rather than
+                reading them into memory, so that several processes
+                share the same pages.
+
+        Returns:
+            SimilarityEngine: the loaded engine.
+
+        """
+        with open(os.path.join(path, 'engine.json')) as f:
+            meta = json.load(f)
+        if meta['format_version'] != MODEL_FORMAT_VERSION:
+            raise ValueError(f'Model at {path} has format version {meta["format_version"]}, '
+                             f'expected {MODEL_FORMAT_VERSION}.')
+        if meta['engine'] != cls.__name__:
+            raise ValueError(f'Model at {path} was saved by {meta["engine"]}, not {cls.__name__}.')
+
+        arrays = {name: np.load(os.path.join(path, name + '.npy'), mmap_mode='r' if mmap else None)
+                  for name in meta['arrays']}
+        engine = cls.__new__(cls)
+        engine.model_path = os.path.abspath(path)
+        engine._load_state(meta['params'], arrays)
+        return engine
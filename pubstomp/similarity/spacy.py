@@ -1,74 +1,245 @@
-from pubstomp.similarity import SimilarityEngine
-from pubstomp.document import Document
+""" This module implements a similarity engine based on the document
+vectors of a pretrained spaCy pipeline. The pipeline is only loaded
+when the first document is parsed, and documents are parsed in
+batches through nlp.pipe, once each: their unit-normalised vectors are
+kept in a single matrix, so that similarities are dot products. The
+matrix is saved with the engine, so a loaded engine does not reparse
+the documents it has already seen.
+
+"""
+
+import functools
+import hashlib
+
+import numpy as np
+
+from pubstomp.similarity.similarity import SimilarityEngine, DocumentParser, blocked_dot, packed_dot
+
+DEFAULT_MODEL = 'en_core_web_sm'
+
+# components that produce the vectors behind Doc.vector; every other
+# component (tagger, parser, NER, ...) is disabled
+VECTOR_PIPES = ('tok2vec', 'transformer')
+
+
+@functools.lru_cache()
+def load_model(model_name):
+    """ Load a spaCy pipeline with only the components needed for
+    document vectors enabled, once per process.
+
+    Parameters:
+        model_name (str): the name or path of the pipeline.
+
+    Returns:
+        spacy.language.Language: the pipeline.
+
+    """
+    import spacy
+    nlp = spacy.load(model_name)
+    nlp.select_pipes(disable=[name for name in nlp.pipe_names if name not in VECTOR_PIPES])
+    return nlp
+
+
+def normalise_rows(vectors):
+    """ Divide each row by its norm, leaving zero rows as they are. """
+    norms = np.linalg.norm(vectors, axis=1)
+    return vectors / np.where(norms > 0, norms, 1)[:, None]
+
+
+class SpacyDocumentParser(DocumentParser):
+    """ Parses batches of documents through nlp.pipe, with the workers
+    passed on as its n_process.
+
+    """
+    def __call__(self, documents):
+        return list(self.sim_engine.vectors_of(documents, n_process=self.workers))
 
 
 class SpacySimilarityEngine(SimilarityEngine):
-    try:
-        import spacy
-        SPACY_EN_CORE_WEB_SM = spacy.load('en_core_web_sm')
-    except ImportError:
-        pass
-    def get_similarity(self):
+    """ Measures the similarity of two abstracts by the cosine of their
+    spaCy document vectors.
+
+    Keyword arguments:
+        documents (:obj:`list` of :obj:`document.Document`): documents
+            to parse up front, in batches.
+        model_name (str): the spaCy pipeline to load.
+        batch_size (int): number of abstracts per nlp.pipe batch.
+        n_process (int): number of processes for nlp.pipe.
+
+    Attributes:
+        self.vectors (numpy.ndarray): the unit-normalised float32 vector
+            of every document with an arXiv ID parsed so far, one row per
+            document.
+        self.rows (dict): the row of self.vectors of each arXiv ID.
+
+    """
+    symmetric = True
+
+    def __init__(self, documents=None, model_name=DEFAULT_MODEL, batch_size=64, n_process=1):
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self.n_process = n_process
+        # self.vectors is a view of the first len(self.rows) rows, the
+        # buffer growing geometrically as documents are added
+        self._buffer = np.empty((0, 0), dtype=np.float32)
+        self.rows = {}
+        if documents is not None:
+            self.vectors_of(documents)
+
+    @property
+    def vectors(self):
+        """ The vectors of the stored documents, one per row. """
+        return self._buffer[:len(self.rows)]
+
+    @property
+    def nlp(self):
+        """ The spaCy pipeline, loaded on first use. """
+        return load_model(self.model_name)
+
+    def _pipe(self, documents, n_process):
+        """ Parse documents through nlp.pipe into a matrix of
+        unit-normalised vectors.
+
         """
-        Given two documents (either the bare records or a Document class)
-        return a tuple (id1, id2, simScore) indicating their semantic similarity.
+        n_process = self.n_process if n_process is None else n_process
+        docs = self.nlp.pipe((document.abstract for document in documents),
+                             batch_size=self.batch_size, n_process=n_process or 1)
+        return normalise_rows(np.array([doc.vector for doc in docs], dtype=np.float32))
+
+    def _append(self, arxiv_ids, vectors):
+        """ Store the vectors of newly-parsed documents, growing the
+        buffer geometrically so that adding n documents costs O(n)
+        copies in total.
 
         """
-        nlp = self.pretrained_data['nlp']
-        self.parsed_text_a = nlp(self.text_a)
-        self.parsed_text_b = nlp(self.text_b)
-        return self.parsed_text_a.similarity(self.parsed_text_b)
-
-    def set_pretrained_data(self):
-        self.pretrained_data = {'nlp': SPACY_EN_CORE_WEB_SM}
-
-
-if __name__ == "__main__":
-    import bson.json_util
-    from bson.json_util import RELAXED_JSON_OPTIONS
-    with open("../../data/maths_short.json") as flines:
-        maths = bson.json_util.loads(flines.read(), json_options=RELAXED_JSON_OPTIONS)
-    with open("../../data/materials_short.json") as flines:
-        materials = bson.json_util.loads(flines.read())
-    with open("../../data/physics_short.json") as flines:
-        physics = bson.json_util.loads(flines.read())
-
-    columns = ["id", "description", "label"]
-    data = []
-    for doc in maths:
-        data.append(Document(doc))
-        # data.append([
-        #     doc["arxiv_id"],
-        #     max(doc['description'], key=len).replace("\n", " ").strip(),
-        #     "maths"
-        # ])
-    for doc in materials:
-        data.append(Document(doc))
-
-        # data.append([
-        #     doc["arxiv_id"],
-        #     max(doc['description'], key=len).replace("\n", " ").strip(),
-        #     "materials"
-        # ])
-    for doc in physics:
-        data.append(Document(doc))
-
-        # data.append([
-        #     doc["arxiv_id"],
-        #     max(doc['description'], key=len).replace("\n", " ").strip(),
-        #     "physics"
-        # ])
-
-    square = []
-    for i, doc in enumerate(data):
-        squareRow = []
-        for j, doc2 in enumerate(data):
-            print(i,j)
-            similarity = SpacySimilarityEngine(doc, doc2).similarity
-            squareRow.append(similarity)
-            print(squareRow)
-    # print(doc1.text, doc2.text, similarity)
-        square.append(squareRow)
-    with open("square.txt", "w") as flines:
-        flines.write("\n".join(" ".join(map(str, x)) for x in square))
+        start = len(self.rows)
+        stop = start + len(arxiv_ids)
+        if stop > len(self._buffer):
+            buffer = np.empty((max(stop, 2 * len(self._buffer)), vectors.shape[1]), dtype=np.float32)
+            if start:
+                buffer[:start] = self._buffer[:start]
+            self._buffer = buffer
+        self._buffer[start:stop] = vectors
+        self.rows.update((arxiv_id, start + ind) for ind, arxiv_id in enumerate(arxiv_ids))
+
+    def vectors_of(self, documents, n_process=None):
+        """ Look up the vectors of a batch of documents, first parsing
+        any that have not been seen before through nlp.pipe. Documents
+        without an arXiv ID cannot be looked up later, so they are
+        parsed every time and not stored.
+
+        Parameters:
+            documents (:obj:`list` of :obj:`document.Document`): the
+                documents to look up.
+
+        Keyword arguments:
+            n_process (int): number of processes for nlp.pipe, by
+                default self.n_process.
+
+        Returns:
+            numpy.ndarray: the unit-normalised vector of each document,
+                one row per document.
+
+        """
+        documents = list(documents)
+        arxiv_ids = [document.arxiv_id for document in documents]
+        new_documents = {}
+        unnamed = []
+        for ind, (arxiv_id, document) in enumerate(zip(arxiv_ids, documents)):
+            if arxiv_id is None:
+                unnamed.append(ind)
+            elif arxiv_id not in self.rows:
+                new_documents.setdefault(arxiv_id, document)
+
+        unnamed_vectors = None
+        if new_documents or unnamed:
+            parsed = self._pipe(list(new_documents.values()) + [documents[ind] for ind in unnamed], n_process)
+            if new_documents:
+                self._append(list(new_documents), parsed[:len(new_documents)])
+            unnamed_vectors = parsed[len(new_documents):]
+
+        if not unnamed:
+            return self.vectors[[self.rows[arxiv_id] for arxiv_id in arxiv_ids]]
+        result = np.empty((len(documents), unnamed_vectors.shape[1]), dtype=np.float32)
+        named = [ind for ind, arxiv_id in enumerate(arxiv_ids) if arxiv_id is not None]
+        result[named] = self.vectors[[self.rows[arxiv_ids[ind]] for ind in named]]
+        result[unnamed] = unnamed_vectors
+        return result
+
+    def _save_state(self):
+        """ Save the pipeline settings, and the vectors of the documents
+        parsed so far along with their arXiv IDs.
+
+        """
+        params = {'model_name': self.model_name,
+                  'batch_size': self.batch_size,
+                  'n_process': self.n_process,
+                  'arxiv_ids': list(self.rows)}
+        return params, {'vectors': self.vectors}
+
+    def _load_state(self, params, arrays):
+        """ Restore the pipeline settings and parsed vectors; the
+        pipeline itself is loaded on first use.
+
+        """
+        self.model_name = params['model_name']
+        self.batch_size = params['batch_size']
+        self.n_process = params['n_process']
+        self._buffer = arrays['vectors']
+        self.rows = {arxiv_id: row for row, arxiv_id in enumerate(params['arxiv_ids'])}
+
+    def fingerprint(self):
+        """ Identify the engine by its pipeline alone, since the vector
+        of a document does not depend on which other documents have been
+        parsed.
+
+        """
+        digest = hashlib.sha1(f'{type(self).__name__}:{self.model_name}'.encode())
+        return digest.hexdigest()[:16]
+
+    def parse_document(self, document):
+        """ Parse a single document into its unit-normalised vector. """
+        return self.vectors_of([document])[0]
+
+    def document_parser(self, workers=None, chunk_size=256):
+        """ Parse documents through nlp.pipe, using workers as its
+        n_process.
+
+        """
+        return SpacyDocumentParser(self, workers=workers, chunk_size=chunk_size)
+
+    def get_similarity(self, document_a, document_b):
+        """ Calculate the cosine similarity of two documents. """
+        return float(np.dot(document_a.parsed(self), document_b.parsed(self)))
+
+    def get_similarity_matrix(self, documents_a, documents_b=None):
+        """ Calculate the similarity between every pair of documents,
+        as a blocked matrix product of their vectors.
+
+        """
+        if documents_b is None:
+            return blocked_dot(self.vectors_of(documents_a))
+        return blocked_dot(self.vectors_of(documents_a), self.vectors_of(documents_b))
+
+    def get_packed_similarity_matrix(self, documents):
+        """ Calculate the similarity between every pair of documents,
+        computing only the upper triangle; see packed_dot.
+
+        """
+        return packed_dot(self.vectors_of(documents))
+
+
+if __name__ == '__main__':
+    import json
+    from pubstomp.document import Document
+    from pubstomp.similarity.similarity import unpack_triangle
+
+    documents = []
+    for fname in ('../../data/maths_short.json', '../../data/materials_short.json', '../../data/physics_short.json'):
+        with open(fname) as f:
+            documents.extend(Document(record) for record in json.load(f))
+
+    sim_engine = SpacySimilarityEngine(documents)
+    square = unpack_triangle(sim_engine.get_packed_similarity_matrix(documents), len(documents))
+    np.savetxt('square.txt', square)
     print(square)
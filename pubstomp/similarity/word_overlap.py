@@ -0,0 +1,193 @@
+""" This module implements the best-match word overlap ("soft cosine")
+similarity between abstracts, in which each word of the shorter
+abstract is matched to its most similar word of the other, using GloVe
+word vectors. Overlaps are computed on demand from the word vectors of
+the two abstracts only, so the vocabulary x vocabulary matrix of word
+overlaps is never built.
+
+"""
+
+import numpy as np
+
+from pubstomp.similarity.similarity import DocumentParser
+from pubstomp.similarity.glove import GloveSimilarityEngine, clean_abstract, make_abstract
+
+
+def word_overlap(abstract_a, abstract_b, embeddings):
+    """ Calculate the overlap between two abstracts: the sum, over each
+    word of the abstract with fewer distinct words, of its largest dot
+    product with a word of the other abstract, divided by the product
+    of the abstract norms.
+
+    Parameters:
+        abstract_a (dict): the 'indices' of its distinct words, and its
+            'norm', see glove.make_abstract.
+        abstract_b (dict): as abstract_a.
+        embeddings (numpy.ndarray): the (vocab, dim) word vectors.
+
+    Returns:
+        float: the overlap, 0 if either abstract has no known words.
+
+    """
+    if len(abstract_a['indices']) > len(abstract_b['indices']):
+        abstract_a, abstract_b = abstract_b, abstract_a
+    if not len(abstract_a['indices']):
+        return 0.0
+
+    overlaps = embeddings[abstract_a['indices']] @ embeddings[abstract_b['indices']].T
+    return float(overlaps.max(axis=1).sum() / (abstract_a['norm'] * abstract_b['norm']))
+
+
+# overlap of a padding word with any word, far below any real overlap
+PADDING_OVERLAP = -1e30
+
+
+def pad_indices(abstracts):
+    """ Pack the word indices of several abstracts into one padded array.
+
+    Parameters:
+        abstracts (:obj:`list` of :obj:`dict`): see glove.make_abstract.
+
+    Returns:
+        (numpy.ndarray, numpy.ndarray): array of shape (num_abstracts,
+            max_words) of word indices, padded with 0, and the boolean
+            mask of the entries that are real words.
+
+    """
+    lengths = np.array([len(abstract['indices']) for abstract in abstracts], dtype=np.intp)
+    mask = np.arange(max(lengths.max(initial=0), 1)) < lengths[:, None]
+    indices = np.zeros(mask.shape, dtype=np.intp)
+    if len(abstracts):
+        indices[mask] = np.concatenate([abstract['indices'] for abstract in abstracts])
+    return indices, mask
+
+
+def _padded_vectors(embeddings, indices, mask, side):
+    """ Gather the word vectors of a padded index array, with two extra
+    coordinates chosen so that the dot product of a padding word of one
+    side with any word of the other side is PADDING_OVERLAP, while real
+    words keep their overlaps. This masks the padding inside the matrix
+    product itself.
+
+    """
+    vectors = np.zeros(indices.shape + (embeddings.shape[1] + 2,), dtype=embeddings.dtype)
+    vectors[..., :-2] = embeddings[indices]
+    padding = ~mask
+    if side == 'a':
+        vectors[..., -2] = np.where(padding, PADDING_OVERLAP, 0)
+        vectors[..., -1] = 1
+    else:
+        vectors[..., -2] = 1
+        vectors[..., -1] = np.where(padding, PADDING_OVERLAP, 0)
+    return vectors.reshape(-1, vectors.shape[-1])
+
+
+def word_overlap_matrix(abstracts_a, abstracts_b, embeddings, block_size=32):
+    """ Calculate the word overlap between every pair of abstracts drawn
+    from the two lists, with one matrix product per block of pairs over
+    padded index arrays, rather than one per pair. Only the word vectors
+    of the abstracts in the current blocks are gathered, and abstracts
+    are blocked in order of length to keep padding to a minimum.
+
+    Parameters:
+        abstracts_a (:obj:`list` of :obj:`dict`): see glove.make_abstract.
+        abstracts_b (:obj:`list` of :obj:`dict`): as abstracts_a.
+        embeddings (numpy.ndarray): the (vocab, dim) word vectors.
+
+    Keyword arguments:
+        block_size (int): number of abstracts per block of each list.
+
+    Returns:
+        numpy.ndarray: matrix of shape (len(abstracts_a), len(abstracts_b))
+            with element [i, j] = word_overlap(abstracts_a[i], abstracts_b[j]).
+
+    """
+    result = np.zeros((len(abstracts_a), len(abstracts_b)), dtype=embeddings.dtype)
+    lengths_a = np.array([len(abstract['indices']) for abstract in abstracts_a], dtype=np.intp)
+    lengths_b = np.array([len(abstract['indices']) for abstract in abstracts_b], dtype=np.intp)
+    norms_a = np.array([abstract['norm'] for abstract in abstracts_a], dtype=embeddings.dtype)
+    norms_b = np.array([abstract['norm'] for abstract in abstracts_b], dtype=embeddings.dtype)
+    order_a = np.argsort(lengths_a, kind='stable')
+    order_b = np.argsort(lengths_b, kind='stable')
+
+    blocks_b = []
+    for start_b in range(0, len(abstracts_b), block_size):
+        rows_b = order_b[start_b:start_b + block_size]
+        indices_b, mask_b = pad_indices([abstracts_b[row] for row in rows_b])
+        blocks_b.append((rows_b, mask_b, _padded_vectors(embeddings, indices_b, mask_b, 'b')))
+
+    for start_a in range(0, len(abstracts_a), block_size):
+        rows_a = order_a[start_a:start_a + block_size]
+        indices_a, mask_a = pad_indices([abstracts_a[row] for row in rows_a])
+        vectors_a = _padded_vectors(embeddings, indices_a, mask_a, 'a')
+        for rows_b, mask_b, vectors_b in blocks_b:
+            # overlaps[i, l, j, m] is the overlap of word l of a_i with word m of b_j
+            overlaps = (vectors_a @ vectors_b.T).reshape(mask_a.shape + mask_b.shape)
+
+            # best match of each word of a_i in b_j, summed over a_i, and vice versa
+            best_a = np.einsum('ilj,il->ij', overlaps.max(axis=3), mask_a)
+            best_b = np.einsum('ijm,jm->ij', overlaps.max(axis=1), mask_b)
+
+            block_lengths_a = lengths_a[rows_a][:, None]
+            block_lengths_b = lengths_b[rows_b][None, :]
+            block = np.where(block_lengths_a <= block_lengths_b, best_a, best_b)
+            empty = (block_lengths_a == 0) | (block_lengths_b == 0)
+            with np.errstate(invalid='ignore', divide='ignore'):
+                block = block / (norms_a[rows_a][:, None] * norms_b[rows_b][None, :])
+            result[np.ix_(rows_a, rows_b)] = np.where(empty, 0, block)
+
+    return result
+
+
+class WordOverlapSimilarityEngine(GloveSimilarityEngine):
+    """ Measures the similarity of two abstracts by best-match word
+    overlap of their GloVe word vectors (see word_overlap), rather than
+    by the cosine of their mean vectors. Training, updating and saving
+    are inherited from GloveSimilarityEngine; documents are parsed into
+    the indices of their distinct known words and their norm.
+
+    The overlap matches the words of the abstract with fewer distinct
+    words, or of the first abstract for ties, so it is not symmetric.
+
+    Parameters:
+        documents (:obj:`list` of :obj:`document.Document`): documents to
+            train the word vectors on.
+
+    Keyword arguments:
+        glove_dir (str): see GloveSimilarityEngine.
+
+    """
+    symmetric = False
+    block_size = 32
+
+    def parse_document(self, document):
+        """ Parse a document into the indices of its distinct known
+        words and its norm.
+
+        """
+        abstract = make_abstract(clean_abstract(document.abstract), self.word_vectors)
+        del abstract['string']
+        return abstract
+
+    def document_parser(self, workers=None, chunk_size=256):
+        """ Parse documents serially: parsed documents are word indices,
+        not vectors.
+
+        """
+        return DocumentParser(self, workers=workers, chunk_size=chunk_size)
+
+    def get_similarity(self, document_a, document_b):
+        """ Calculate the word overlap between two documents. """
+        return word_overlap(document_a.parsed(self), document_b.parsed(self), self.embeddings)
+
+    def get_similarity_matrix(self, documents_a, documents_b=None):
+        """ Calculate the word overlap between every pair of documents,
+        in blocks; see word_overlap_matrix.
+
+        """
+        abstracts_a = [document.parsed(self) for document in documents_a]
+        if documents_b is None:
+            abstracts_b = abstracts_a
+        else:
+            abstracts_b = [document.parsed(self) for document in documents_b]
+        return word_overlap_matrix(abstracts_a, abstracts_b, self.embeddings, block_size=self.block_size)
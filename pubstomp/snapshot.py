@@ -0,0 +1,418 @@
+""" This module implements an offline, columnar snapshot of a
+collection of arXiv records, so that analytics and training can run
+straight from disk without a database.
+
+A snapshot is a directory of column files plus a meta.json file
+describing them, written last:
+
+    * text columns (arxiv_id, title, abstract) are stored as one UTF-8
+      byte stream with int64 offsets, <name>.offsets.bin, such that row
+      i is stream[offsets[i]:offsets[i + 1]]. The stream is cut into
+      chunks of chunk_rows rows (see meta.json), each compressed with
+      zlib and written back to back to <name>.data.z, with the int64
+      position of each compressed chunk in <name>.chunks.bin, so that a
+      row is read by decompressing only its own chunk;
+    * subjects are dictionary-encoded: the distinct subjects are listed in
+      meta.json, and each row's subjects are int32 codes in
+      subject.codes.bin, with offsets in subject.offsets.bin;
+    * the version dates of each row are datetime64[D] values in
+      dates.values.bin, with offsets in dates.offsets.bin;
+    * header_date is one datetime64[D] per row in header_date.bin,
+      NaT if missing.
+
+Every column file is memory-mapped read-only by Snapshot, so several
+processes share the same pages and nothing is read until it is used.
+The numeric columns are left uncompressed so that analytics such as
+subject_counts run directly on the mapped arrays; the text columns make
+up most of a snapshot and compress several-fold.
+
+"""
+
+import datetime
+import json
+import os
+import zlib
+
+import numpy as np
+
+from pubstomp.document import Document, DocumentBatch
+from pubstomp.text import normalise_whitespace
+
+SNAPSHOT_FORMAT_VERSION = 2
+TEXT_COLUMNS = ('arxiv_id', 'title', 'abstract')
+# rows per compressed chunk of a text column
+CHUNK_ROWS = 256
+OFFSETS_DTYPE = np.dtype('<i8')
+CODES_DTYPE = np.dtype('<i4')
+DATE_DTYPE = np.dtype('datetime64[D]')
+
+
+def to_datetime64(value):
+    """ Convert a date from a record to a numpy datetime64[D].
+
+    Parameters:
+        value: a datetime.date/datetime, an ISO 8601 string, or a
+            MongoDB extended JSON date, e.g. {'$date': '2019-01-01T00:00:00Z'}.
+
+    Returns:
+        numpy.datetime64: the date, or NaT if value is None.
+
+    """
+    if value is None:
+        return np.datetime64('NaT', 'D')
+    if isinstance(value, dict):
+        value = value['$date']
+    if isinstance(value, datetime.datetime):
+        value = value.date()
+    elif isinstance(value, str):
+        value = value[:10]
+    return np.datetime64(value, 'D')
+
+
+class SnapshotWriter:
+    """ Writes records to a new snapshot one at a time, appending to
+    each column file as it goes, so that exporting a whole collection
+    only holds the offsets and the subject dictionary in memory. Use as
+    a context manager, or call close to write meta.json.
+
+    Parameters:
+        path (str): directory to write the snapshot into, created if missing.
+
+    Keyword arguments:
+        chunk_rows (int): number of rows per compressed chunk of each
+            text column.
+        compress_level (int): zlib compression level.
+
+    """
+    def __init__(self, path, chunk_rows=CHUNK_ROWS, compress_level=6):
+        self.path = path
+        self.chunk_rows = chunk_rows
+        self.compress_level = compress_level
+        os.makedirs(path, exist_ok=True)
+        meta_fname = os.path.join(path, 'meta.json')
+        if os.path.isfile(meta_fname):
+            os.remove(meta_fname)
+
+        self._files = {}
+        self._offsets = {}
+        self._chunk_buffers = {}
+        self._chunk_positions = {}
+        for name in TEXT_COLUMNS:
+            self._files[name] = open(os.path.join(path, f'{name}.data.z'), 'wb')
+            self._offsets[name] = [0]
+            self._chunk_buffers[name] = []
+            self._chunk_positions[name] = [0]
+        for name, fname in (('subject', 'subject.codes.bin'), ('dates', 'dates.values.bin')):
+            self._files[name] = open(os.path.join(path, fname), 'wb')
+            self._offsets[name] = [0]
+        self._files['header_date'] = open(os.path.join(path, 'header_date.bin'), 'wb')
+
+        self.subjects = {}
+        self.num_documents = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc_info):
+        if exc_type is None:
+            self.close()
+        else:
+            for f in self._files.values():
+                f.close()
+
+    def add(self, record):
+        """ Append a single record.
+
+        Parameters:
+            record (dict): an arXiv record, e.g. as stored in MongoDB.
+                Missing fields are stored as empty strings, empty lists
+                or NaT.
+
+        """
+        texts = {'arxiv_id': record.get('arxiv_id') or '',
+                 'title': normalise_whitespace(record.get('title') or ''),
+                 'abstract': Document(record).abstract if record.get('description') else ''}
+        for name, text in texts.items():
+            data = text.encode('utf-8')
+            self._chunk_buffers[name].append(data)
+            self._offsets[name].append(self._offsets[name][-1] + len(data))
+            if len(self._chunk_buffers[name]) >= self.chunk_rows:
+                self._write_chunk(name)
+
+        codes = [self.subjects.setdefault(subject, len(self.subjects))
+                 for subject in record.get('subject') or ()]
+        self._files['subject'].write(np.asarray(codes, dtype=CODES_DTYPE).tobytes())
+        self._offsets['subject'].append(self._offsets['subject'][-1] + len(codes))
+
+        dates = [to_datetime64(date) for date in record.get('dates') or ()]
+        self._files['dates'].write(np.asarray(dates, dtype=DATE_DTYPE).tobytes())
+        self._offsets['dates'].append(self._offsets['dates'][-1] + len(dates))
+
+        header_date = to_datetime64(record.get('header_date'))
+        self._files['header_date'].write(np.asarray([header_date], dtype=DATE_DTYPE).tobytes())
+
+        self.num_documents += 1
+
+    def _write_chunk(self, name):
+        """ Compress and write the buffered rows of a text column. """
+        data = zlib.compress(b''.join(self._chunk_buffers[name]), self.compress_level)
+        self._files[name].write(data)
+        self._chunk_positions[name].append(self._chunk_positions[name][-1] + len(data))
+        self._chunk_buffers[name] = []
+
+    def add_many(self, records):
+        """ Append every record of an iterable. """
+        for record in records:
+            self.add(record)
+
+    def close(self):
+        """ Write the offsets and meta.json, completing the snapshot. """
+        for name in TEXT_COLUMNS:
+            if self._chunk_buffers[name]:
+                self._write_chunk(name)
+            np.asarray(self._chunk_positions[name], dtype=OFFSETS_DTYPE).tofile(
+                os.path.join(self.path, f'{name}.chunks.bin'))
+        for f in self._files.values():
+            f.close()
+        for name, offsets in self._offsets.items():
+            np.asarray(offsets, dtype=OFFSETS_DTYPE).tofile(os.path.join(self.path, f'{name}.offsets.bin'))
+
+        meta = {'format_version': SNAPSHOT_FORMAT_VERSION,
+                'num_documents': self.num_documents,
+                'chunk_rows': self.chunk_rows,
+                'subjects': sorted(self.subjects, key=self.subjects.get)}
+        tmp_fname = os.path.join(self.path, 'meta.json.tmp')
+        with open(tmp_fname, 'w') as f:
+            json.dump(meta, f)
+        os.replace(tmp_fname, os.path.join(self.path, 'meta.json'))
+
+
+def export_records(records, path):
+    """ Write an iterable of records to a new snapshot.
+
+    Parameters:
+        records (iterable of dict): e.g. a MongoDB cursor.
+        path (str): directory to write the snapshot into.
+
+    Returns:
+        int: the number of records written.
+
+    """
+    with SnapshotWriter(path) as writer:
+        writer.add_many(records)
+    return writer.num_documents
+
+
+def export_collection(collection, path, batch_size=1000):
+    """ Write every record of a MongoDB collection to a new snapshot,
+    requesting only the snapshotted fields.
+
+    Parameters:
+        collection (pymongo.collection.Collection): the collection to export.
+        path (str): directory to write the snapshot into.
+
+    Keyword arguments:
+        batch_size (int): number of records per cursor batch.
+
+    Returns:
+        int: the number of records written.
+
+    """
+    fields = ('arxiv_id', 'title', 'description', 'subject', 'dates', 'header_date')
+    projection = {field: 1 for field in fields}
+    projection['_id'] = 0
+    return export_records(collection.find({}, projection, batch_size=batch_size), path)
+
+
+class Snapshot:
+    """ Read-only, memory-mapped access to a snapshot written by
+    SnapshotWriter.
+
+    Parameters:
+        path (str): directory of the snapshot.
+
+    Attributes:
+        self.subjects (:obj:`list` of :obj:`str`): the subject dictionary,
+            indexed by subject code.
+
+    """
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, 'meta.json')) as f:
+            meta = json.load(f)
+        if meta['format_version'] != SNAPSHOT_FORMAT_VERSION:
+            raise ValueError(f'Snapshot at {path} has format version {meta["format_version"]}, '
+                             f'expected {SNAPSHOT_FORMAT_VERSION}.')
+        self.num_documents = meta['num_documents']
+        self.chunk_rows = meta['chunk_rows']
+        self.subjects = meta['subjects']
+        self._columns = {}
+        # the last decompressed chunk of each text column, as (chunk, data)
+        self._chunks = {}
+
+    def _column(self, fname, dtype):
+        """ Memory-map a column file, once. """
+        if fname not in self._columns:
+            full_fname = os.path.join(self.path, fname)
+            if os.path.getsize(full_fname) == 0:
+                self._columns[fname] = np.empty(0, dtype=dtype)
+            else:
+                self._columns[fname] = np.memmap(full_fname, dtype=dtype, mode='r')
+        return self._columns[fname]
+
+    def offsets(self, name):
+        """ The offsets of a text or multi-valued column. """
+        return self._column(f'{name}.offsets.bin', OFFSETS_DTYPE)
+
+    def __len__(self):
+        return self.num_documents
+
+    def _chunk(self, name, chunk):
+        """ Decompress a chunk of a text column, keeping the last one
+        of each column so that sequential reads decompress each once.
+
+        """
+        cached = self._chunks.get(name)
+        if cached is None or cached[0] != chunk:
+            positions = self._column(f'{name}.chunks.bin', OFFSETS_DTYPE)
+            compressed = self._column(f'{name}.data.z', np.uint8)[positions[chunk]:positions[chunk + 1]]
+            cached = (chunk, zlib.decompress(compressed))
+            self._chunks[name] = cached
+        return cached[1]
+
+    def text(self, name, ind):
+        """ Get row ind of the text column name, e.g. 'abstract'. """
+        offsets = self.offsets(name)
+        chunk = ind // self.chunk_rows
+        data = self._chunk(name, chunk)
+        start = offsets[chunk * self.chunk_rows]
+        return data[offsets[ind] - start:offsets[ind + 1] - start].decode('utf-8')
+
+    def arxiv_id(self, ind):
+        """ Get the arXiv ID of row ind. """
+        return self.text('arxiv_id', ind)
+
+    def abstract(self, ind):
+        """ Get the whitespace-normalised abstract of row ind. """
+        return self.text('abstract', ind)
+
+    def title(self, ind):
+        """ Get the title of row ind. """
+        return self.text('title', ind)
+
+    @property
+    def subject_codes(self):
+        """ The subject codes of every row, back to back. """
+        return self._column('subject.codes.bin', CODES_DTYPE)
+
+    @property
+    def date_values(self):
+        """ The version dates of every row, back to back. """
+        return self._column('dates.values.bin', DATE_DTYPE)
+
+    @property
+    def header_dates(self):
+        """ The header date of each row. """
+        return self._column('header_date.bin', DATE_DTYPE)
+
+    def subjects_of(self, ind):
+        """ Get the subjects of row ind. """
+        offsets = self.offsets('subject')
+        return [self.subjects[code] for code in self.subject_codes[offsets[ind]:offsets[ind + 1]]]
+
+    def dates_of(self, ind):
+        """ Get the version dates of row ind. """
+        offsets = self.offsets('dates')
+        return self.date_values[offsets[ind]:offsets[ind + 1]]
+
+    def subject_counts(self):
+        """ Count the rows with each subject.
+
+        Returns:
+            dict: mapping from subject to count.
+
+        """
+        counts = np.bincount(self.subject_codes, minlength=len(self.subjects))
+        return {subject: int(count) for subject, count in zip(self.subjects, counts)}
+
+    def rows_with_subject(self, subject):
+        """ Find the rows that have the given subject.
+
+        Returns:
+            numpy.ndarray: the sorted row indices.
+
+        """
+        try:
+            code = self.subjects.index(subject)
+        except ValueError:
+            return np.empty(0, dtype=np.intp)
+        positions = np.flatnonzero(self.subject_codes == code)
+        return np.unique(np.searchsorted(self.offsets('subject'), positions, side='right') - 1)
+
+    def first_dates(self):
+        """ Get the earliest version date of each row, NaT for rows
+        without dates.
+
+        """
+        offsets = np.asarray(self.offsets('dates'))
+        first = np.full(self.num_documents, np.datetime64('NaT'), dtype=DATE_DTYPE)
+        has_dates = np.diff(offsets) > 0
+        if has_dates.any():
+            values = np.asarray(self.date_values).view(np.int64)
+            first[has_dates] = np.minimum.reduceat(values, offsets[:-1][has_dates]).view(DATE_DTYPE)
+        return first
+
+    def year_counts(self):
+        """ Count the rows by the year of their earliest version.
+
+        Returns:
+            dict: mapping from year to count, in increasing year order.
+
+        """
+        first = self.first_dates()
+        years = first[~np.isnat(first)].astype('datetime64[Y]').astype(np.int64) + 1970
+        if not len(years):
+            return {}
+        counts = np.bincount(years - years.min())
+        return {int(years.min()) + ind: int(count) for ind, count in enumerate(counts) if count}
+
+    def record(self, ind):
+        """ Rebuild the record of row ind, with the fields read by Document. """
+        return {'arxiv_id': self.arxiv_id(ind),
+                'title': self.title(ind),
+                'description': [self.abstract(ind)],
+                'subject': self.subjects_of(ind),
+                'dates': [date.astype(datetime.date) for date in self.dates_of(ind)]}
+
+    def document_batch(self, start=0, stop=None):
+        """ Get rows start to stop as a DocumentBatch. """
+        stop = self.num_documents if stop is None else min(stop, self.num_documents)
+        arxiv_ids = [self.arxiv_id(ind) for ind in range(start, stop)]
+        abstracts = [self.abstract(ind) for ind in range(start, stop)]
+        offsets = np.zeros(len(abstracts) + 1, dtype=np.int64)
+        np.cumsum([len(abstract) for abstract in abstracts], out=offsets[1:])
+        return DocumentBatch(np.array(arxiv_ids, dtype=str), offsets, ''.join(abstracts))
+
+    def iter_document_batches(self, batch_size=1000, rows=None):
+        """ Stream the snapshot as lists of Document, like
+        pubstomp.store.iter_document_batches.
+
+        Keyword arguments:
+            batch_size (int): number of documents per list.
+            rows (numpy.ndarray): only these rows, e.g. from
+                rows_with_subject; by default every row.
+
+        Yields:
+            :obj:`list` of :obj:`document.Document`: up to batch_size documents.
+
+        """
+        if rows is None:
+            rows = range(self.num_documents)
+        batch = []
+        for ind in rows:
+            batch.append(Document(self.record(ind)))
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
@@ -0,0 +1,289 @@
+""" This module implements aggregate statistics of a corpus of arXiv
+records (counts by subject, by year and by subject and year) and an
+inverted index from each subject to the arXiv IDs filed under it,
+kept up to date as records are ingested rather than recomputed by
+scanning the whole collection. Statistics are persisted as a JSON
+file, compacted now and then, plus an append-only log of the records
+added since.
+
+"""
+
+import collections
+import json
+import os
+
+import numpy as np
+
+from pubstomp.snapshot import to_datetime64
+
+STATS_FORMAT_VERSION = 2
+DEFAULT_STATS_FNAME = 'corpus_stats.json'
+# the fields of a record read by CorpusStats
+STATS_FIELDS = ('arxiv_id', 'subject', 'dates')
+
+
+def record_year(record):
+    """ The year of the earliest version of a record, or None if it has
+    no dates.
+
+    """
+    dates = [to_datetime64(date) for date in record.get('dates') or ()]
+    if not dates:
+        return None
+    return int(min(dates).astype('datetime64[Y]').astype(np.int64)) + 1970
+
+
+class CorpusStats:
+    """ Incrementally-updated aggregates of a corpus. Records are keyed
+    by arXiv ID, and a record whose ID has already been added is not
+    re-counted, so adding the same records again (e.g. a re-harvested
+    page) is harmless; revisions of existing records are not counted.
+
+    When persisted to path, commit appends the records added since the
+    last commit to the log file path + '.log', one JSON line per commit,
+    so that each commit costs I/O proportional to its records rather
+    than to the corpus. Once the log grows past compact_bytes, or when
+    save is called, the statistics are written to path in full and the
+    log is emptied. Loading replays the log over the compacted file;
+    replays are idempotent, and a partial last line left by a crash is
+    ignored and overwritten by the next commit.
+
+    Keyword arguments:
+        path (str): JSON file to persist the statistics to, loaded (with
+            its log) if it already exists.
+        compact_bytes (int): size of the log beyond which commit
+            compacts it into the JSON file.
+
+    Attributes:
+        self.num_documents (int): the number of records added.
+        self.subject_counts (collections.Counter): records per subject.
+        self.year_counts (collections.Counter): records per year of
+            first version.
+        self.subject_year_counts (dict): records per year of first
+            version, as a Counter for each subject.
+        self.postings (dict): the arXiv IDs of the records with each
+            subject, in order of addition.
+        self.arxiv_ids (set): the arXiv IDs of all records added.
+
+    """
+    def __init__(self, path=None, compact_bytes=64 * 2**20):
+        self.path = path
+        self.compact_bytes = compact_bytes
+        self.num_documents = 0
+        self.subject_counts = collections.Counter()
+        self.year_counts = collections.Counter()
+        self.subject_year_counts = collections.defaultdict(collections.Counter)
+        self.postings = collections.defaultdict(list)
+        self.arxiv_ids = set()
+        self._pending = []
+        # the size of the complete lines of the log
+        self._log_size = 0
+        if path is not None and (os.path.isfile(path) or os.path.isfile(path + '.log')):
+            self._load(path)
+
+    @property
+    def log_path(self):
+        return self.path + '.log'
+
+    def add(self, record):
+        """ Add a single record to the aggregates, unless a record with
+        the same arXiv ID has already been added.
+
+        Parameters:
+            record (dict): an arXiv record, with optional arxiv_id,
+                subject and dates fields.
+
+        Returns:
+            bool: whether the record was counted.
+
+        """
+        return self._add(record.get('arxiv_id'), list(record.get('subject') or ()), record_year(record))
+
+    def _add(self, arxiv_id, subjects, year):
+        """ Count a record from its arXiv ID, subjects and year. """
+        if arxiv_id is not None:
+            if arxiv_id in self.arxiv_ids:
+                return False
+            self.arxiv_ids.add(arxiv_id)
+        self._pending.append([arxiv_id, subjects, year])
+        self.num_documents += 1
+        if year is not None:
+            self.year_counts[year] += 1
+        for subject in subjects:
+            self.subject_counts[subject] += 1
+            if year is not None:
+                self.subject_year_counts[subject][year] += 1
+            if arxiv_id is not None:
+                self.postings[subject].append(arxiv_id)
+        return True
+
+    def add_many(self, records):
+        """ Add every record of an iterable to the aggregates.
+
+        Returns:
+            int: the number of records counted.
+
+        """
+        return sum(self.add(record) for record in records)
+
+    @classmethod
+    def from_snapshot(cls, snapshot, path=None):
+        """ Compute the statistics of a whole snapshot (see
+        pubstomp.snapshot.Snapshot) in bulk, e.g. to initialise them for
+        an existing collection.
+
+        """
+        stats = cls(path=None)
+        stats.path = path
+        stats.num_documents = len(snapshot)
+        first = snapshot.first_dates()
+        has_year = ~np.isnat(first)
+        years = np.zeros(len(snapshot), dtype=np.int64)
+        years[has_year] = first[has_year].astype('datetime64[Y]').astype(np.int64) + 1970
+        stats.year_counts.update({int(year): int(count) for year, count in
+                                  zip(*np.unique(years[has_year], return_counts=True))})
+
+        codes = np.asarray(snapshot.subject_codes)
+        rows = np.repeat(np.arange(len(snapshot)), np.diff(snapshot.offsets('subject')))
+        for code, count in enumerate(np.bincount(codes, minlength=len(snapshot.subjects))):
+            if count:
+                stats.subject_counts[snapshot.subjects[code]] = int(count)
+
+        keep = has_year[rows]
+        if keep.any():
+            pairs, counts = np.unique(np.stack([codes[keep], years[rows[keep]]]), axis=1, return_counts=True)
+            for (code, year), count in zip(pairs.T, counts):
+                stats.subject_year_counts[snapshot.subjects[code]][int(year)] = int(count)
+
+        arxiv_ids = [snapshot.arxiv_id(row) for row in range(len(snapshot))]
+        stats.arxiv_ids.update(arxiv_ids)
+        order = np.argsort(codes, kind='stable')
+        boundaries = np.flatnonzero(np.diff(codes[order])) + 1
+        for group in np.split(order, boundaries):
+            if len(group):
+                stats.postings[snapshot.subjects[codes[group[0]]]] = [arxiv_ids[row] for row in rows[group]]
+        return stats
+
+    @classmethod
+    def from_collection(cls, collection, path=None, batch_size=10000):
+        """ Compute the statistics of a whole MongoDB collection with one
+        projected scan, e.g. to initialise them before a harvest.
+
+        Parameters:
+            collection (pymongo.collection.Collection): the collection.
+
+        Keyword arguments:
+            path (str): file to persist the statistics to.
+            batch_size (int): number of records per cursor batch.
+
+        """
+        from pubstomp.store import iter_document_batches
+        stats = cls(path=None)
+        stats.path = path
+        for batch in iter_document_batches(collection, fields=STATS_FIELDS, batch_size=batch_size):
+            stats.add_many(document.record for document in batch)
+        stats._pending = []
+        return stats
+
+    @classmethod
+    def for_collection(cls, path, collection):
+        """ Load the statistics persisted at path, or if there are none
+        yet, compute them from the collection and save them.
+
+        """
+        if os.path.isfile(path) or os.path.isfile(path + '.log'):
+            return cls(path=path)
+        stats = cls.from_collection(collection, path=path)
+        stats.save()
+        return stats
+
+    def documents_with_subject(self, subject):
+        """ The arXiv IDs of the records with the given subject. """
+        return self.postings.get(subject, [])
+
+    def commit(self):
+        """ Persist the records added since the last commit by appending
+        them to the log, compacting it into the JSON file once it grows
+        past compact_bytes.
+
+        """
+        if self.path is None:
+            self._pending = []
+            return
+        if not self._pending:
+            return
+        if not os.path.isfile(self.path):
+            self.save()
+            return
+
+        data = (json.dumps(self._pending) + '\n').encode()
+        mode = 'r+b' if os.path.isfile(self.log_path) else 'wb'
+        with open(self.log_path, mode) as f:
+            f.seek(self._log_size)
+            f.write(data)
+            f.truncate()
+            f.flush()
+            os.fsync(f.fileno())
+        self._log_size += len(data)
+        self._pending = []
+        if self._log_size > self.compact_bytes:
+            self.save()
+
+    def save(self, path=None):
+        """ Write the statistics in full to a JSON file, atomically, and
+        empty the log.
+
+        Keyword arguments:
+            path (str): the file to write, by default self.path.
+
+        """
+        path = self.path if path is None else path
+        state = {'format_version': STATS_FORMAT_VERSION,
+                 'num_documents': self.num_documents,
+                 'subject_counts': self.subject_counts,
+                 'year_counts': self.year_counts,
+                 'subject_year_counts': self.subject_year_counts,
+                 'postings': self.postings,
+                 'arxiv_ids': sorted(self.arxiv_ids)}
+        tmp_fname = path + '.tmp'
+        with open(tmp_fname, 'w') as f:
+            json.dump(state, f)
+        os.replace(tmp_fname, path)
+        if path == self.path:
+            # replaying the log over the new file would only re-add known IDs
+            if os.path.isfile(self.log_path):
+                os.truncate(self.log_path, 0)
+            self._log_size = 0
+            self._pending = []
+
+    def _load(self, path):
+        """ Read statistics written by save, and replay their log. """
+        if os.path.isfile(path):
+            with open(path) as f:
+                state = json.load(f)
+            if state['format_version'] != STATS_FORMAT_VERSION:
+                raise ValueError(f'Statistics at {path} have format version {state["format_version"]}, '
+                                 f'expected {STATS_FORMAT_VERSION}.')
+            self.num_documents = state['num_documents']
+            self.subject_counts.update(state['subject_counts'])
+            self.year_counts.update({int(year): count for year, count in state['year_counts'].items()})
+            for subject, counts in state['subject_year_counts'].items():
+                self.subject_year_counts[subject].update({int(year): count for year, count in counts.items()})
+            self.postings.update(state['postings'])
+            self.arxiv_ids.update(state['arxiv_ids'])
+
+        if os.path.isfile(path + '.log'):
+            with open(path + '.log', 'rb') as f:
+                data = f.read()
+            self._log_size = data.rfind(b'\n') + 1
+            for line in data[:self._log_size].splitlines():
+                for arxiv_id, subjects, year in json.loads(line):
+                    self._add(arxiv_id, subjects, year)
+            self._pending = []
+
+    @classmethod
+    def load(cls, path):
+        """ Read statistics written by save and commit. """
+        if not os.path.isfile(path) and not os.path.isfile(path + '.log'):
+            raise FileNotFoundError(f'No statistics at {path}.')
+        return cls(path=path)
@@ -0,0 +1,148 @@
+""" This module implements batched reads of arXiv records from MongoDB,
+requesting only the fields that the similarity engines need and
+yielding Document objects one batch at a time, so that a pass over the
+whole corpus never holds the whole collection in memory.
+
+"""
+
+import pymongo
+
+from pubstomp.document import Document
+
+# the fields read by Document
+DOCUMENT_FIELDS = ('arxiv_id', 'description', 'title', 'subject')
+DEFAULT_BATCH_SIZE = 1000
+
+
+def get_collection(coll_name='arXiv_v1', db_name='pubstomp', **client_kwargs):
+    """ Connect to a collection of arXiv records.
+
+    Keyword arguments:
+        coll_name (str): name of the MongoDB collection.
+        db_name (str): name of the MongoDB database.
+
+    Other keyword arguments are passed to pymongo.MongoClient.
+
+    Returns:
+        pymongo.collection.Collection: the collection.
+
+    """
+    return pymongo.MongoClient(**client_kwargs)[db_name][coll_name]
+
+
+def ensure_indexes(collection):
+    """ Create the indexes that back the filters of make_query: one on
+    subject, one on header_date, and a compound index for subject
+    filters within a date range.
+
+    Parameters:
+        collection (pymongo.collection.Collection): the collection to index.
+
+    """
+    collection.create_index('subject')
+    collection.create_index('header_date')
+    collection.create_index([('subject', pymongo.ASCENDING), ('header_date', pymongo.ASCENDING)])
+
+
+def make_query(subjects=None, date_from=None, date_until=None):
+    """ Build a MongoDB filter on subject and header_date.
+
+    Keyword arguments:
+        subjects (:obj:`list` of :obj:`str`): keep records with any of
+            these subjects, e.g. 'Physics - Fluid Dynamics'.
+        date_from (datetime.datetime): keep records with header_date
+            on or after this date.
+        date_until (datetime.datetime): keep records with header_date
+            strictly before this date.
+
+    Returns:
+        dict: the filter.
+
+    """
+    query = {}
+    if subjects:
+        query['subject'] = {'$in': list(subjects)}
+    date_range = {}
+    if date_from is not None:
+        date_range['$gte'] = date_from
+    if date_until is not None:
+        date_range['$lt'] = date_until
+    if date_range:
+        query['header_date'] = date_range
+    return query
+
+
+def make_projection(fields=DOCUMENT_FIELDS):
+    """ Build a MongoDB projection returning only the given fields. """
+    projection = {field: 1 for field in fields}
+    projection['_id'] = 0
+    return projection
+
+
+def iter_document_batches(collection, subjects=None, date_from=None, date_until=None,
+                          fields=DOCUMENT_FIELDS, batch_size=DEFAULT_BATCH_SIZE, limit=0):
+    """ Stream the matching records of a collection as lists of Document.
+
+    Parameters:
+        collection (pymongo.collection.Collection): the collection to read.
+
+    Keyword arguments:
+        subjects, date_from, date_until: filters, see make_query.
+        fields (:obj:`tuple` of :obj:`str`): the fields to request.
+        batch_size (int): number of records per cursor batch, and per
+            yielded list.
+        limit (int): maximum number of records to read, 0 for all.
+
+    Yields:
+        :obj:`list` of :obj:`document.Document`: up to batch_size documents.
+
+    """
+    cursor = collection.find(make_query(subjects, date_from, date_until),
+                             make_projection(fields),
+                             batch_size=batch_size,
+                             limit=limit)
+    batch = []
+    try:
+        for record in cursor:
+            batch.append(Document(record))
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+    finally:
+        cursor.close()
+
+
+def iter_documents(collection, **kwargs):
+    """ Stream the matching records of a collection as Documents; takes
+    the same arguments as iter_document_batches.
+
+    """
+    for batch in iter_document_batches(collection, **kwargs):
+        yield from batch
+
+
+def sample_documents(collection, size, subjects=None, date_from=None, date_until=None,
+                     fields=DOCUMENT_FIELDS):
+    """ Draw a random sample of the matching records.
+
+    Parameters:
+        collection (pymongo.collection.Collection): the collection to read.
+        size (int): the number of documents to sample.
+
+    Keyword arguments:
+        subjects, date_from, date_until: filters, see make_query.
+        fields (:obj:`tuple` of :obj:`str`): the fields to request.
+
+    Returns:
+        :obj:`list` of :obj:`document.Document`: the sampled documents.
+
+    """
+    pipeline = []
+    query = make_query(subjects, date_from, date_until)
+    if query:
+        pipeline.append({'$match': query})
+    pipeline.append({'$sample': {'size': size}})
+    pipeline.append({'$project': make_projection(fields)})
+    return [Document(record) for record in collection.aggregate(pipeline)]
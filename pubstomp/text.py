@@ -0,0 +1,147 @@
+""" This module implements the text normalisation and tokenisation
+shared by the similarity engines, with precompiled regexes, a frozen
+stop list and a cached stemmer, and batch entry points that tokenise
+many abstracts in one call.
+
+"""
+
+import functools
+import os
+import re
+
+STOP_WORDS_FNAME = os.path.join(os.path.dirname(__file__), 'most_common.txt')
+
+WHITESPACE_RE = re.compile(r'\s+')
+# runs of characters between whitespace and sentence punctuation, keeping
+# internal full stops and apostrophes so that e.g. "e.g." stays one token
+_SEPARATORS = r'\s.,;:!?()\[\]"\''
+TOKEN_RE = re.compile(rf'[^{_SEPARATORS}]+(?:[.\'][^{_SEPARATORS}]+)*')
+# words containing any of these look more like punctuation, maths, etc.,
+# as used by direct.remove_non_words on whitespace-separated words
+NON_WORD_RE = re.compile(r"""[0-9,;_:'"`~=()<>\\|+\[\]{}.$*^]""")
+# the same test for the tokens of TOKEN_RE, which only contain full stops
+# and apostrophes between letters, as in "e.g." or "Hilbert's", and
+# should not be dropped for them
+TOKEN_NON_WORD_RE = re.compile(r"""[0-9,;_:"`~=()<>\\|+\[\]{}$*^]""")
+# GloVe vocabularies keep case and only lose line endings, commas and full stops
+GLOVE_TABLE = str.maketrans('\r\n', '  ', ',.')
+# marks the boundary between abstracts joined for batch tokenisation
+_BOUNDARY = '\x00'
+
+
+@functools.lru_cache(maxsize=None)
+def stop_words(fname=STOP_WORDS_FNAME):
+    """ Load a stop list, one word per line, once per process.
+
+    Keyword arguments:
+        fname (str): the stop list to load, by default the most common
+            English words shipped with pubstomp.
+
+    Returns:
+        frozenset: the stop words.
+
+    """
+    with open(fname) as f:
+        return frozenset(line.strip() for line in f if line.strip())
+
+
+@functools.lru_cache(maxsize=None)
+def _porter_stemmer():
+    from nltk.stem import PorterStemmer
+    return PorterStemmer()
+
+
+@functools.lru_cache(maxsize=2**18)
+def stem(word):
+    """ Porter-stem a word, caching the result, as abstracts reuse a
+    small vocabulary over and over.
+
+    """
+    return _porter_stemmer().stem(word)
+
+
+def normalise_whitespace(text):
+    """ Collapse all runs of whitespace, including line breaks, into
+    single spaces.
+
+    """
+    return WHITESPACE_RE.sub(' ', text).strip()
+
+
+def clean_for_glove(text):
+    """ Replace line endings with spaces and remove commas and full
+    stops, leaving tokens to be split on whitespace.
+
+    """
+    return text.translate(GLOVE_TABLE)
+
+
+class Tokenizer:
+    """ Configurable tokenisation pipeline: lower-casing, splitting into
+    word tokens, stop-word removal, removal of tokens that look like
+    numbers or maths, then stemming. Filtering and stemming are done
+    once per distinct token of a batch, rather than once per token.
+
+    Keyword arguments:
+        lower (bool): whether to lower-case the text.
+        stop_list (frozenset): tokens to drop before stemming, by default
+            the shipped stop list; pass an empty set to keep everything.
+        drop_non_words (bool): whether to drop tokens that contain
+            digits, maths or punctuation.
+        stem (bool): whether to Porter-stem the remaining tokens.
+
+    """
+    def __init__(self, lower=True, stop_list=None, drop_non_words=True, stem=True):
+        self.lower = lower
+        self._stop_list = None if stop_list is None else frozenset(stop_list)
+        self.drop_non_words = drop_non_words
+        self.stem = stem
+
+    @property
+    def stop_list(self):
+        """ The stop words, loading the shipped list on first use. """
+        if self._stop_list is None:
+            self._stop_list = stop_words()
+        return self._stop_list
+
+    def _normalise_token(self, token):
+        """ Map a raw token to its normalised form, or None to drop it. """
+        if token in self.stop_list:
+            return None
+        if self.drop_non_words and TOKEN_NON_WORD_RE.search(token):
+            return None
+        if self.stem:
+            return stem(token)
+        return token
+
+    def tokenize(self, text):
+        """ Tokenise a single piece of text.
+
+        Returns:
+            :obj:`list` of :obj:`str`: the normalised tokens, in order.
+
+        """
+        return self.tokenize_batch([text])[0]
+
+    def tokenize_batch(self, texts):
+        """ Tokenise many pieces of text with a single regex scan.
+
+        Parameters:
+            texts (:obj:`list` of :obj:`str`): e.g. abstracts.
+
+        Returns:
+            :obj:`list` of :obj:`list` of :obj:`str`: the normalised
+                tokens of each text, in order.
+
+        """
+        if not texts:
+            return []
+        joined = f' {_BOUNDARY} '.join(text.replace(_BOUNDARY, ' ') for text in texts)
+        if self.lower:
+            joined = joined.lower()
+
+        raw_tokens = [TOKEN_RE.findall(chunk) for chunk in joined.split(_BOUNDARY)]
+        mapping = {token: self._normalise_token(token) for token in set().union(*raw_tokens)}
+        # normalised tokens are never empty, so dropped ones are the only
+        # false values
+        return [list(filter(None, map(mapping.__getitem__, tokens))) for tokens in raw_tokens]
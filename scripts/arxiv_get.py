@@ -8,28 +8,57 @@ Links:
 
 """
 
+import argparse
 import datetime
+import io
+import json
+import queue
+import re
+import threading
 import time
 import logging
 import sys
+from concurrent.futures import ProcessPoolExecutor
 from xml.etree import ElementTree
 import pymongo
+import pymongo.errors
 import requests
 
+from pubstomp.stats import CorpusStats
+
+OAI_URL = 'http://export.arxiv.org/oai2'
+OAI = '{http://www.openarchives.org/OAI/2.0/}'
+STATE_COLLECTION = 'harvest_state'
+METRICS_FNAME = 'arxiv_get_metrics.jsonl'
+RESUMPTION_TOKEN_RE = re.compile(rb'<resumptionToken([^>]*?)(?:/>|>([^<]*)</resumptionToken>)')
+COMPLETE_LIST_SIZE_RE = re.compile(rb'completeListSize="(\d+)"')
+OAI_ERROR_RE = re.compile(rb'<error[^>]*code="([^"]+)"')
+# seconds to wait for the server to connect or send data, before retrying
+REQUEST_TIMEOUT = 60
+
 
 def start_scrape():
     """ Start scraping arXiv, with collection name optionally
-    grabbed from sys.argv[1].
+    grabbed from the command line.
 
     """
+    parser = argparse.ArgumentParser(description='Scrape arXiv metadata into MongoDB.')
+    parser.add_argument('collection', nargs='?', help='name of the MongoDB collection to scrape into')
+    parser.add_argument('--base_url', default=OAI_URL, help='the OAI-PMH endpoint to scrape')
+    parser.add_argument('--timeout', default=10, type=float, help='minimum time in seconds between requests')
+    parser.add_argument('--parsers', default=2, type=int, help='number of parser processes')
+    parser.add_argument('--sequential', action='store_true', help='fetch, parse and insert one page at a time')
+    parser.add_argument('--stats', help='JSON file of corpus statistics to keep up to date, computed from the collection if missing')
+    args = parser.parse_args()
+
     logging_setup()
-    try:
-        coll_name = sys.argv[1]
-    except IndexError:
-        coll_name = None
-    collection = mongo_setup(coll_name=coll_name)
-    recursive_arxiv_scrape(collection, hot_start=True,
-                           timeout=10)
+    collection = mongo_setup(coll_name=args.collection)
+    stats = CorpusStats.for_collection(args.stats, collection) if args.stats else None
+    if args.sequential:
+        arxiv_scrape(collection, hot_start=True, timeout=args.timeout, base_url=args.base_url, stats=stats)
+    else:
+        pipelined_arxiv_scrape(collection, hot_start=True, timeout=args.timeout,
+                               base_url=args.base_url, num_parsers=args.parsers, stats=stats)
 
 
 def logging_setup():
@@ -78,6 +107,7 @@ def mongo_setup(db_name='pubstomp', coll_name=None):
     msg = f'Creating MongoDB collection {coll_name} inside database {db_name}.'
     logging.debug(msg)
 
+    ensure_indexes(db[coll_name])
     return db[coll_name]
 
 
@@ -140,97 +170,627 @@ def parse_xml_record(xml_record):
     return record
 
 
-def recursive_arxiv_scrape(mongo_collection, resumption_token=None, timeout=10, num_failures=0, hot_start=False):
-    """ Recursively scrape arXiv's OAI metadata endpoint into a MongoDB collection.
+class BadResumptionTokenError(RuntimeError):
+    """ Raised when the OAI endpoint rejects a resumption token, e.g.
+    because it expired while the harvest was interrupted.
+
+    """
+
+
+def load_checkpoint(mongo_collection):
+    """ Load the resumption token checkpointed for a collection.
+
+    Parameters:
+        mongo_collection (pymongo.Collection): the collection being scraped into.
+
+    Returns:
+        str: the resumption token of the next page, or None.
+
+    """
+    state = mongo_collection.database[STATE_COLLECTION].find_one({'_id': mongo_collection.name})
+    if state is None:
+        return None
+    return state.get('resumption_token')
+
+
+def save_checkpoint(mongo_collection, resumption_token, header_date=None, progress=None):
+    """ Checkpoint the resumption token of the next page to fetch, or
+    clear it once the harvest is complete, and raise the pending
+    high-water mark of the current harvest to the latest header date
+    seen so far.
+
+    Parameters:
+        mongo_collection (pymongo.Collection): the collection being scraped into.
+        resumption_token (str): token of the next page, or None.
+
+    Keyword arguments:
+        header_date (datetime.datetime): latest header date of the page
+            just written.
+        progress (HarvestProgress): progress counters to store alongside.
+
+    """
+    update = {'$set': {'resumption_token': resumption_token,
+                       'updated': datetime.datetime.utcnow()}}
+    if progress is not None:
+        update['$set']['progress'] = progress.state()
+    if header_date is not None:
+        update['$max'] = {'pending_high_water_mark': header_date}
+    mongo_collection.database[STATE_COLLECTION].update_one(
+        {'_id': mongo_collection.name}, update, upsert=True)
+
+
+def load_high_water_mark(mongo_collection):
+    """ Find the latest header date covered by a completed harvest, from
+    which an incremental harvest should start.
+
+    Parameters:
+        mongo_collection (pymongo.Collection): the collection being scraped into.
+
+    Returns:
+        datetime.datetime: the high-water mark, or None for an empty collection.
+
+    """
+    state = mongo_collection.database[STATE_COLLECTION].find_one({'_id': mongo_collection.name})
+    if state is not None and state.get('high_water_mark') is not None:
+        return state['high_water_mark']
+
+    # fall back to the data itself for collections harvested before
+    # the high-water mark was tracked
+    last_doc = mongo_collection.find_one({}, {'header_date': 1}, sort=[('header_date', pymongo.DESCENDING)])
+    if last_doc is None:
+        return None
+    return last_doc.get('header_date')
+
+
+def commit_high_water_mark(mongo_collection):
+    """ Promote the pending high-water mark once a harvest has
+    completed. Until then, a harvest that has to restart its query
+    starts again from the previous high-water mark, as OAI does not
+    return records in date order.
+
+    Parameters:
+        mongo_collection (pymongo.Collection): the collection being scraped into.
+
+    """
+    states = mongo_collection.database[STATE_COLLECTION]
+    state = states.find_one({'_id': mongo_collection.name})
+    if state is None or state.get('pending_high_water_mark') is None:
+        return
+    high_water_mark = state['pending_high_water_mark']
+    states.update_one({'_id': mongo_collection.name},
+                      {'$max': {'high_water_mark': high_water_mark},
+                       '$unset': {'pending_high_water_mark': ''}})
+    msg = f'Advanced high-water mark to {high_water_mark}'
+    logging.info(msg)
+
+
+class HarvestProgress:
+    """ Keeps running counters of a harvest, so that progress can be
+    reported without scanning the collection. The counters of the
+    current query are stored in the harvest state document with each
+    checkpoint, and carried over when an interrupted query is resumed;
+    throughput is appended as one JSON line per page to a metrics file.
+
+    Parameters:
+        mongo_collection (pymongo.Collection): the collection being scraped into.
+
+    Keyword arguments:
+        resumed (bool): whether the harvest resumes a checkpointed query,
+            in which case the stored counters are carried over.
+        metrics_fname (str): file to append per-page metrics to, or None.
+
+    """
+    def __init__(self, mongo_collection, resumed=False, metrics_fname=METRICS_FNAME):
+        self.metrics_fname = metrics_fname
+        self.complete_list_size = None
+        self.query_records = 0
+        self.query_pages = 0
+        if resumed:
+            state = mongo_collection.database[STATE_COLLECTION].find_one({'_id': mongo_collection.name})
+            stored = (state or {}).get('progress', {})
+            self.complete_list_size = stored.get('complete_list_size')
+            self.query_records = stored.get('records', 0)
+            self.query_pages = stored.get('pages', 0)
+
+        # collection metadata count, which does not scan the documents
+        self.collection_size = mongo_collection.estimated_document_count()
+        self.run_records = 0
+        self.run_bytes = 0
+        self.parse_time = 0.0
+        self.write_time = 0.0
+        self.start_time = time.monotonic()
+
+    def record_page(self, records, result, num_bytes, complete_list_size, parse_time, write_time):
+        """ Account for one written page.
+
+        Parameters:
+            records (:obj:`list` of :obj:`dict`): the records of the page.
+            result (pymongo.results.BulkWriteResult): result of the write, or None.
+            num_bytes (int): size of the raw response.
+            complete_list_size (int): the size of the query reported by
+                the endpoint, or None.
+            parse_time (float): seconds spent parsing the page.
+            write_time (float): seconds spent writing the page.
+
+        """
+        self.query_pages += 1
+        self.query_records += len(records)
+        self.run_records += len(records)
+        self.run_bytes += num_bytes
+        self.parse_time += parse_time
+        self.write_time += write_time
+        if complete_list_size is not None:
+            self.complete_list_size = complete_list_size
+        if result is not None:
+            self.collection_size += result.upserted_count
+
+    def state(self):
+        """ Return the counters to store in the harvest state document. """
+        return {'records': self.query_records,
+                'pages': self.query_pages,
+                'complete_list_size': self.complete_list_size}
+
+    def metrics(self):
+        """ Return the current counters and throughput of this run. """
+        elapsed = max(time.monotonic() - self.start_time, 1e-9)
+        return {'time': datetime.datetime.utcnow().isoformat(),
+                'pages': self.query_pages,
+                'records': self.query_records,
+                'complete_list_size': self.complete_list_size,
+                'collection_size': self.collection_size,
+                'elapsed': elapsed,
+                'records_per_s': self.run_records / elapsed,
+                'bytes_per_s': self.run_bytes / elapsed,
+                'parse_time': self.parse_time,
+                'write_time': self.write_time}
+
+    def report(self):
+        """ Log the current progress and append it to the metrics file. """
+        metrics = self.metrics()
+        msg = (f'{metrics["records"]} out of {metrics["complete_list_size"]} records harvested, '
+               f'{metrics["collection_size"]} in collection '
+               f'({metrics["records_per_s"]:.1f} records/s, {metrics["bytes_per_s"] / 1024:.1f} kB/s, '
+               f'{metrics["parse_time"]:.1f} s parsing, {metrics["write_time"]:.1f} s writing).')
+        logging.info(msg)
+        if self.metrics_fname is not None:
+            with open(self.metrics_fname, 'a') as f:
+                f.write(json.dumps(metrics) + '\n')
+
+
+def upsert_records(mongo_collection, records):
+    """ Idempotently write a batch of records with one unordered bulk
+    write of upserts keyed on arxiv_id, so that re-harvested or revised
+    papers replace their previous metadata rather than duplicating it,
+    and unchanged records are not rewritten.
+
+    Parameters:
+        mongo_collection (pymongo.Collection): the collection to write to.
+        records (:obj:`list` of :obj:`dict`): the parsed records.
+
+    Returns:
+        pymongo.results.BulkWriteResult: the result of the write, or
+            None if there was nothing to write.
+
+    """
+    operations = [pymongo.UpdateOne({'arxiv_id': record['arxiv_id']}, {'$set': record}, upsert=True)
+                  for record in records if 'arxiv_id' in record]
+    if not operations:
+        return None
+    result = mongo_collection.bulk_write(operations, ordered=False)
+    msg = (f'Upserted {result.upserted_count} new and modified {result.modified_count} '
+           f'existing records out of {len(operations)}.')
+    logging.debug(msg)
+    return result
+
+
+def update_stats(stats, records):
+    """ Add the records of a batch to the corpus statistics and commit
+    them, after the batch is written but before the page is
+    checkpointed. Records are counted once per arXiv ID, so if the
+    harvest is interrupted in between, the page is re-harvested and its
+    records are counted then.
+
+    """
+    if stats is None:
+        return
+    stats.add_many(records)
+    stats.commit()
+
+
+def latest_header_date(records):
+    """ Return the latest header date of a batch of records, or None. """
+    return max((record['header_date'] for record in records if 'header_date' in record), default=None)
+
+
+def ensure_indexes(mongo_collection):
+    """ Create the indexes that upserts and incremental harvests rely on:
+    a unique index on arxiv_id and an index on header_date.
+
+    Parameters:
+        mongo_collection (pymongo.Collection): the collection to index.
+
+    """
+    try:
+        mongo_collection.create_index('arxiv_id', unique=True)
+    except pymongo.errors.OperationFailure as exc:
+        msg = f'Could not create unique arxiv_id index on {mongo_collection.name}, deduplicate it first: {exc}'
+        logging.warning(msg)
+    mongo_collection.create_index('header_date')
+
+
+def fetch_page(request_url, timeout=10, max_failures=3, request_timeout=REQUEST_TIMEOUT):
+    """ Request a single OAI page, retrying after timeout on failure. A
+    request that stalls for longer than request_timeout, or whose
+    connection fails, counts as a failure like an error status.
+
+    Parameters:
+        request_url (str): the full OAI-PMH request.
+
+    Keyword arguments:
+        timeout (int): time in seconds to wait before retrying.
+        max_failures (int): number of consecutive failures to tolerate.
+        request_timeout (float): time in seconds to wait for the server
+            to accept the connection or send more data.
+
+    Returns:
+        bytes: the raw XML response.
+
+    """
+    num_failures = 0
+    while True:
+        msg = f'Submitting request {request_url}'
+        logging.debug(msg)
+        try:
+            request = requests.get(request_url, timeout=request_timeout)
+        except (requests.Timeout, requests.ConnectionError) as error:
+            failure = f'error {error!r}'
+        else:
+            msg = f'Received response: {request.status_code}'
+            logging.debug(msg)
+            if request.status_code == 200:
+                return request.content
+            failure = f'status code {request.status_code}.\n\nFull output: {request.text}'
+
+        num_failures += 1
+        if num_failures >= max_failures:
+            raise RuntimeError(f'Requests fell over for {num_failures} times in a row, with {failure}')
+        msg = f'Request {request_url} failed ({num_failures} of {max_failures}), retrying.'
+        logging.warning(msg)
+        time.sleep(timeout)
+
+
+def parse_page(content):
+    """ Incrementally parse an OAI ListRecords response, clearing each
+    record element once it has been converted, so that only one record
+    tree is alive at any time.
+
+    Parameters:
+        content (bytes): the raw XML response.
+
+    Returns:
+        (:obj:`list` of :obj:`dict`, str, int): the parsed records, the
+            resumption token of the next page (or None) and the complete
+            list size reported with it (or None).
+
+    """
+    records = []
+    resumption_token = None
+    complete_list_size = None
+    for _, elem in ElementTree.iterparse(io.BytesIO(content), events=('end',)):
+        if elem.tag == OAI + 'record':
+            records.append(parse_xml_record(elem))
+            elem.clear()
+        elif elem.tag == OAI + 'resumptionToken':
+            resumption_token = elem.text
+            if 'completeListSize' in elem.attrib:
+                complete_list_size = int(elem.attrib['completeListSize'])
+        elif elem.tag == OAI + 'error':
+            if elem.attrib.get('code') == 'badResumptionToken':
+                raise BadResumptionTokenError(elem.text)
+            if elem.attrib.get('code') != 'noRecordsMatch':
+                raise RuntimeError(f'OAI error {elem.attrib.get("code")}: {elem.text}')
+
+    return records, resumption_token, complete_list_size
+
+
+def timed_parse_page(content):
+    """ Parse a page with parse_page, also returning the time taken in
+    seconds, as measured wherever the parsing actually runs.
+
+    """
+    start = time.perf_counter()
+    records, resumption_token, complete_list_size = parse_page(content)
+    return records, resumption_token, complete_list_size, time.perf_counter() - start
+
+
+def make_request_url(base_url, resumption_token=None, from_date=None):
+    """ Build the OAI ListRecords request for a page.
+
+    Parameters:
+        base_url (str): the OAI-PMH endpoint.
+
+    Keyword arguments:
+        resumption_token (str): token to resume an incomplete query from.
+        from_date (datetime.datetime): only request records modified since this date.
+
+    Returns:
+        str: the full request URL.
+
+    """
+    request_url = base_url + '?verb=ListRecords'
+    if resumption_token is not None:
+        request_url += '&resumptionToken={}'.format(resumption_token)
+    else:
+        if from_date is not None:
+            request_url += '&from={}'.format(from_date.strftime('%Y-%m-%d'))
+        request_url += '&metadataPrefix=oai_dc'
+    return request_url
+
+
+def scan_resumption_token(content):
+    """ Cheaply pull the resumption token out of the tail of a raw OAI
+    response without parsing the whole document, so that the next page
+    can be requested while this one is still being parsed.
+
+    Parameters:
+        content (bytes): the raw XML response.
+
+    Returns:
+        (str, int): the resumption token of the next page (or None) and
+            the complete list size (or None).
+
+    """
+    error = OAI_ERROR_RE.search(content)
+    if error is not None and error.group(1) == b'badResumptionToken':
+        raise BadResumptionTokenError(content[error.end():error.end() + 200].decode(errors='replace'))
+
+    match = RESUMPTION_TOKEN_RE.search(content, max(0, len(content) - 4096))
+    if match is None:
+        match = RESUMPTION_TOKEN_RE.search(content)
+    if match is None:
+        return None, None
+
+    complete_list_size = COMPLETE_LIST_SIZE_RE.search(match.group(1))
+    if complete_list_size is not None:
+        complete_list_size = int(complete_list_size.group(1))
+    resumption_token = match.group(2).decode().strip() if match.group(2) else None
+    return resumption_token or None, complete_list_size
+
+
+def iter_pages(resumption_token=None, from_date=None, timeout=10, base_url=OAI_URL):
+    """ Iteratively walk an OAI ListRecords query, one page at a time.
+
+    Keyword arguments:
+        resumption_token (str): token to resume an incomplete query from.
+        from_date (datetime.datetime): only request records modified since this date.
+        timeout (int): time in seconds between queries to manage flow control.
+        base_url (str): the OAI-PMH endpoint.
+
+    Yields:
+        (:obj:`list` of :obj:`dict`, str, int, int, float): the records of
+            each page, the resumption token of the next page (None on the
+            last page), the complete list size, the size of the response
+            in bytes and the time spent parsing it.
+
+    """
+    while True:
+        request_url = make_request_url(base_url, resumption_token, from_date)
+        content = fetch_page(request_url, timeout=timeout)
+        logging.debug('Parsing XML...')
+        records, resumption_token, complete_list_size, parse_time = timed_parse_page(content)
+        num_bytes = len(content)
+        del content
+
+        if resumption_token:
+            msg = f'Received resumptionToken {resumption_token}, with total query size {complete_list_size}'
+            logging.debug(msg)
+        else:
+            logging.debug(f'No resumptionToken received.')
+            resumption_token = None
+
+        yield records, resumption_token, complete_list_size, num_bytes, parse_time
+
+        if resumption_token is None:
+            return
+
+        msg = f'Sleeping for {timeout} s...'
+        logging.debug(msg)
+        time.sleep(timeout)
+
+
+def arxiv_scrape(mongo_collection, timeout=10, hot_start=False, base_url=OAI_URL, stats=None):
+    """ Iteratively scrape arXiv's OAI metadata endpoint into a MongoDB
+    collection, checkpointing the resumption token after every page so
+    that an interrupted harvest resumes from the page it stopped at.
 
     Parameters:
         mongo_collection (pymongo.Collection): the MongoDB collection to scrape into.
 
     Keyword arguments:
-        resumption_token (str): token required to restart incomplete queries.
         timeout (int): time in seconds between queries to manage flow control.
-        num_failures (int): the number of failures since last successful query.
         hot_start (bool): query for documents added since last previous date existing
             in collection.
+        base_url (str): the OAI-PMH endpoint.
+        stats (pubstomp.stats.CorpusStats): statistics to update with
+            each newly-inserted record.
 
     Returns:
-        int: the number of documents added.
+        int: the number of documents in the collection.
 
     """
-
     last_date = None
     if hot_start:
-        last_date = mongo_collection.find_one({}, sort=[('_id', pymongo.DESCENDING)])['header_date']
-        msg = f'Found last date {last_date}'
+        last_date = load_high_water_mark(mongo_collection)
+        msg = f'Found high-water mark {last_date}'
         logging.debug(msg)
 
-    base_request = 'http://export.arxiv.org/oai2?verb=ListRecords'
+    resumption_token = load_checkpoint(mongo_collection)
     if resumption_token is not None:
-        base_request += '&resumptionToken={}'.format(resumption_token)
-    else:
-        if last_date is not None:
-            base_request += '&from={}'.format(last_date.strftime('%Y-%m-%d'))
+        msg = f'Resuming harvest from checkpointed resumptionToken {resumption_token}'
+        logging.info(msg)
+
+    progress = HarvestProgress(mongo_collection, resumed=resumption_token is not None)
+    while True:
+        pages = iter_pages(resumption_token=resumption_token, from_date=last_date,
+                           timeout=timeout, base_url=base_url)
+        try:
+            for record_batch, next_token, complete_list_size, page_bytes, parse_time in pages:
+                msg = f'Writing {len(record_batch)} entries.'
+                logging.debug(msg)
+                write_start = time.perf_counter()
+                result = upsert_records(mongo_collection, record_batch)
+                progress.record_page(record_batch, result, page_bytes, complete_list_size,
+                                     parse_time, time.perf_counter() - write_start)
+                update_stats(stats, record_batch)
+                save_checkpoint(mongo_collection, next_token, latest_header_date(record_batch),
+                                progress=progress)
+                progress.report()
+            break
+
+        except BadResumptionTokenError:
+            if resumption_token is None:
+                raise
+            logging.warning('Checkpointed resumptionToken was rejected, restarting query.')
+            save_checkpoint(mongo_collection, None)
+            resumption_token = None
+            progress = HarvestProgress(mongo_collection, resumed=False)
+
+    commit_high_water_mark(mongo_collection)
+    logging.info('Scrape complete!')
+    return progress.collection_size
 
-        base_request += '&metadataPrefix=oai_dc'
 
-    msg = f'Submitting request {base_request}'
-    logging.debug(msg)
+def fetch_loop(pending, pool, stop, resumption_token=None, from_date=None, timeout=10,
+               base_url=OAI_URL):
+    """ Fetch OAI pages as fast as the rate limit allows, handing each
+    raw response to the parser pool and queueing the pending result.
+    Only outbound requests are rate limited: consecutive requests are
+    started at least timeout seconds apart, however long the parsing
+    and inserting of earlier pages takes.
 
-    request = requests.get(base_request)
-
-    msg = f'Received response: {request.status_code}'
-    logging.debug(msg)
+    Parameters:
+        pending (queue.Queue): bounded queue of (future, next_token,
+            complete_list_size, num_bytes) tuples, terminated by None or
+            by the exception that stopped the loop.
+        pool (concurrent.futures.Executor): the parser pool.
+        stop (threading.Event): set by the consumer to abandon the harvest.
 
-    # if the request failed, try again after timeout, but accumulate number of failures
-    if request.status_code != 200:
-        if num_failures >= 3:
-            raise RuntimeError(f'Requests fell over for 3rd time in a row, with status code {request.status_code}.\n\nFull output: {request.text}')
+    Keyword arguments:
+        resumption_token (str): token to resume an incomplete query from.
+        from_date (datetime.datetime): only request records modified since this date.
+        timeout (int): minimum time in seconds between requests.
+        base_url (str): the OAI-PMH endpoint.
 
-        time.sleep(timeout)
-        return recursive_arxiv_scrape(mongo_collection,
-                                      resumption_token=resumption_token,
-                                      timeout=timeout,
-                                      hot_start=hot_start,
-                                      num_failures=num_failures+1)
-
-    logging.debug('Parsing XML...')
-    xml_tree = ElementTree.fromstring(request.text)
-
-    new_resumption_token = None
-    for elem in xml_tree.iter(tag='{http://www.openarchives.org/OAI/2.0/}resumptionToken'):
-        new_resumption_token = elem.text
-        complete_list_size = int(elem.attrib['completeListSize'])
-
-    if new_resumption_token is not None:
-        msg = f'Received resumptionToken {new_resumption_token}, with total query size {complete_list_size}'
-        logging.debug(msg)
-    else:
-        logging.debug(f'No resumptionToken received.')
+    """
+    def put(item):
+        while not stop.is_set():
+            try:
+                pending.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
 
-    record_batch = []
-    for _record in xml_tree.iter(tag='{http://www.openarchives.org/OAI/2.0/}record'):
-        record = parse_xml_record(_record)
-        record_batch.append(record)
+    try:
+        next_request = 0
+        while not stop.is_set():
+            time.sleep(max(0, next_request - time.monotonic()))
+            next_request = time.monotonic() + timeout
+            content = fetch_page(make_request_url(base_url, resumption_token, from_date), timeout=timeout)
+            resumption_token, complete_list_size = scan_resumption_token(content)
+            if not put((pool.submit(timed_parse_page, content), resumption_token, complete_list_size, len(content))):
+                return
+            if resumption_token is None:
+                break
+        put(None)
+    except Exception as exc:
+        put(exc)
+
+
+def pipelined_arxiv_scrape(mongo_collection, timeout=10, hot_start=False, base_url=OAI_URL,
+                           num_parsers=2, max_pending=4, stats=None):
+    """ Scrape arXiv's OAI metadata endpoint into a MongoDB collection,
+    overlapping the three stages of each page: a fetcher thread issues
+    rate-limited requests, a process pool parses the responses and this
+    thread bulk-inserts the parsed records in page order, checkpointing
+    the resumption token after each page. The bounded queue between
+    fetcher and writer applies back-pressure so memory stays constant.
 
-    msg = 'Inserting {len(record_batch)} entries.'
-    logging.debug(msg)
-    mongo_collection.insert_many(record_batch)
-    total_count = mongo_collection.count_documents({})
+    Parameters:
+        mongo_collection (pymongo.Collection): the MongoDB collection to scrape into.
 
-    msg = f'{total_count} out of {complete_list_size} inserted.'
-    logging.info(msg)
-    msg = f'Sleeping for {timeout} s...'
-    logging.debug(msg)
+    Keyword arguments:
+        timeout (int): minimum time in seconds between requests.
+        hot_start (bool): query for documents added since last previous date existing
+            in collection.
+        base_url (str): the OAI-PMH endpoint.
+        num_parsers (int): number of parser processes.
+        max_pending (int): maximum number of fetched pages awaiting insertion.
+        stats (pubstomp.stats.CorpusStats): statistics to update with
+            each newly-inserted record.
 
-    time.sleep(timeout)
+    Returns:
+        int: the number of documents in the collection, as for arxiv_scrape.
 
-    if new_resumption_token is not None:
-        return recursive_arxiv_scrape(mongo_collection, hot_start=hot_start,
-                                      resumption_token=new_resumption_token,
-                                      timeout=timeout)
+    """
+    last_date = None
+    if hot_start:
+        last_date = load_high_water_mark(mongo_collection)
+        msg = f'Found high-water mark {last_date}'
+        logging.debug(msg)
 
+    resumption_token = load_checkpoint(mongo_collection)
+    if resumption_token is not None:
+        msg = f'Resuming harvest from checkpointed resumptionToken {resumption_token}'
+        logging.info(msg)
+
+    progress = HarvestProgress(mongo_collection, resumed=resumption_token is not None)
+    with ProcessPoolExecutor(max_workers=num_parsers) as pool:
+        while True:
+            pending = queue.Queue(maxsize=max_pending)
+            stop = threading.Event()
+            fetcher = threading.Thread(target=fetch_loop, args=(pending, pool, stop),
+                                       kwargs={'resumption_token': resumption_token,
+                                               'from_date': last_date,
+                                               'timeout': timeout,
+                                               'base_url': base_url},
+                                       daemon=True)
+            fetcher.start()
+            try:
+                while True:
+                    item = pending.get()
+                    if item is None:
+                        break
+                    if isinstance(item, Exception):
+                        raise item
+                    future, next_token, complete_list_size, page_bytes = item
+                    record_batch, _, _, parse_time = future.result()
+                    write_start = time.perf_counter()
+                    result = upsert_records(mongo_collection, record_batch)
+                    progress.record_page(record_batch, result, page_bytes, complete_list_size,
+                                         parse_time, time.perf_counter() - write_start)
+                    update_stats(stats, record_batch)
+                    save_checkpoint(mongo_collection, next_token, latest_header_date(record_batch),
+                                    progress=progress)
+                    progress.report()
+                break
+
+            except BadResumptionTokenError:
+                if resumption_token is None:
+                    raise
+                logging.warning('Checkpointed resumptionToken was rejected, restarting query.')
+                save_checkpoint(mongo_collection, None)
+                resumption_token = None
+                progress = HarvestProgress(mongo_collection, resumed=False)
+
+            finally:
+                stop.set()
+                fetcher.join()
+
+    commit_high_water_mark(mongo_collection)
     logging.info('Scrape complete!')
-    return total_count
+    progress.report()
+    return progress.collection_size
 
 
 if __name__ == '__main__':
@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+""" Measure how long importing pubstomp modules takes in a fresh
+interpreter, started outside the repository, and check that no heavy
+or optional dependency (plotting, the database driver, spaCy, ...) is
+imported along the way. Exits with status 1 if a module is too slow to
+import or pulls in a forbidden dependency, e.g.
+
+    python bench_import.py --max_seconds 0.5
+
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+DEFAULT_MODULES = ('pubstomp.similarity', 'pubstomp.similarity.glove', 'pubstomp.similarity.neighbours')
+FORBIDDEN_MODULES = ('matplotlib', 'seaborn', 'pymongo', 'spacy', 'nltk', 'networkx')
+
+# run in the fresh interpreter: time the import, and list the forbidden
+# modules that it loaded
+PROBE = """
+import json, sys, time
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+print(json.dumps({{'seconds': elapsed, 'loaded': [name for name in {forbidden!r} if name in sys.modules]}}))
+"""
+
+
+def time_import(module, forbidden=FORBIDDEN_MODULES, repeats=5):
+    """ Import a module in fresh interpreters, from an empty working
+    directory with the repository on the path.
+
+    Parameters:
+        module (str): the module to import.
+
+    Keyword arguments:
+        forbidden (:obj:`tuple` of :obj:`str`): modules that must not
+            be imported along the way.
+        repeats (int): number of interpreters to time.
+
+    Returns:
+        (float, :obj:`list` of :obj:`str`): the fastest import time in
+            seconds, and the forbidden modules that were imported.
+
+    """
+    repo = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [repo, os.environ.get('PYTHONPATH')])))
+    probe = PROBE.format(module=module, forbidden=tuple(forbidden))
+    times = []
+    loaded = set()
+    with tempfile.TemporaryDirectory() as cwd:
+        for _ in range(repeats):
+            output = subprocess.check_output([sys.executable, '-c', probe], cwd=cwd, env=env)
+            result = json.loads(output.decode().splitlines()[-1])
+            times.append(result['seconds'])
+            loaded.update(result['loaded'])
+    return min(times), sorted(loaded)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Guard the import time of pubstomp modules.')
+    parser.add_argument('modules', nargs='*', default=DEFAULT_MODULES, help='modules to import')
+    parser.add_argument('--max_seconds', default=1.0, type=float, help='slowest acceptable import')
+    parser.add_argument('--repeats', default=5, type=int, help='number of fresh interpreters per module')
+    args = parser.parse_args()
+
+    failed = False
+    for module in args.modules:
+        seconds, loaded = time_import(module, repeats=args.repeats)
+        status = 'ok'
+        if loaded:
+            status = f'imports {", ".join(loaded)}'
+            failed = True
+        elif seconds > args.max_seconds:
+            status = f'slower than {args.max_seconds} s'
+            failed = True
+        print(f'{module:<40} {seconds * 1e3:>8.1f} ms  {status}')
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+""" Measure the throughput of the shared tokenizer on the bundled
+abstracts, e.g.
+
+    python bench_tokenizer.py ../data/*_short.json --repeats 5
+
+"""
+
+import argparse
+import json
+import time
+
+from pubstomp.text import Tokenizer, normalise_whitespace
+
+
+def load_abstracts(fnames):
+    """ Load the longest description of every record in the given
+    JSON exports.
+
+    """
+    abstracts = []
+    for fname in fnames:
+        with open(fname) as f:
+            for record in json.load(f):
+                if record.get('description'):
+                    abstracts.append(normalise_whitespace(max(record['description'], key=len)))
+    return abstracts
+
+
+def benchmark(configurations, abstracts, repeats):
+    """ Time the best of several runs of each configuration over all the
+    abstracts, and print the throughput in tokens per second. Every
+    configuration gets an untimed warm-up run, which also fills the
+    stemmer cache, and the timed runs take turns, so that a slow patch
+    of the machine does not favour one configuration.
+
+    Parameters:
+        configurations (:obj:`list` of (str, callable)): label to print,
+            and a function that takes the list of abstracts and returns
+            their lists of tokens.
+        abstracts (:obj:`list` of :obj:`str`): the abstracts to tokenise.
+        repeats (int): the number of runs of each configuration.
+
+    """
+    num_tokens = {}
+    for name, tokenize in configurations:
+        num_tokens[name] = sum(len(doc_tokens) for doc_tokens in tokenize(abstracts))
+    best = {name: float('inf') for name, _ in configurations}
+    for _ in range(repeats):
+        for name, tokenize in configurations:
+            start = time.perf_counter()
+            tokenize(abstracts)
+            best[name] = min(best[name], time.perf_counter() - start)
+    for name, _ in configurations:
+        print(f'{name:<28} {num_tokens[name]:>8d} tokens  {best[name] * 1e3:8.1f} ms  '
+              f'{num_tokens[name] / best[name]:12,.0f} tokens/s')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the pubstomp tokenizer.')
+    parser.add_argument('fnames', nargs='+', help='JSON exports of arXiv records, e.g. data/*_short.json')
+    parser.add_argument('--repeats', default=5, type=int, help='number of timed runs per configuration')
+    args = parser.parse_args()
+
+    abstracts = load_abstracts(args.fnames)
+    print(f'{len(abstracts)} abstracts from {len(args.fnames)} files')
+
+    unstemmed = Tokenizer(stem=False)
+    configurations = [('batch, unstemmed', unstemmed.tokenize_batch),
+                      ('per abstract, unstemmed', lambda texts: [unstemmed.tokenize(text) for text in texts])]
+
+    try:
+        import nltk  # noqa: F401
+    except ImportError:
+        print('nltk is not installed, skipping stemmed runs.')
+    else:
+        stemmed = Tokenizer()
+        configurations += [('batch, stemmed', stemmed.tokenize_batch),
+                           ('per abstract, stemmed', lambda texts: [stemmed.tokenize(text) for text in texts])]
+
+    benchmark(configurations, abstracts, args.repeats)
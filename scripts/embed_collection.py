@@ -0,0 +1,55 @@
+#!/usr/bin/env python
+""" Embed every abstract of an arXiv collection with a saved GloVe
+engine into the persistent embedding cache. Documents that are
+already cached are skipped, so an interrupted run can simply be
+restarted.
+
+"""
+
+import argparse
+import logging
+
+from pubstomp.cache import EmbeddingCache, embed_documents
+from pubstomp.similarity import GloveSimilarityEngine
+from pubstomp.store import get_collection, iter_documents
+
+
+def embed_collection(model_path, cache_dir, coll_name='arXiv_v1', db_name='pubstomp', batch_size=1000, workers=None):
+    """ Stream the collection through the saved engine into the cache.
+
+    Parameters:
+        model_path (str): directory of an engine saved with SimilarityEngine.save.
+        cache_dir (str): root directory of the embedding caches.
+
+    Keyword arguments:
+        coll_name (str): name of the MongoDB collection to embed.
+        db_name (str): name of the MongoDB database.
+        batch_size (int): number of documents per cache commit.
+        workers (int): number of processes to parse with.
+
+    Returns:
+        int: the number of newly-embedded documents.
+
+    """
+    sim_engine = GloveSimilarityEngine.load(model_path)
+    cache = EmbeddingCache.for_engine(cache_dir, sim_engine)
+    logging.info(f'Opened cache {cache.path} with {len(cache)} documents.')
+
+    documents = iter_documents(get_collection(coll_name, db_name),
+                               fields=('arxiv_id', 'description'),
+                               batch_size=batch_size)
+    return embed_documents(sim_engine, documents, cache, batch_size=batch_size, workers=workers)
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description='Embed an arXiv collection into the embedding cache.')
+    parser.add_argument('model', help='directory of the saved GloVe engine')
+    parser.add_argument('cache', help='root directory of the embedding caches')
+    parser.add_argument('--collection', default='arXiv_v1', help='name of the MongoDB collection')
+    parser.add_argument('--batch_size', default=1000, type=int, help='documents per cache commit')
+    parser.add_argument('--workers', default=None, type=int, help='number of processes to parse with')
+    args = parser.parse_args()
+
+    embed_collection(args.model, args.cache, coll_name=args.collection, batch_size=args.batch_size,
+                     workers=args.workers)
@@ -0,0 +1,39 @@
+#!/usr/bin/env python
+""" Export an arXiv collection, or MongoDB extended JSON dumps of one
+such as data/*_short.json, to an offline columnar snapshot, e.g.
+
+    python export_snapshot.py snapshots/arXiv_v1 --collection arXiv_v1
+    python export_snapshot.py snapshots/short --json ../data/*_short.json
+
+"""
+
+import argparse
+import json
+import logging
+
+from pubstomp.snapshot import export_collection, export_records
+
+
+def iter_json_records(fnames):
+    """ Stream the records of JSON files, each holding a list of records. """
+    for fname in fnames:
+        with open(fname) as f:
+            yield from json.load(f)
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description='Export arXiv records to a columnar snapshot.')
+    parser.add_argument('path', help='directory to write the snapshot into')
+    parser.add_argument('--collection', default='arXiv_v1', help='name of the MongoDB collection')
+    parser.add_argument('--batch_size', default=1000, type=int, help='records per cursor batch')
+    parser.add_argument('--json', nargs='+', help='export these JSON files instead of the collection')
+    args = parser.parse_args()
+
+    if args.json:
+        num_documents = export_records(iter_json_records(args.json), args.path)
+    else:
+        from pubstomp.store import get_collection
+        num_documents = export_collection(get_collection(args.collection), args.path,
+                                          batch_size=args.batch_size)
+    logging.info(f'Exported {num_documents} records to {args.path}.')
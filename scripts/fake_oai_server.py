@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+""" A local fake OAI-PMH endpoint serving synthetic arXiv records, for
+measuring harvester throughput without hitting export.arxiv.org, e.g.
+
+    python fake_oai_server.py --pages 50 --page_size 1000 &
+    python arxiv_get.py fake_v0 --base_url http://localhost:8080/oai2 --timeout 0
+
+"""
+
+import argparse
+import datetime
+import random
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+RECORD_TEMPLATE = """<record><header><identifier>oai:arXiv.org:{arxiv_id}</identifier>\
+<datestamp>{date}</datestamp><setSpec>physics</setSpec></header><metadata>\
+<oai_dc:dc xmlns:oai_dc="http://www.openarchives.org/OAI/2.0/oai_dc/" \
+xmlns:dc="http://purl.org/dc/elements/1.1/"><dc:title>{title}</dc:title>\
+<dc:creator>Doe, Jane</dc:creator><dc:creator>Bloggs, Joe</dc:creator>\
+<dc:subject>Physics - Fluid Dynamics</dc:subject>\
+<dc:description>{abstract}</dc:description><dc:description>Comment: 10 pages</dc:description>\
+<dc:date>{date}</dc:date><dc:type>text</dc:type></oai_dc:dc></metadata></record>"""
+
+WORDS = ('flow turbulence vortex boundary layer viscous reynolds number simulation '
+         'instability wave energy spectrum model scaling regime shear').split()
+
+
+def make_page(page, num_pages, page_size, abstract_words=150):
+    """ Render one ListRecords page of synthetic records.
+
+    Parameters:
+        page (int): the index of the page to render.
+        num_pages (int): the total number of pages in the query.
+        page_size (int): the number of records per page.
+
+    Keyword arguments:
+        abstract_words (int): the number of words per abstract.
+
+    Returns:
+        bytes: the XML response.
+
+    """
+    rng = random.Random(page)
+    date = datetime.date(2019, 1, 1) + datetime.timedelta(days=page)
+    records = []
+    for ind in range(page_size):
+        number = page * page_size + ind
+        records.append(RECORD_TEMPLATE.format(
+            arxiv_id=f'{1900 + number // 100000}.{number % 100000:05d}',
+            date=date.strftime('%Y-%m-%d'),
+            title=' '.join(rng.choices(WORDS, k=8)),
+            abstract=' '.join(rng.choices(WORDS, k=abstract_words))))
+
+    if page + 1 < num_pages:
+        token = (f'<resumptionToken cursor="{page * page_size}" '
+                 f'completeListSize="{num_pages * page_size}">fake|{page + 1}</resumptionToken>')
+    else:
+        token = f'<resumptionToken cursor="{page * page_size}" completeListSize="{num_pages * page_size}"/>'
+
+    return ('<?xml version="1.0" encoding="UTF-8"?>'
+            '<OAI-PMH xmlns="http://www.openarchives.org/OAI/2.0/"><ListRecords>'
+            + ''.join(records) + token + '</ListRecords></OAI-PMH>').encode()
+
+
+def make_handler(num_pages, page_size, latency):
+    """ Create a request handler serving the given synthetic query. """
+    class FakeOAIHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            query = parse_qs(urlparse(self.path).query)
+            token = query.get('resumptionToken', ['fake|0'])[0]
+            try:
+                page = int(token.split('|')[1])
+            except (IndexError, ValueError):
+                page = num_pages
+            if page >= num_pages:
+                body = ('<?xml version="1.0" encoding="UTF-8"?>'
+                        '<OAI-PMH xmlns="http://www.openarchives.org/OAI/2.0/">'
+                        '<error code="badResumptionToken">unknown token</error></OAI-PMH>').encode()
+            else:
+                body = make_page(page, num_pages, page_size)
+
+            time.sleep(latency)
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/xml')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    return FakeOAIHandler
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Serve synthetic arXiv records over OAI-PMH.')
+    parser.add_argument('--port', default=8080, type=int, help='port to listen on')
+    parser.add_argument('--pages', default=20, type=int, help='number of pages in the query')
+    parser.add_argument('--page_size', default=1000, type=int, help='number of records per page')
+    parser.add_argument('--latency', default=0.2, type=float, help='server-side delay per request in seconds')
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer(('localhost', args.port),
+                                 make_handler(args.pages, args.page_size, args.latency))
+    print(f'Serving {args.pages} pages of {args.page_size} records on '
+          f'http://localhost:{args.port}/oai2')
+    server.serve_forever()
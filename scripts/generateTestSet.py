@@ -5,34 +5,46 @@ Subjects:
 - Mathematics - Number Theory
 - Condensed Matter - Materials Science
 - Physics - Fluid Dynamics
+
+Pass the path of an offline snapshot (see pubstomp.snapshot) to sample
+from it instead of the database.
 """
-import pymongo
-# import json
-import bson.json_util
+import json
+import sys
 import numpy as np
-# from bson.json_util import dumps, RELAXED_JSON_OPTIONS
-client = pymongo.MongoClient()
-collection = client.pubstomp.arXiv_v1
-
 
 subjects = ["Mathematics - Number Theory", "Condensed Matter - Materials Science", "Physics - Fluid Dynamics"]
+fnames = ["maths_short.json", "materials_short.json", "physics_short.json"]
+
+
+def sample_from_collection():
+    import pymongo
+    import bson.json_util
+    client = pymongo.MongoClient()
+    collection = client.pubstomp.arXiv_v1
+
+    for subject, fname in zip(subjects, fnames):
+        records = collection.find({"subject": subject})
+        with open(fname, "w") as flines:
+            records = np.random.choice(list(records), 100)
+            flines.write(bson.json_util.dumps(list(records), json_options=bson.json_util.RELAXED_JSON_OPTIONS))
 
-maths = collection.find({"subject": subjects[0]})
-with open("maths_short.json", "w") as flines:
-    maths = np.random.choice(list(maths), 100)
-    flines.write(bson.json_util.dumps(list(maths), json_options=bson.json_util.RELAXED_JSON_OPTIONS))
 
-materials = collection.find({"subject": subjects[1]})
-with open("materials_short.json", "w") as flines:
-    materials = np.random.choice(list(materials), 100)
-    flines.write(bson.json_util.dumps(list(materials), json_options=bson.json_util.RELAXED_JSON_OPTIONS))
+def sample_from_snapshot(snapshot_path):
+    from pubstomp.snapshot import Snapshot
+    snapshot = Snapshot(snapshot_path)
 
-# print(materials.count())
-physics = collection.find({"subject": subjects[2]})
-with open("physics_short.json", "w") as flines:
-    physics = np.random.choice(list(physics), 100)
-    
-    flines.write(bson.json_util.dumps(list(physics), json_options=bson.json_util.RELAXED_JSON_OPTIONS))
+    for subject, fname in zip(subjects, fnames):
+        rows = np.random.choice(snapshot.rows_with_subject(subject), 100)
+        records = [snapshot.record(row) for row in rows]
+        for record in records:
+            record["dates"] = [{"$date": f"{date.isoformat()}T00:00:00Z"} for date in record["dates"]]
+        with open(fname, "w") as flines:
+            json.dump(records, flines)
 
-# print(physics.count())
 
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        sample_from_snapshot(sys.argv[1])
+    else:
+        sample_from_collection()
@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+""" Compare the top-10 recall and query latency of the approximate
+IVFIndex against exact search with NearestNeighbourIndex, for a range
+of num_probe values, e.g.
+
+    python ivf_report.py ../data/maths_short.json ../data/materials_short.json ../data/physics_short.json
+    python ivf_report.py ../data/*_short.json --model models/glove --num_probe 1 2 4 8
+
+"""
+
+import argparse
+import json
+import time
+
+import numpy as np
+
+from pubstomp.document import Document
+from pubstomp.similarity import GloveSimilarityEngine, NearestNeighbourIndex
+from pubstomp.similarity.ivf import IVFIndex, recall_at_k
+
+
+def load_documents(fnames):
+    """ Load the records of JSON files, each holding a list of records. """
+    documents = []
+    for fname in fnames:
+        with open(fname) as f:
+            documents.extend(Document(record) for record in json.load(f))
+    return documents
+
+
+def time_queries(index, vectors, arxiv_ids, k=10):
+    """ Measure the mean time of a top-k query, excluding each query's
+    own document from its results.
+
+    """
+    start = time.perf_counter()
+    for vector, arxiv_id in zip(vectors, arxiv_ids):
+        index.query_vector(vector, k=k, exclude=arxiv_id)
+    return (time.perf_counter() - start) / len(vectors)
+
+
+def ivf_report(sim_engine, documents, num_probes, num_lists=None, k=10):
+    """ Index the documents exactly and with IVF, and measure the IVF
+    index at each num_probe against the exact one. Every document is
+    also used as a query, and is excluded from its own results.
+
+    Parameters:
+        sim_engine (SimilarityEngine): a fitted engine whose parsed
+            documents are unit-normalised vectors.
+        documents (:obj:`list` of :obj:`document.Document`): the documents
+            to index.
+        num_probes (:obj:`list` of int): the num_probe values to measure.
+
+    Keyword arguments:
+        num_lists (int): number of IVF clusters, see IVFIndex.
+        k (int): number of neighbours to compare.
+
+    Returns:
+        :obj:`list` of :obj:`dict`: the index ('exact' or 'ivf'),
+            num_probe, mean query time in seconds and recall@k of each
+            measurement.
+
+    """
+    arxiv_ids = [document.arxiv_id for document in documents]
+    vectors = np.vstack(sim_engine.parse_documents(documents))
+    exact = NearestNeighbourIndex(sim_engine, arxiv_ids, vectors)
+    approximate = IVFIndex(sim_engine, arxiv_ids, vectors, num_lists=num_lists)
+
+    rows = [{'index': 'exact', 'num_probe': None,
+             'query_time': time_queries(exact, vectors, arxiv_ids, k=k), 'recall': 1.0}]
+    for num_probe in num_probes:
+        approximate.num_probe = num_probe
+        rows.append({'index': 'ivf', 'num_probe': num_probe,
+                     'query_time': time_queries(approximate, vectors, arxiv_ids, k=k),
+                     'recall': recall_at_k(approximate, exact, vectors, k=k, exclude=arxiv_ids)})
+    return rows
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Report the recall and latency of IVF search.')
+    parser.add_argument('fnames', nargs='+', help='JSON exports of arXiv records, e.g. data/*_short.json')
+    parser.add_argument('--model', help='directory of a saved GloVe engine, instead of training one')
+    parser.add_argument('--num_lists', default=None, type=int, help='number of IVF clusters')
+    parser.add_argument('--num_probe', nargs='+', default=[1, 2, 4, 8, 16], type=int,
+                        help='num_probe values to measure')
+    parser.add_argument('--k', default=10, type=int, help='number of neighbours to compare')
+    args = parser.parse_args()
+
+    documents = load_documents(args.fnames)
+    if args.model:
+        sim_engine = GloveSimilarityEngine.load(args.model)
+    else:
+        sim_engine = GloveSimilarityEngine(documents)
+    print(f'{len(documents)} documents')
+    print(f'{"index":<6} {"num_probe":>9} {"query (us)":>12} {f"recall@{args.k}":>10}')
+    for row in ivf_report(sim_engine, documents, args.num_probe, num_lists=args.num_lists, k=args.k):
+        num_probe = '' if row['num_probe'] is None else row['num_probe']
+        print(f'{row["index"]:<6} {num_probe:>9} {row["query_time"] * 1e6:>12.1f} {row["recall"]:>10.4f}')
@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+""" Compare the memory, query time and top-10 recall of the document
+matrix storage types against exact float64 search, for a GloVe engine
+trained in-process in float64 on the bundled test sets, e.g.
+
+    python quantization_report.py ../data/maths_short.json ../data/materials_short.json ../data/physics_short.json
+
+"""
+
+import argparse
+import json
+import time
+
+import numpy as np
+
+from pubstomp.document import Document
+from pubstomp.similarity import GloveSimilarityEngine, NearestNeighbourIndex
+from pubstomp.similarity.ivf import recall_at_k
+from pubstomp.similarity.quantize import STORAGE_TYPES
+
+
+def load_documents(fnames):
+    """ Load the records of JSON files, each holding a list of records. """
+    documents = []
+    for fname in fnames:
+        with open(fname) as f:
+            documents.extend(Document(record) for record in json.load(f))
+    return documents
+
+
+def storage_report(sim_engine, documents, k=10):
+    """ Index the documents once per storage type, and measure each
+    index against the float64 one. Every document is also used as a
+    query, and is excluded from its own results.
+
+    Parameters:
+        sim_engine (SimilarityEngine): a fitted engine whose parsed
+            documents are vectors, ideally trained in float64 so that
+            the reference is not itself rounded to float32.
+        documents (:obj:`list` of :obj:`document.Document`): the documents
+            to index.
+
+    Keyword arguments:
+        k (int): number of neighbours to compare.
+
+    Returns:
+        :obj:`list` of :obj:`dict`: the storage type, bytes used by the
+            document matrix, mean query time in seconds and recall@k of
+            each index.
+
+    """
+    arxiv_ids = [document.arxiv_id for document in documents]
+    vectors = np.vstack(sim_engine.parse_documents(documents))
+    exact = NearestNeighbourIndex(sim_engine, arxiv_ids, vectors, storage='float64')
+
+    rows = []
+    for storage in STORAGE_TYPES:
+        index = NearestNeighbourIndex(sim_engine, arxiv_ids, vectors, storage=storage)
+        num_bytes = index.vectors.nbytes + (0 if index.scales is None else index.scales.nbytes)
+        start = time.perf_counter()
+        for vector, arxiv_id in zip(vectors, arxiv_ids):
+            index.query_vector(vector, k=k, exclude=arxiv_id)
+        query_time = (time.perf_counter() - start) / len(vectors)
+        rows.append({'storage': storage,
+                     'bytes': num_bytes,
+                     'query_time': query_time,
+                     'recall': recall_at_k(index, exact, vectors, k=k, exclude=arxiv_ids)})
+    return rows
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Report the accuracy of quantized document storage.')
+    parser.add_argument('fnames', nargs='+', help='JSON exports of arXiv records, e.g. data/*_short.json')
+    parser.add_argument('--k', default=10, type=int, help='number of neighbours to compare')
+    args = parser.parse_args()
+
+    documents = load_documents(args.fnames)
+    sim_engine = GloveSimilarityEngine(documents, dtype='float64')
+    print(f'{len(documents)} documents, {sim_engine.embeddings.shape[1]} {sim_engine.embeddings.dtype} dimensions')
+    print(f'{"storage":<10} {"bytes":>10} {"query (us)":>12} {f"recall@{args.k}":>10}')
+    for row in storage_report(sim_engine, documents, k=args.k):
+        print(f'{row["storage"]:<10} {row["bytes"]:>10d} {row["query_time"] * 1e6:>12.1f} {row["recall"]:>10.4f}')
@@ -6,9 +6,15 @@ based on date and arXiv_id.
 import pymongo
 import sys
 
+from pubstomp.store import ensure_indexes
+
 
 def index_collection(db_name='pubstomp'):
-    """ (Re)index arXiv abstract database over header_date and arXiv_id keys. """
+    """ (Re)index arXiv abstract database over header_date and arXiv_id keys,
+    with arXiv_id unique so that harvests can upsert on it, plus the subject
+    and date indexes used by the filters of pubstomp.store.
+
+    """
     try:
         collection_name = sys.argv[1]
     except IndexError:
@@ -17,16 +23,16 @@ def index_collection(db_name='pubstomp'):
     client = pymongo.MongoClient()
     db = client[db_name]
 
-    if collection_name in db.list_collection_names():
-        db[collection_name].crreate
-        if collection_name in db.list_collection_names():
-            index_keys = ['header_date', 'arxiv_id']
-            for key in index_keys:
-                if key not in db[collection_name].index_information():
-                    print(f'Creating index over key: {key}.')
-                    db[collection_name].create_index(key, unique=True)
-            print(f'Re-indexing over all keys: {index_keys}.')
-            db[collection_name].reindex()
+    if collection_name not in db.list_collection_names():
+        raise SystemExit(f'No collection named {collection_name} in {db_name}.')
+
+    index_keys = {'arxiv_id': True, 'header_date': False}
+    existing = db[collection_name].index_information()
+    for key, unique in index_keys.items():
+        if f'{key}_1' not in existing:
+            print(f'Creating index over key: {key}.')
+            db[collection_name].create_index(key, unique=unique)
+    ensure_indexes(db[collection_name])
 
 
 if __name__ == '__main__':
@@ -1,43 +1,46 @@
-import pymongo
+import argparse
 import json
 import seaborn as sns
-from tqdm import tqdm
 import matplotlib.pyplot as plt
 
-def findNumberOfSubjects(collection, outputPath="counts.json"):
+from pubstomp.stats import CorpusStats, DEFAULT_STATS_FNAME
+from pubstomp.store import get_collection
+
+def findNumberOfSubjects(collection, statsPath=DEFAULT_STATS_FNAME, outputPath="counts.json"):
     """
-    Given a collection of records with a "subject" field, each of which contains
-    a list of subjects, count the occurrence of each subject.
-    
-    print the number of records without a subject field
-    
-    Save the list.
+    Count the occurrence of each subject in a collection of records, read from
+    the corpus statistics that the harvester keeps up to date (see
+    pubstomp.stats), which are computed from the collection if missing.
+
+    Save the counts.
     """
-    subjectCounts = {}
-    errors = 0
-    for document in tqdm(collection.find(), total=721000):
-        try:
-            subjects = document["subject"]  # iterate the cursor
-        except KeyError:
-            errors += 1
-            continue
-        for subject in subjects:
-            try:
-                subjectCounts[subject] +=1
-            except KeyError:
-                subjectCounts[subject] = 1
+    subjectCounts = dict(CorpusStats.for_collection(statsPath, collection).subject_counts)
 
     with open(outputPath, "w") as flines:
         json.dump(subjectCounts, flines)
 
-# print(errors)  #  11 errors
+def findNumberOfSubjectsInSnapshot(snapshotPath, outputPath="counts.json"):
+    """
+    As findNumberOfSubjects, but reading the subject column of an offline
+    snapshot (see pubstomp.snapshot) instead of scanning the database.
+    """
+    from pubstomp.snapshot import Snapshot
+    subjectCounts = {subject: count for subject, count in Snapshot(snapshotPath).subject_counts().items() if count}
+
+    with open(outputPath, "w") as flines:
+        json.dump(subjectCounts, flines)
 
 
 if __name__ == "__main__":
-
-    client = pymongo.MongoClient()
-    collection = client.pubstomp.arXiv_v1
-    findNumberOfSubjects(collection)
+    parser = argparse.ArgumentParser(description="Plot a histogram of arXiv subjects.")
+    parser.add_argument("--snapshot", help="count subjects in this snapshot instead of the corpus statistics")
+    parser.add_argument("--stats", default=DEFAULT_STATS_FNAME, help="the corpus statistics to read")
+    args = parser.parse_args()
+
+    if args.snapshot:
+        findNumberOfSubjectsInSnapshot(args.snapshot)
+    else:
+        findNumberOfSubjects(get_collection(), statsPath=args.stats)
 
     with open("counts.json") as flines:
         subjectCounts = json.load(flines)
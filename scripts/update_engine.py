@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+""" Fold newly-harvested abstracts into a saved GloVe engine and bring
+the embedding cache up to date, e.g.
+
+    python update_engine.py models/glove models/glove_v2 caches --since 2024-01-01
+
+The updated engine is saved to a new directory, and its cache is
+filled from the cache of the old engine: only documents containing a
+word whose vector changed are re-parsed. The update is deterministic,
+so if the re-embedding is interrupted, rerunning the same command
+reproduces the updated engine and resumes filling its cache.
+
+"""
+
+import argparse
+import datetime
+import logging
+
+from pubstomp.cache import EmbeddingCache, reembed_documents
+from pubstomp.similarity import GloveSimilarityEngine
+from pubstomp.store import get_collection, iter_documents
+
+
+def update_engine(model_path, new_model_path, cache_dir, since, coll_name='arXiv_v1', db_name='pubstomp',
+                  iterations=5, drift_tolerance=0.05, batch_size=1000, workers=None):
+    """ Update a saved engine with the documents harvested since a date,
+    save it, and re-embed the collection into the cache of the updated
+    engine.
+
+    Parameters:
+        model_path (str): directory of the engine to update.
+        new_model_path (str): directory to save the updated engine to.
+        cache_dir (str): root directory of the embedding caches.
+        since (datetime.datetime): update with the documents whose
+            header_date is on or after this date.
+
+    Keyword arguments:
+        coll_name (str): name of the MongoDB collection.
+        db_name (str): name of the MongoDB database.
+        iterations, drift_tolerance: see GloveSimilarityEngine.update.
+        batch_size (int): number of documents per cache commit.
+        workers (int): number of processes to parse with.
+
+    Returns:
+        (int, int): the number of documents copied and re-parsed.
+
+    """
+    collection = get_collection(coll_name, db_name)
+    sim_engine = GloveSimilarityEngine.load(model_path)
+    old_cache = EmbeddingCache.for_engine(cache_dir, sim_engine, attach=False)
+
+    new_documents = iter_documents(collection, date_from=since, fields=('arxiv_id', 'description'),
+                                   batch_size=batch_size)
+    changed_words = sim_engine.update(new_documents, iterations=iterations, drift_tolerance=drift_tolerance)
+    logging.info(f'Updated {model_path}: {len(changed_words)} words added or changed.')
+    sim_engine.save(new_model_path)
+
+    return reembed_engine(sim_engine, old_cache, changed_words, collection, cache_dir,
+                          batch_size=batch_size, workers=workers)
+
+
+def reembed_engine(sim_engine, old_cache, changed_words, collection, cache_dir, batch_size=1000, workers=None):
+    """ Fill the cache of an updated engine from the cache of the
+    engine it was updated from, see pubstomp.cache.reembed_documents.
+
+    """
+    cache = EmbeddingCache.for_engine(cache_dir, sim_engine, attach=False)
+    logging.info(f'Re-embedding from {old_cache.path} ({len(old_cache)} documents) '
+                 f'into {cache.path} ({len(cache)} documents).')
+    documents = iter_documents(collection, fields=('arxiv_id', 'description'), batch_size=batch_size)
+    return reembed_documents(sim_engine, documents, old_cache, cache,
+                             lambda document: sim_engine.is_stale(document, changed_words),
+                             batch_size=batch_size, workers=workers)
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description='Update a saved GloVe engine and its embedding cache.')
+    parser.add_argument('model', help='directory of the saved GloVe engine')
+    parser.add_argument('new_model', help='directory to save the updated engine to')
+    parser.add_argument('cache', help='root directory of the embedding caches')
+    parser.add_argument('--since', required=True, type=lambda date: datetime.datetime.strptime(date, '%Y-%m-%d'),
+                        help='update with documents harvested on or after this date, YYYY-MM-DD')
+    parser.add_argument('--collection', default='arXiv_v1', help='name of the MongoDB collection')
+    parser.add_argument('--iterations', default=5, type=int, help='training passes over the new co-occurrences')
+    parser.add_argument('--drift_tolerance', default=0.05, type=float,
+                        help='relative change beyond which a word vector counts as changed')
+    parser.add_argument('--batch_size', default=1000, type=int, help='documents per cache commit')
+    parser.add_argument('--workers', default=None, type=int, help='number of processes to parse with')
+    args = parser.parse_args()
+
+    update_engine(args.model, args.new_model, args.cache, args.since, coll_name=args.collection,
+                  iterations=args.iterations, drift_tolerance=args.drift_tolerance,
+                  batch_size=args.batch_size, workers=args.workers)
@@ -7,7 +7,7 @@ with open("LICENSE") as flines:
     license = flines.read()
 
 with open("requirements.txt") as flines:
-    requirements = [line.strip() for line in flines]
+    requirements = [line.strip() for line in flines if line.strip() and not line.startswith('#')]
 
 setup(
     name='pubstomp',
@@ -21,5 +21,7 @@ setup(
     setup_requires=['pytest_runner'],
     tests_require=['pytest'],
     install_requires=requirements,
+    extras_require={'plot': ['matplotlib', 'seaborn'], 'spacy': ['spacy>=3']},
     packages=find_packages(exclude=('tests', 'examples','htmlcov')),
+    package_data={'pubstomp': ['most_common.txt']},
 )
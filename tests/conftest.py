@@ -0,0 +1,41 @@
+""" Shared fixtures: the bundled short exports of arXiv records, and a
+GloVe engine trained on them once per test session.
+
+"""
+
+import glob
+import json
+import os
+
+import pytest
+
+from pubstomp.document import Document
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DATA_FNAMES = sorted(glob.glob(os.path.join(REPO_DIR, 'data', '*_short.json')))
+
+
+@pytest.fixture(scope='session')
+def records():
+    """ Every record of data/*_short.json. """
+    records = []
+    for fname in DATA_FNAMES:
+        with open(fname) as f:
+            records.extend(json.load(f))
+    return records
+
+
+@pytest.fixture
+def documents(records):
+    """ Fresh Documents of every record; a Document keeps the first
+    representation it is parsed into, so they are not shared between
+    tests that use different engines.
+
+    """
+    return [Document(record) for record in records]
+
+
+@pytest.fixture(scope='session')
+def glove_engine(records):
+    from pubstomp.similarity import GloveSimilarityEngine
+    return GloveSimilarityEngine([Document(record) for record in records])
@@ -0,0 +1,72 @@
+""" Tests of parsing OAI ListRecords pages in the harvester script. """
+
+import datetime
+import os
+import sys
+
+import pytest
+
+pytest.importorskip('pymongo')
+pytest.importorskip('requests')
+
+from conftest import REPO_DIR  # noqa: E402
+
+sys.path.insert(0, os.path.join(REPO_DIR, 'scripts'))
+import arxiv_get  # noqa: E402
+
+FIXTURE_FNAME = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'list_records.xml')
+
+
+@pytest.fixture
+def page():
+    with open(FIXTURE_FNAME, 'rb') as f:
+        return f.read()
+
+
+def test_parse_page(page):
+    records, resumption_token, complete_list_size = arxiv_get.parse_page(page)
+    assert resumption_token == '3785943|1001'
+    assert complete_list_size == 1459
+    assert [record['arxiv_id'] for record in records] == ['1001.2044', '1001.2050']
+
+    record = records[0]
+    assert record['header_date'] == datetime.datetime(2010, 1, 14)
+    assert record['title'] == 'Companion forms for unitary and symplectic groups'
+    assert record['creators'] == ['Gee, Toby', 'Geraghty, David']
+    assert record['subject'] == ['Mathematics - Number Theory', '11F33']
+    assert record['dates'] == [datetime.datetime(2010, 1, 13)]
+    assert len(record['description']) == 2
+    assert 'n>1' in record['description'][0]
+    assert records[1]['dates'] == [datetime.datetime(2010, 1, 14), datetime.datetime(2010, 2, 1)]
+
+
+def test_scan_resumption_token_matches_parse_page(page):
+    _, resumption_token, complete_list_size = arxiv_get.parse_page(page)
+    assert arxiv_get.scan_resumption_token(page) == (resumption_token, complete_list_size)
+
+
+def test_last_page(page):
+    last_page = page.replace(b'>3785943|1001</resumptionToken>', b'/>')
+    assert arxiv_get.scan_resumption_token(last_page) == (None, 1459)
+    records, resumption_token, complete_list_size = arxiv_get.parse_page(last_page)
+    assert len(records) == 2
+    assert resumption_token is None
+    assert complete_list_size == 1459
+
+
+def test_bad_resumption_token(page):
+    error_page = (b'<?xml version="1.0" encoding="UTF-8"?>'
+                  b'<OAI-PMH xmlns="http://www.openarchives.org/OAI/2.0/">'
+                  b'<error code="badResumptionToken">expired</error></OAI-PMH>')
+    with pytest.raises(arxiv_get.BadResumptionTokenError):
+        arxiv_get.scan_resumption_token(error_page)
+    with pytest.raises(arxiv_get.BadResumptionTokenError):
+        arxiv_get.parse_page(error_page)
+
+
+def test_no_records_match():
+    empty_page = (b'<?xml version="1.0" encoding="UTF-8"?>'
+                  b'<OAI-PMH xmlns="http://www.openarchives.org/OAI/2.0/">'
+                  b'<error code="noRecordsMatch">none</error></OAI-PMH>')
+    assert arxiv_get.parse_page(empty_page) == ([], None, None)
+    assert arxiv_get.scan_resumption_token(empty_page) == (None, None)
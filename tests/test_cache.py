@@ -0,0 +1,125 @@
+""" Tests of the persistent cache of parsed document vectors. """
+
+import numpy as np
+import pytest
+
+from pubstomp.cache import EmbeddingCache
+from pubstomp.document import Document
+from pubstomp.similarity import DummySimilarityEngine, SimilarityEngine
+
+
+class VectorEngine(SimilarityEngine):
+    """ An engine that parses each document into the vector of its
+    character counts of a few letters, and counts the calls.
+
+    """
+    LETTERS = 'aeiost'
+
+    def __init__(self):
+        self.num_parsed = 0
+
+    def parse_document(self, document):
+        self.num_parsed += 1
+        return np.array([document.abstract.count(letter) for letter in self.LETTERS], dtype=np.float32)
+
+    def fingerprint(self):
+        return 'vectorengine'
+
+
+def make_document(arxiv_id, abstract):
+    record = {'description': [abstract]}
+    if arxiv_id is not None:
+        record['arxiv_id'] = arxiv_id
+    return Document(record)
+
+
+def test_put_get_flush(tmp_path):
+    cache = EmbeddingCache(str(tmp_path), 'abc', buffer_size=10)
+    vectors = np.arange(12, dtype=np.float32).reshape(4, 3)
+    for ind, vector in enumerate(vectors):
+        cache.put(f'id{ind}', vector)
+    assert len(cache) == 4
+    # buffered vectors are readable, but not yet on disk
+    np.testing.assert_array_equal(cache.get('id2'), vectors[2])
+    assert len(EmbeddingCache(str(tmp_path), 'abc')) == 0
+
+    cache.flush()
+    assert not cache._pending
+    reopened = EmbeddingCache(str(tmp_path), 'abc')
+    assert len(reopened) == 4
+    for ind, vector in enumerate(vectors):
+        np.testing.assert_array_equal(reopened.get(f'id{ind}'), vector)
+    # flushing again with nothing pending writes nothing
+    cache.flush()
+    assert len(EmbeddingCache(str(tmp_path), 'abc')) == 4
+
+
+def test_put_flushes_full_buffer(tmp_path):
+    cache = EmbeddingCache(str(tmp_path), 'abc', buffer_size=2)
+    cache.put('id0', np.zeros(3))
+    cache.put('id1', np.ones(3))
+    assert not cache._pending
+    assert len(EmbeddingCache(str(tmp_path), 'abc')) == 2
+
+
+def test_context_manager_flushes(tmp_path):
+    with EmbeddingCache(str(tmp_path), 'abc') as cache:
+        cache.put('id0', np.zeros(3))
+    assert 'id0' in EmbeddingCache(str(tmp_path), 'abc')
+
+
+def test_none_id_is_not_cached(tmp_path):
+    cache = EmbeddingCache(str(tmp_path), 'abc')
+    cache.put(None, np.zeros(3))
+    assert len(cache) == 0
+    cache.flush()
+    assert len(EmbeddingCache(str(tmp_path), 'abc')) == 0
+    with pytest.raises(ValueError):
+        cache.put_many(['id0', None], np.zeros((2, 3)))
+
+
+def test_put_rejects_non_vectors(tmp_path):
+    cache = EmbeddingCache(str(tmp_path), 'abc')
+    with pytest.raises(TypeError):
+        cache.put('id0', {'words': ['a']})
+    with pytest.raises(TypeError):
+        cache.put('id0', np.zeros((2, 3)))
+    assert len(cache) == 0
+
+
+def test_torn_index_line_is_ignored(tmp_path):
+    cache = EmbeddingCache(str(tmp_path), 'abc')
+    cache.put_many(['id0', 'id1'], np.eye(2))
+    with open(cache._id_fname, 'ab') as f:
+        f.write(b'id2')
+    reopened = EmbeddingCache(str(tmp_path), 'abc')
+    assert len(reopened) == 2
+    reopened.put_many(['id2'], np.ones((1, 2)))
+    with open(cache._id_fname) as f:
+        assert f.read().splitlines() == ['id0', 'id1', 'id2']
+
+
+def test_parsed_uses_attached_cache(tmp_path):
+    engine = VectorEngine()
+    cache = EmbeddingCache.for_engine(str(tmp_path), engine)
+    assert engine.cache is cache
+
+    vector = make_document('id0', 'a test abstract').parsed(engine)
+    # a document without an arXiv ID is parsed, but not cached
+    make_document(None, 'another abstract').parsed(engine)
+    assert engine.num_parsed == 2
+    assert len(cache) == 1
+    cache.flush()
+
+    engine = VectorEngine()
+    EmbeddingCache.for_engine(str(tmp_path), engine)
+    np.testing.assert_array_equal(make_document('id0', 'a test abstract').parsed(engine), vector)
+    assert engine.num_parsed == 0
+
+
+def test_attach_cache_checks_fingerprint(tmp_path):
+    cache = EmbeddingCache(str(tmp_path), 'abc')
+    with pytest.raises(ValueError):
+        VectorEngine().attach_cache(cache)
+    with pytest.raises(NotImplementedError):
+        EmbeddingCache.for_engine(str(tmp_path), DummySimilarityEngine([]))
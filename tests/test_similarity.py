@@ -0,0 +1,117 @@
+""" Tests of the batched similarity kernels, saving and loading engines,
+and approximate nearest-neighbour search.
+
+"""
+
+import numpy as np
+import pytest
+
+from pubstomp.similarity import SimilarityEngine
+from pubstomp.similarity.similarity import blocked_dot, packed_dot, packed_size, unpack_triangle
+
+
+def pairwise_dot(matrix_a, matrix_b):
+    """ The reference result: one dot product per pair of rows. """
+    result = np.empty((matrix_a.shape[0], matrix_b.shape[0]))
+    for ind, row_a in enumerate(matrix_a):
+        for jnd, row_b in enumerate(matrix_b):
+            result[ind, jnd] = np.dot(row_a, row_b)
+    return result
+
+
+@pytest.fixture
+def matrices():
+    rng = np.random.default_rng(0)
+    return rng.standard_normal((23, 8)), rng.standard_normal((11, 8))
+
+
+@pytest.mark.parametrize('block_size', [1, 4, 1024])
+def test_blocked_dot_matches_pairs(matrices, block_size):
+    matrix_a, matrix_b = matrices
+    np.testing.assert_allclose(blocked_dot(matrix_a, matrix_b, block_size=block_size),
+                               pairwise_dot(matrix_a, matrix_b))
+    np.testing.assert_allclose(blocked_dot(matrix_a, block_size=block_size),
+                               pairwise_dot(matrix_a, matrix_a))
+
+
+@pytest.mark.parametrize('block_size', [1, 4, 1024])
+def test_packed_dot_matches_pairs(matrices, block_size):
+    matrix, _ = matrices
+    num_rows = len(matrix)
+    packed = packed_dot(matrix, block_size=block_size)
+    assert packed.shape == (packed_size(num_rows),)
+    expected = pairwise_dot(matrix, matrix)
+    np.testing.assert_allclose(unpack_triangle(packed, num_rows), expected)
+    # element [i, j] for j >= i is at i * num_rows - i * (i - 1) // 2 + (j - i)
+    for ind in range(num_rows):
+        for jnd in range(ind, num_rows):
+            position = ind * num_rows - ind * (ind - 1) // 2 + (jnd - ind)
+            assert packed[position] == pytest.approx(expected[ind, jnd])
+
+
+def test_sparse_kernels_match_pairs(matrices):
+    sparse = pytest.importorskip('scipy.sparse')
+    matrix, _ = matrices
+    matrix = np.where(matrix > 0.5, 1.0, 0.0)
+    expected = pairwise_dot(matrix, matrix)
+    np.testing.assert_allclose(blocked_dot(sparse.csr_matrix(matrix), block_size=4), expected)
+    np.testing.assert_allclose(unpack_triangle(packed_dot(sparse.csr_matrix(matrix), block_size=4), len(matrix)),
+                               expected)
+
+
+def test_engine_matrices_match_pairs(glove_engine, documents):
+    documents = documents[:40]
+    # the base class computes the matrices with one get_similarity call per pair
+    expected = SimilarityEngine.get_similarity_matrix(glove_engine, documents)
+    np.testing.assert_allclose(glove_engine.get_similarity_matrix(documents), expected, rtol=1e-5, atol=1e-6)
+    np.testing.assert_allclose(glove_engine.get_similarity_matrix(documents[:15], documents[15:]),
+                               expected[:15, 15:], rtol=1e-5, atol=1e-6)
+    packed = glove_engine.get_packed_similarity_matrix(documents)
+    np.testing.assert_allclose(packed, SimilarityEngine.get_packed_similarity_matrix(glove_engine, documents),
+                               rtol=1e-5, atol=1e-6)
+    np.testing.assert_allclose(unpack_triangle(packed, len(documents)), expected, rtol=1e-5, atol=1e-6)
+
+
+def test_save_load_round_trip(glove_engine, records, tmp_path):
+    from pubstomp.document import Document
+    from pubstomp.similarity import GloveSimilarityEngine
+
+    path = str(tmp_path / 'glove')
+    glove_engine.save(path)
+    loaded = GloveSimilarityEngine.load(path)
+    assert loaded.fingerprint() == glove_engine.fingerprint()
+    assert loaded.model_path == path
+    for record in records[:20]:
+        np.testing.assert_array_equal(loaded.parse_document(Document(record)),
+                                      glove_engine.parse_document(Document(record)))
+
+    # saving over an existing model replaces it, and saving the loaded
+    # engine again keeps the fingerprint, including its trainer
+    loaded.save(path)
+    reloaded = GloveSimilarityEngine.load(path, mmap=False)
+    assert reloaded.fingerprint() == glove_engine.fingerprint()
+    assert reloaded.trainer is not None
+
+
+def test_load_rejects_other_engine(glove_engine, tmp_path):
+    from pubstomp.similarity import WordOverlapSimilarityEngine
+
+    path = str(tmp_path / 'glove')
+    glove_engine.save(path)
+    with pytest.raises(ValueError):
+        WordOverlapSimilarityEngine.load(path)
+
+
+def test_ivf_recall(glove_engine, documents):
+    from pubstomp.similarity import IVFIndex, NearestNeighbourIndex
+    from pubstomp.similarity.ivf import recall_at_k
+
+    arxiv_ids = [document.arxiv_id for document in documents]
+    vectors = np.vstack(glove_engine.parse_documents(documents))
+    exact = NearestNeighbourIndex(glove_engine, arxiv_ids, vectors)
+    approximate = IVFIndex(glove_engine, arxiv_ids, vectors, num_probe=8)
+    assert recall_at_k(approximate, exact, vectors, k=10, exclude=arxiv_ids) >= 0.85
+
+    # probing every list is an exact search
+    approximate.num_probe = len(approximate.centroids)
+    assert recall_at_k(approximate, exact, vectors[:50], k=10, exclude=arxiv_ids[:50]) == pytest.approx(1.0)
@@ -0,0 +1,73 @@
+""" Tests that a snapshot reads back the records it was written from,
+and that statistics computed from it agree with those accumulated
+record by record.
+
+"""
+
+import pytest
+
+from pubstomp.document import Document
+from pubstomp.snapshot import CHUNK_ROWS, Snapshot, SnapshotWriter, export_records
+from pubstomp.stats import CorpusStats
+
+
+@pytest.fixture
+def snapshot(records, tmp_path):
+    path = str(tmp_path / 'snapshot')
+    assert export_records(records, path) == len(records)
+    return Snapshot(path)
+
+
+def test_snapshot_round_trip(records, snapshot):
+    assert len(snapshot) == len(records)
+    for ind, record in enumerate(records):
+        document = Document(record)
+        assert snapshot.arxiv_id(ind) == document.arxiv_id
+        assert snapshot.abstract(ind) == document.abstract
+        assert snapshot.title(ind) == (document.title or '')
+        assert snapshot.subjects_of(ind) == list(document.subjects)
+        assert len(snapshot.dates_of(ind)) == len(record['dates'])
+
+
+def test_snapshot_reads_rows_across_chunks(records, tmp_path):
+    path = str(tmp_path / 'snapshot')
+    with SnapshotWriter(path, chunk_rows=7) as writer:
+        writer.add_many(records)
+    snapshot = Snapshot(path)
+    # out of order, so that consecutive reads hit different chunks
+    for ind in list(range(len(records)))[::-13] + [0, 6, 7, len(records) - 1]:
+        assert snapshot.abstract(ind) == Document(records[ind]).abstract
+    assert CHUNK_ROWS > 7
+
+
+def test_stats_from_snapshot_match_records(records, snapshot):
+    expected = CorpusStats()
+    assert expected.add_many(records) == len(records)
+    stats = CorpusStats.from_snapshot(snapshot)
+
+    assert stats.num_documents == expected.num_documents
+    assert stats.subject_counts == expected.subject_counts
+    assert stats.year_counts == expected.year_counts
+    assert dict(stats.subject_year_counts) == dict(expected.subject_year_counts)
+    assert dict(stats.postings) == dict(expected.postings)
+    assert stats.arxiv_ids == expected.arxiv_ids
+
+    assert snapshot.subject_counts() == dict(expected.subject_counts)
+    assert snapshot.year_counts() == dict(sorted(expected.year_counts.items()))
+    for subject in expected.subject_counts:
+        rows = snapshot.rows_with_subject(subject)
+        assert [snapshot.arxiv_id(row) for row in rows] == expected.documents_with_subject(subject)
+
+
+def test_stats_save_load(records, tmp_path):
+    path = str(tmp_path / 'stats.json')
+    stats = CorpusStats(path=path)
+    stats.add_many(records[:100])
+    stats.save()
+    stats.add_many(records)
+    stats.commit()
+
+    loaded = CorpusStats.load(path)
+    assert loaded.num_documents == len(records)
+    assert loaded.subject_counts == stats.subject_counts
+    assert dict(loaded.postings) == dict(stats.postings)